@@ -1,6 +1,6 @@
 // src/hooks/useTripFeasibility.js
-import { useEffect, useState } from "react";
-import { sortStationsByRouteProgress } from "../utils/tripUtils";
+import { useEffect, useMemo, useState } from "react";
+import { routeProgressKm, sortStationsByRouteProgress } from "../utils/tripUtils";
 
 export default function useTripFeasibility({
   selectedVehicle,
@@ -11,6 +11,12 @@ export default function useTripFeasibility({
   const [feasible, setFeasible] = useState(null);
   const [reason, setReason] = useState("");
 
+  // Progress comes from the server; only re-sort when the station list changes
+  const sortedStations = useMemo(
+    () => sortStationsByRouteProgress(stations || []),
+    [stations]
+  );
+
   useEffect(() => {
     if (!selectedVehicle || !routeKm) {
       setFeasible(null);
@@ -32,10 +38,8 @@ export default function useTripFeasibility({
     let remainingRange = maxRangeKm;
     let distanceCovered = 0;
 
-    const sortedStations = sortStationsByRouteProgress(stations);
-
     for (let st of sortedStations) {
-      const gap = st.distanceFromStartKm - distanceCovered;
+      const gap = routeProgressKm(st) - distanceCovered;
 
       if (gap > remainingRange) {
         setFeasible(false);
@@ -60,7 +64,7 @@ export default function useTripFeasibility({
       setFeasible(false);
       setReason("Final segment unreachable even with charging.");
     }
-  }, [selectedVehicle, batteryPercent, routeKm, stations]);
+  }, [selectedVehicle, batteryPercent, routeKm, sortedStations]);
 
   return { feasible, reason };
 }
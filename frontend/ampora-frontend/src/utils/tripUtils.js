@@ -25,9 +25,16 @@ export function routeDistanceKm(route) {
   );
 }
 
+/* ================= ROUTE PROGRESS ================= */
+// Distance from the route start to the station's foot point on the route,
+// as computed by the ml-service (distance_from_start_km).
+export function routeProgressKm(station) {
+  return station.distanceFromStartKm ?? station.distance_from_start_km ?? Number.MAX_VALUE;
+}
+
 /* ================= SORT STATIONS ALONG ROUTE ================= */
 export function sortStationsByRouteProgress(stations) {
   return [...stations].sort(
-    (a, b) => a.distanceToRouteKm - b.distanceToRouteKm
+    (a, b) => routeProgressKm(a) - routeProgressKm(b)
   );
 }
@@ -1,26 +1,43 @@
 # ml-service/app.py
-import os
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 from dotenv import load_dotenv
 
-from models import db, Station, Charger
-from enhanced_ev_planner import EnhancedEVPlanner
-
+# before the project imports: several of them read their settings from the environment at import
 load_dotenv()
 
-def _pg_uri():
-    host = os.getenv("POSTGRES_HOST", "localhost")
-    port = os.getenv("POSTGRES_PORT", "5432")
-    dbn  = os.getenv("POSTGRES_DB", "ampora")
-    usr  = os.getenv("POSTGRES_USER", "ampora_user")
-    pwd  = os.getenv("POSTGRES_PASSWORD", "a")
-    return f"postgresql+psycopg2://{usr}:{pwd}@{host}:{port}/{dbn}"
+from models import db, Station, Charger
+from services.activity import (
+    ACTIVITY_BATCH_MAX,
+    ACTIVITY_BATCH_WAIT_MS,
+    ACTIVITY_MODEL_PATH,
+    ActivityRequestError,
+    parse_activity_request,
+)
+from services.admin import ADMIN_REQUIRED, admin_allowed
+from services.metrics import CONTENT_TYPE, REGISTRY, SERVER_TIMING, begin_request, current_request, end_request, stage
+from services.microbatch import MicroBatcher
+from services.profiling import collapsed_text, get_profiler, track
+from services.route_api import (
+    BATCH_CONCURRENCY,
+    RouteRequestError,
+    batch_error,
+    batch_result,
+    parse_batch_request,
+    parse_plan_request,
+    parse_route_request,
+    plan_response,
+    route_response,
+)
+from services.routing import CircuitOpenError
+from shared import get_activity_model, get_planner, init_db
 
 app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = _pg_uri()
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+init_db(app)
 
 # CORS for local dev
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
@@ -31,61 +48,235 @@ def add_cors_headers(response):
     response.headers.add("Access-Control-Allow-Methods", "GET,POST,PUT,DELETE,OPTIONS")
     return response
 
-db.init_app(app)
-planner = EnhancedEVPlanner(max_station_distance_km=5)  # 5km band from route polyline
+# Per-request stage timings (services.metrics): Prometheus on /metrics, this request's in Server-Timing
+@app.before_request
+def begin_request_metrics():
+    begin_request()
+
+@app.after_request
+def end_request_metrics(response):
+    req = current_request()
+    if req is not None:
+        end_request(req, request.url_rule.rule if request.url_rule else "unmatched", request.method,
+                    response.status_code)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = req.server_timing()
+    return response
+
+# Opt-in profiling (services.profiling): sampled or slow requests are saved for /debug/profiles
+profiler = get_profiler()
+
+@app.before_request
+def begin_profile():
+    capture = profiler.begin(request.method, request.path, request.query_string.decode())
+    if capture is not None:
+        g.profile = (capture, profiler.start_thread(capture))
+
+def _end_profile(status):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        capture, handle = profile
+        profiler.stop_thread(capture, handle)
+        body = request.get_json(silent=True) if profiler.keep_body else None
+        profiler.end(capture, status, body, current_request())
+
+@app.after_request
+def end_profile(response):
+    _end_profile(response.status_code)
+    return response
+
+@app.teardown_request
+def abandon_profile(exc):
+    # after_request handlers are skipped when the view raised
+    _end_profile(500)
+
+planner = get_planner()
+# Bounds concurrent upstream routing calls across all batch requests
+_batch_pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="route-batch")
+
+# Activity model from model/model.ipynb; /api/activity answers 503 until it exists
+activity_model = get_activity_model()
+# Single-row requests from all workers share classifier calls
+activity_batcher = (
+    MicroBatcher(activity_model.predict, ACTIVITY_BATCH_MAX, ACTIVITY_BATCH_WAIT_MS, name="activity-batch")
+    if activity_model else None
+)
 
 @app.get("/api/health")
 def health():
-    return {"ok": True, "time": datetime.utcnow().isoformat()}
+    return {
+        "ok": True,
+        "time": datetime.utcnow().isoformat(),
+        "route_cache": planner.route_cache.stats(),
+        "osrm": planner.osrm.stats(),
+        "coalescing": planner.flights.stats(),
+        "activity": {"batching": activity_batcher.stats(), **activity_model.info()} if activity_model else None,
+        "profiling": profiler.info(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics of this process: request and stage histograms, cache / upstream / corridor counters."""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.get("/debug/profiles")
+def debug_profiles():
+    """Saved profiling captures, newest first; needs the admin token, 404 while profiling is off."""
+    if not admin_allowed(request.headers.get("Authorization")):
+        return jsonify({"success": False, "error": ADMIN_REQUIRED}), 403
+    if not profiler.enabled:
+        return jsonify({"success": False, "error": "Profiling is off (PROFILE_SAMPLE_RATE / PROFILE_SLOW_MS)"}), 404
+    return jsonify({"success": True, **profiler.info(), "captures": profiler.captures()})
+
+@app.get("/debug/profiles/<capture_id>")
+def debug_profile(capture_id):
+    """One capture: ?format=json (default), collapsed (flame graph input) or pstats (cprofile mode)."""
+    if not admin_allowed(request.headers.get("Authorization")):
+        return jsonify({"success": False, "error": ADMIN_REQUIRED}), 403
+    if not profiler.enabled:
+        return jsonify({"success": False, "error": "Profiling is off (PROFILE_SAMPLE_RATE / PROFILE_SLOW_MS)"}), 404
+    fmt = request.args.get("format", "json")
+    if fmt == "pstats":
+        path = profiler.capture_path(capture_id, ".prof")
+        if path is None:
+            return jsonify({"success": False, "error": "No pstats file for this capture"}), 404
+        return send_file(path, mimetype="application/octet-stream", as_attachment=True)
+    record = profiler.capture(capture_id)
+    if record is None:
+        return jsonify({"success": False, "error": "Unknown capture"}), 404
+    if fmt == "collapsed":
+        return Response(collapsed_text(record), mimetype="text/plain")
+    return jsonify(record)
+
+@app.post("/api/stations/invalidate")
+def api_stations_invalidate():
+    """Force the next route request to reload stations (e.g. after an admin edit); needs the admin token."""
+    if not admin_allowed(request.headers.get("Authorization")):
+        return jsonify({"success": False, "error": ADMIN_REQUIRED}), 403
+    planner.station_snapshot.invalidate()
+    return jsonify({"success": True, "snapshot": planner.station_snapshot.stats()})
 
 @app.post("/api/route")
 def api_route():
-    """
-    Body:
-    {
-      "start": {"lat": <float>, "lng": <float>},
-      "end": {"lat": <float>, "lng": <float>},
-      "stops": [ {"lat":..., "lng":...}, ... ]  # optional
-    }
-    """
-    data = request.get_json(force=True)
-    start = data.get("start")
-    end   = data.get("end")
-    stops = data.get("stops", [])
+    """Corridor stations along OSRM routes; body documented in services.route_api.parse_route_request."""
+    try:
+        req = parse_route_request(request.get_json(force=True))
+    except RouteRequestError as ex:
+        return jsonify({"success": False, "error": str(ex)}), 400
+
+    try:
+        # Routes via OSRM (with waypoints) + stations near each alternative, matched in one pass;
+        # identical requests already in flight are coalesced into one computation
+        routes, near = planner.route_corridor(req["start"], req["end"], waypoints=req["waypoints"], alternatives=2)
+        if not routes:
+            return jsonify({"success": False, "error": "No routes returned"}), 404
+
+        # Optional: build a folium map file (commented by default)
+        # map_name = planner.build_map(req["start"], req["end"], routes, near)
 
-    if not start or not end:
-        return jsonify({"success": False, "error": "start {lat,lng} and end {lat,lng} required"}), 400
+        payload = route_response(routes, near, req)
+        with stage("serialize"):
+            body = jsonify(payload)
+        return body
+    except CircuitOpenError as ex:
+        return jsonify({"success": False, "error": f"Routing backend unavailable: {ex}"}), 503
+    except Exception as ex:
+        return jsonify({"success": False, "error": str(ex)}), 500
 
-    s = (float(start["lat"]), float(start["lng"]))
-    e = (float(end["lat"]), float(end["lng"]))
-    waypoints = [(float(p["lat"]), float(p["lng"])) for p in stops if p and "lat" in p and "lng" in p]
+@app.post("/api/plan")
+def api_plan():
+    """
+    Minimum-time charging stops for a trip; body documented in
+    services.route_api.parse_plan_request. 422 when no plan reaches the destination.
+    """
+    try:
+        req = parse_plan_request(request.get_json(force=True))
+    except RouteRequestError as ex:
+        return jsonify({"success": False, "error": str(ex)}), 400
 
     try:
-        # 1) Routes via OSRM (with waypoints)
-        routes = planner.get_routes_from_osrm(s, e, waypoints=waypoints, alternatives=2)
+        routes, near = planner.route_corridor(req["start"], req["end"], waypoints=req["waypoints"], alternatives=2)
         if not routes:
             return jsonify({"success": False, "error": "No routes returned"}), 404
+        if req["route_index"] >= len(routes):
+            return jsonify({"success": False, "error": f"route_index must be below {len(routes)}"}), 400
 
-        # 2) Load stations once (from DB) and compute proximity to the first (shortest) route
+        route = routes[req["route_index"]]
+        plan = planner.plan_charging_stops(route, near[req["route_index"]], req)
+        payload = plan_response(route, plan, req)
+        with stage("serialize"):
+            body = jsonify(payload)
+        return body, (200 if plan["feasible"] else 422)
+    except CircuitOpenError as ex:
+        return jsonify({"success": False, "error": f"Routing backend unavailable: {ex}"}), 503
+    except Exception as ex:
+        return jsonify({"success": False, "error": str(ex)}), 500
+
+def _batch_job(index, req, stations):
+    try:
+        routes, near = planner.route_corridor(
+            req["start"], req["end"], waypoints=req["waypoints"], alternatives=2, stations=stations
+        )
+        return batch_result(index, routes, near, req)
+    except CircuitOpenError as ex:
+        return batch_error(index, 503, f"Routing backend unavailable: {ex}")
+    except Exception as ex:
+        return batch_error(index, 500, str(ex))
+
+@app.post("/api/routes/batch")
+def api_routes_batch():
+    """
+    Corridor stations for many trips; body documented in services.route_api.parse_batch_request.
+    Every job is matched against one station snapshot. Results come back in job order,
+    or with "stream": true as NDJSON lines (one per job, with its index) as they finish.
+    """
+    try:
+        jobs, stream = parse_batch_request(request.get_json(force=True))
+    except RouteRequestError as ex:
+        return jsonify({"success": False, "error": str(ex)}), 400
+
+    try:
         stations = planner.load_stations()
-        near = planner.stations_near_route(routes[0]["path"], stations)
-
-        # 3) Optional: build a folium map file (commented by default)
-        # map_name = planner.build_map(s, e, routes, near)
-
-        return jsonify({
-            "success": True,
-            "routes": [{
-                "distance_km": round(r["distance_km"], 1),
-                "duration_min": round(r["duration_min"], 0),
-                "path": r["path"],  # [ [lat,lon], ... ]
-            } for r in routes],
-            "nearby_stations": near[:60],
-            # "map_file": map_name
-        })
     except Exception as ex:
         return jsonify({"success": False, "error": str(ex)}), 500
 
+    # each job runs in a copy of this request's context, so its stage timings (and a profiled
+    # request's capture) land on this request rather than being dropped in the pool thread
+    futures = [
+        _batch_pool.submit(contextvars.copy_context().run, track, _batch_job, i, req, stations)
+        for i, req in enumerate(jobs)
+    ]
+    if stream:
+        def lines():
+            for fut in as_completed(futures):
+                yield json.dumps(fut.result(), separators=(",", ":")) + "\n"
+        return Response(lines(), mimetype="application/x-ndjson")
+
+    return jsonify({"success": True, "results": [fut.result() for fut in futures]})
+
+@app.post("/api/activity")
+def api_activity():
+    """
+    Recommended activities while charging; body documented in services.activity.parse_activity_request.
+    A single row answers {"activities": [...]}, {"rows": [...]} answers {"results": [[...], ...]}.
+    """
+    if activity_model is None:
+        return jsonify({"success": False, "error": f"Activity model not found at {ACTIVITY_MODEL_PATH}"}), 503
+    try:
+        rows, many = parse_activity_request(request.get_json(force=True))
+    except ActivityRequestError as ex:
+        return jsonify({"success": False, "error": str(ex)}), 400
+
+    try:
+        if many:
+            return jsonify({"success": True, "results": activity_model.predict(rows)})
+        # on-grid rows come straight from the lookup table; the rest share classifier calls
+        labels = activity_model.lookup(rows)[0]
+        if labels is None:
+            labels = activity_batcher.submit(rows[0])
+        return jsonify({"success": True, "activities": labels})
+    except Exception as ex:
+        return jsonify({"success": False, "error": str(ex)}), 500
 
 if __name__ == "__main__":
     with app.app_context():
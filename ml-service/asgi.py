@@ -0,0 +1,428 @@
+# ml-service/asgi.py
+"""
+ASGI entry point serving the ml-service API on an event loop:
+
+    uvicorn asgi:app --host 127.0.0.1 --port 8000
+
+Upstream routing is awaited (OSRM through AsyncOSRMClient, or Google Directions
+through GoogleEVPlanner), so a single process can hold hundreds of route
+requests while they wait on I/O. Station loading (DB) and the CPU-heavy
+decode / proximity / simplify / serialization work run in a bounded thread
+pool. The planner (station snapshot, route cache) and the activity model are
+set up by shared.py exactly as for the Flask app, without importing app.py.
+
+ROUTING_BACKEND picks the default backend ("osrm" or "google"); a request can
+override it with "backend" in the body. CPU_WORKERS sizes the thread pool.
+
+/api/activity predictions for single rows are micro-batched
+(services.microbatch) into shared classifier calls in the same pool.
+"""
+import asyncio
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.datastructures import MutableHeaders
+from dotenv import load_dotenv
+
+# .env has to be loaded before importing shared and services, whose settings are read at import
+load_dotenv()
+
+from enhanced_ev_planner_google import GoogleEVPlanner
+from services.route_api import (
+    BATCH_CONCURRENCY,
+    RouteRequestError,
+    batch_error,
+    batch_result,
+    parse_batch_request,
+    parse_plan_request,
+    parse_route_request,
+    plan_response,
+    route_response,
+)
+from services.activity import (
+    ACTIVITY_BATCH_MAX,
+    ACTIVITY_BATCH_WAIT_MS,
+    ACTIVITY_MODEL_PATH,
+    ActivityRequestError,
+    parse_activity_request,
+)
+from services.admin import ADMIN_REQUIRED, admin_allowed
+from services.cache import route_cache_key
+from services.metrics import (
+    CONTENT_TYPE,
+    REGISTRY,
+    SERVER_TIMING,
+    begin_request,
+    current_request,
+    end_request,
+    stage,
+)
+from services.routing import AsyncOSRMClient, CircuitOpenError
+from services.microbatch import AsyncMicroBatcher
+from services.profiling import collapsed_text, get_profiler, track
+from services.singleflight import AsyncSingleFlight
+from shared import get_activity_model, get_db_app, get_planner
+
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "osrm")
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(8, os.cpu_count() or 2))))
+GOOGLE_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY") or os.getenv("VITE_GOOGLE_MAPS_API_KEY")
+
+# NumPy releases the GIL in the heavy array ops, so threads overlap well here
+# and avoid pickling the station set into worker processes.
+_cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="ampora-cpu")
+planner = get_planner()
+activity_model = get_activity_model()
+_db_app = get_db_app()
+_backends: Dict[str, Any] = {}
+# identical (backend, snapped start/end/stops) requests in flight share one computation
+_flights = AsyncSingleFlight()
+profiler = get_profiler()
+
+
+async def run_cpu(fn: Callable, *args: Any) -> Any:
+    # run in a copy of the caller's context so stage timings (and a profiled
+    # request's capture) land on its request
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, ctx.run, track, fn, *args)
+
+
+# single-row /api/activity requests share one classifier call in the CPU pool
+_activity_batcher = (
+    AsyncMicroBatcher(lambda rows: run_cpu(activity_model.predict, rows), ACTIVITY_BATCH_MAX, ACTIVITY_BATCH_WAIT_MS)
+    if activity_model else None
+)
+
+
+def _load_stations():
+    # load_stations / the snapshot fingerprint use Flask-SQLAlchemy's session
+    with _db_app.app_context():
+        return planner.load_stations()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    _backends["osrm"] = AsyncOSRMClient()
+    if GOOGLE_API_KEY:
+        _backends["google"] = GoogleEVPlanner(GOOGLE_API_KEY, max_station_distance_km=planner.max_station_distance_km)
+    try:
+        yield
+    finally:
+        await _backends["osrm"].aclose()
+        if "google" in _backends:
+            await _backends["google"]._client.aclose()
+        _backends.clear()
+
+
+class RequestMetricsMiddleware:
+    """
+    Per-request stage timings (services.metrics): observed when the response
+    starts and sent back in a Server-Timing header. Plain ASGI, so the
+    endpoint runs in this task's context and sees the request's record.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        req = begin_request()
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                end_request(req, getattr(route, "path", "unmatched"), scope["method"], message["status"])
+                if SERVER_TIMING:
+                    MutableHeaders(scope=message).append("Server-Timing", req.server_timing())
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in profiling (services.profiling): profiles the CPU-pool jobs of a
+    sampled or possibly slow request and saves the capture, with the request
+    body (kept aside as it is received) if PROFILE_KEEP_BODY is on.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        capture = profiler.begin(scope["method"], scope["path"], scope["query_string"].decode("latin-1"))
+        if capture is None:
+            return await self.app(scope, receive, send)
+        chunks: List[bytes] = []
+        status = 500
+
+        async def receive_body() -> Dict[str, Any]:
+            message = await receive()
+            if message["type"] == "http.request" and profiler.keep_body:
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def send_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_body, send_status)
+        finally:
+            try:
+                body = json.loads(b"".join(chunks)) if chunks else None
+            except ValueError:
+                body = None
+            profiler.end(capture, status, body, current_request())
+
+
+app = FastAPI(title="Ampora ml-service", lifespan=lifespan)
+# added first, so it runs inside RequestMetricsMiddleware and sees the request's timings
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
+)
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    return JSONResponse({"success": False, "error": message}, status_code=status)
+
+
+def _json_body(fn: Callable, *args: Any) -> bytes:
+    payload = fn(*args)  # route_response times its own "simplify" stage
+    with stage("serialize"):
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+
+async def _json_response(fn: Callable, *args: Any, status: int = 200) -> Response:
+    """fn(*args) as a JSON response, built and encoded in the CPU pool."""
+    return Response(await run_cpu(_json_body, fn, *args), status_code=status, media_type="application/json")
+
+
+def _backend(body: Dict[str, Any]) -> str:
+    backend = body.get("backend", ROUTING_BACKEND)
+    if backend not in _backends:
+        raise RouteRequestError(f"backend must be one of {sorted(_backends)}")
+    return backend
+
+
+def _coalesced(req: Dict[str, Any], backend: str, stations=None):
+    key = route_cache_key(backend, req["start"], req["end"], req["waypoints"])
+    return _flights.do(key, lambda: _corridor(req, backend, stations))
+
+
+async def _fetch_routes(req: Dict[str, Any], backend: str) -> List[Dict[str, Any]]:
+    """Await the upstream router, then decode in the CPU pool."""
+    if backend == "google":
+        dtos = await _backends["google"].get_routes_from_google(req["start"], req["end"], req["waypoints"])
+        return await run_cpu(planner.route_entries, [(r.distance_km, r.duration_min, r.path) for r in dtos])
+
+    data = await planner.aget_routes_from_osrm(
+        _backends["osrm"], req["start"], req["end"], waypoints=req["waypoints"], alternatives=2
+    )
+    return await run_cpu(planner.routes_from_osrm_json, data)
+
+
+async def _corridor(req: Dict[str, Any], backend: str, stations=None):
+    """
+    (routes, stations near each route); upstream I/O and the station snapshot
+    run concurrently unless an already loaded snapshot is passed.
+    """
+    if stations is None:
+        routes, stations = await asyncio.gather(_fetch_routes(req, backend), run_cpu(_load_stations))
+    else:
+        routes = await _fetch_routes(req, backend)
+    if not routes:
+        return routes, []
+    return routes, await run_cpu(planner.stations_near_routes, [r["path"] for r in routes], stations)
+
+
+@app.get("/api/health")
+async def health():
+    return {
+        "ok": True,
+        "time": datetime.utcnow().isoformat(),
+        "backends": sorted(_backends),
+        "route_cache": planner.route_cache.stats(),
+        "osrm": _backends["osrm"].stats() if "osrm" in _backends else None,
+        "coalescing": _flights.stats(),
+        "activity": {"batching": _activity_batcher.stats(), **activity_model.info()} if activity_model else None,
+        "profiling": profiler.info(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of this process (services.metrics)."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+_PROFILING_OFF = "Profiling is off (PROFILE_SAMPLE_RATE / PROFILE_SLOW_MS)"
+
+
+@app.get("/debug/profiles")
+async def debug_profiles(request: Request):
+    """Saved profiling captures, newest first; needs the admin token, 404 while profiling is off."""
+    if not admin_allowed(request.headers.get("authorization")):
+        return _error(403, ADMIN_REQUIRED)
+    if not profiler.enabled:
+        return _error(404, _PROFILING_OFF)
+    return {"success": True, **profiler.info(), "captures": await run_cpu(profiler.captures)}
+
+
+@app.get("/debug/profiles/{capture_id}")
+async def debug_profile(request: Request, capture_id: str, format: str = "json"):
+    """One capture: ?format=json (default), collapsed (flame graph input) or pstats (cprofile mode)."""
+    if not admin_allowed(request.headers.get("authorization")):
+        return _error(403, ADMIN_REQUIRED)
+    if not profiler.enabled:
+        return _error(404, _PROFILING_OFF)
+    if format == "pstats":
+        path = profiler.capture_path(capture_id, ".prof")
+        if path is None:
+            return _error(404, "No pstats file for this capture")
+        return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
+    record = await run_cpu(profiler.capture, capture_id)
+    if record is None:
+        return _error(404, "Unknown capture")
+    if format == "collapsed":
+        return Response(collapsed_text(record), media_type="text/plain")
+    return record
+
+
+@app.post("/api/stations/invalidate")
+async def api_stations_invalidate(request: Request):
+    if not admin_allowed(request.headers.get("authorization")):
+        return _error(403, ADMIN_REQUIRED)
+    planner.station_snapshot.invalidate()
+    return {"success": True, "snapshot": planner.station_snapshot.stats()}
+
+
+@app.post("/api/route")
+async def api_route(request: Request):
+    """Same contract as the Flask /api/route, plus an optional "backend": "osrm" | "google"."""
+    try:
+        body = await request.json()
+        req = parse_route_request(body)
+        backend = _backend(body)
+    except (RouteRequestError, ValueError) as ex:
+        return _error(400, str(ex))
+
+    try:
+        routes, near = await _coalesced(req, backend)
+        if not routes:
+            return _error(404, "No routes returned")
+        return await _json_response(route_response, routes, near, req)
+    except CircuitOpenError as ex:
+        return _error(503, f"Routing backend unavailable: {ex}")
+    except Exception as ex:
+        return _error(500, str(ex))
+
+
+@app.post("/api/plan")
+async def api_plan(request: Request):
+    """Same contract as the Flask /api/plan, plus an optional "backend"."""
+    try:
+        body = await request.json()
+        req = parse_plan_request(body)
+        backend = _backend(body)
+    except (RouteRequestError, ValueError) as ex:
+        return _error(400, str(ex))
+
+    try:
+        routes, near = await _coalesced(req, backend)
+        if not routes:
+            return _error(404, "No routes returned")
+        if req["route_index"] >= len(routes):
+            return _error(400, f"route_index must be below {len(routes)}")
+
+        route = routes[req["route_index"]]
+        plan = await run_cpu(planner.plan_charging_stops, route, near[req["route_index"]], req)
+        return await _json_response(plan_response, route, plan, req, status=200 if plan["feasible"] else 422)
+    except CircuitOpenError as ex:
+        return _error(503, f"Routing backend unavailable: {ex}")
+    except Exception as ex:
+        return _error(500, str(ex))
+
+
+@app.post("/api/routes/batch")
+async def api_routes_batch(request: Request):
+    """
+    Same contract as the Flask /api/routes/batch, plus an optional "backend".
+    Jobs share one station snapshot; at most BATCH_CONCURRENCY of a batch's
+    jobs wait on the routing backend at once.
+    """
+    try:
+        body = await request.json()
+        jobs, stream = parse_batch_request(body)
+        backend = _backend(body)
+    except (RouteRequestError, ValueError) as ex:
+        return _error(400, str(ex))
+
+    try:
+        stations = await run_cpu(_load_stations)
+    except Exception as ex:
+        return _error(500, str(ex))
+
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def job(index: int, req: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            async with limit:
+                routes, near = await _coalesced(req, backend, stations)
+            return await run_cpu(batch_result, index, routes, near, req)
+        except CircuitOpenError as ex:
+            return batch_error(index, 503, f"Routing backend unavailable: {ex}")
+        except Exception as ex:
+            return batch_error(index, 500, str(ex))
+
+    tasks = [asyncio.ensure_future(job(i, req)) for i, req in enumerate(jobs)]
+    if stream:
+        async def lines():
+            try:
+                for done in asyncio.as_completed(tasks):
+                    yield json.dumps(await done, separators=(",", ":")) + "\n"
+            finally:
+                for t in tasks:
+                    t.cancel()
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return {"success": True, "results": await asyncio.gather(*tasks)}
+
+
+@app.post("/api/activity")
+async def api_activity(request: Request):
+    """Same contract as the Flask /api/activity."""
+    if activity_model is None:
+        return _error(503, f"Activity model not found at {ACTIVITY_MODEL_PATH}")
+    try:
+        rows, many = parse_activity_request(await request.json())
+    except (ActivityRequestError, ValueError) as ex:
+        return _error(400, str(ex))
+
+    try:
+        if many:
+            return {"success": True, "results": await run_cpu(activity_model.predict, rows)}
+        labels = activity_model.lookup(rows)[0]
+        if labels is None:
+            labels = await _activity_batcher.submit(rows[0])
+        return {"success": True, "activities": labels}
+    except Exception as ex:
+        return _error(500, str(ex))
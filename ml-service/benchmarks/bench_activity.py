@@ -0,0 +1,101 @@
+# ml-service/benchmarks/bench_activity.py
+"""
+Activity prediction under concurrent single-row requests: per-request predict, micro-batching, lookup table.
+
+Each of --clients threads sends --requests rows back to back (rows taken
+from model/ev_activity_data_v2.csv) and the script reports throughput and
+p50/p99 latency. "per-request" calls ActivityModel.predict on one row per
+request, as the notebook's predict_activity did; "micro-batched" goes through
+the MicroBatcher the Flask app uses; "lookup table" reads the ActivityTable
+built by build_activity_table.py, when there is one. Checks all give the
+same labels.
+
+Needs a model package saved by model/model.ipynb.
+
+Usage (from ml-service/):
+    python benchmarks/bench_activity.py --model model/ev_recommendation_model.pkl --clients 1 8 32
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.activity import (  # noqa: E402
+    ACTIVITY_MODEL_PATH,
+    ACTIVITY_TABLE_PATH,
+    ActivityModel,
+    ActivityTable,
+    parse_activity_row,
+)
+from services.microbatch import MicroBatcher  # noqa: E402
+
+DATA_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model", "ev_activity_data_v2.csv")
+
+
+def run_clients(call, rows, clients, per_client):
+    """(labels per request, latencies in ms, wall seconds) for clients x per_client calls."""
+    out = [None] * (clients * per_client)
+    lat = np.zeros(clients * per_client)
+
+    def client(c):
+        for k in range(per_client):
+            i = c * per_client + k
+            t0 = time.perf_counter()
+            out[i] = call(rows[i % len(rows)])
+            lat[i] = (time.perf_counter() - t0) * 1000.0
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return out, lat, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--model", default=ACTIVITY_MODEL_PATH)
+    ap.add_argument("--table", default=ACTIVITY_TABLE_PATH)
+    ap.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--requests", type=int, default=50, help="requests per client")
+    ap.add_argument("--max-batch", type=int, default=64)
+    ap.add_argument("--wait-ms", type=float, default=2.0)
+    args = ap.parse_args()
+
+    if not os.path.exists(args.model):
+        sys.exit(f"No model at {args.model}; train and save one with model/model.ipynb first")
+    model = ActivityModel.load(args.model, table_path=None)
+    table = ActivityTable.load(args.table) if os.path.exists(args.table) else None
+    raw = pd.read_csv(DATA_CSV).drop(columns=["label", "city"]).head(2000).to_dict("records")
+    rows = [parse_activity_row(r) for r in raw]
+    batcher = MicroBatcher(model.predict, args.max_batch, args.wait_ms)
+
+    print(f"{'clients':>7} {'mode':<14} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>11} {'same':>5}")
+    for clients in args.clients:
+        single, lat, wall = run_clients(lambda r: model.predict([r])[0], rows, clients, args.requests)
+        n = len(single)
+        print(f"{clients:>7} {'per-request':<14} {n / wall:>8.0f} {np.percentile(lat, 50):>8.1f} "
+              f"{np.percentile(lat, 99):>8.1f} {1:>11} {'':>5}")
+
+        before = batcher.stats()
+        batched, lat, wall = run_clients(batcher.submit, rows, clients, args.requests)
+        after = batcher.stats()
+        mean_batch = (after["items"] - before["items"]) / max(1, after["batches"] - before["batches"])
+        print(f"{clients:>7} {'micro-batched':<14} {n / wall:>8.0f} {np.percentile(lat, 50):>8.1f} "
+              f"{np.percentile(lat, 99):>8.1f} {mean_batch:>11.1f} {str(batched == single):>5}")
+
+        if table is not None:
+            looked_up, lat, wall = run_clients(table.get, rows, clients, args.requests)
+            print(f"{clients:>7} {'lookup table':<14} {n / wall:>8.0f} {np.percentile(lat, 50):>8.3f} "
+                  f"{np.percentile(lat, 99):>8.3f} {'':>11} {str(looked_up == single):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# ml-service/benchmarks/bench_alternatives.py
+"""
+Corridor stations for a route and its alternatives: one near_route call per route vs near_routes.
+
+Uses the recorded OSRM alternatives in maps/*.html at full geometry, as the
+planner matches them, and checks both paths match the same stations.
+
+Usage (from ml-service/):
+    python benchmarks/bench_alternatives.py --stations 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_proximity import synthetic_stations  # noqa: E402
+from recorded_routes import load_recorded_routes  # noqa: E402
+from services.stations import StationIndex  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--stations", type=int, default=10000)
+    ap.add_argument("--threshold-km", type=float, default=5.0)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    coords = synthetic_stations(args.stations)
+    index = StationIndex([{"lat": float(lat), "lon": float(lon)} for lat, lon in coords])
+
+    print(f"{'route':<42} {'alts':>4} {'segments':>9} {'unique':>7} {'per-route ms':>13} {'shared ms':>10} {'matched':>8}")
+    total_sep = total_shared = 0.0
+    for name, routes in load_recorded_routes().items():
+        segs = np.concatenate([np.hstack([p[:-1], p[1:]]) for p in routes])
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            separate = [index.near_route(p, args.threshold_km) for p in routes]
+        t_sep = (time.perf_counter() - t0) / args.repeat
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            shared = index.near_routes(routes, args.threshold_km)
+        t_shared = (time.perf_counter() - t0) / args.repeat
+
+        for (i1, c1, a1), (i2, c2, a2) in zip(separate, shared):
+            assert np.array_equal(i1, i2), "near_routes matched different stations"
+            assert np.allclose(c1, c2, atol=1e-9) and np.allclose(a1, a2, atol=1e-6)
+
+        total_sep += t_sep
+        total_shared += t_shared
+        print(
+            f"{name[:42]:<42} {len(routes):>4} {len(segs):>9} {len(np.unique(segs, axis=0)):>7} "
+            f"{t_sep * 1000:>13.1f} {t_shared * 1000:>10.1f} {sum(len(m[0]) for m in shared):>8}"
+        )
+    print(f"{'total':<42} {'':>4} {'':>9} {'':>7} {total_sep * 1000:>13.1f} {total_shared * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
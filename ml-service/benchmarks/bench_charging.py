@@ -0,0 +1,49 @@
+# ml-service/benchmarks/bench_charging.py
+"""
+Charging-stop optimizer run time vs number of corridor stations.
+
+Synthetic 900 km corridor with stations of mixed power; a 60 kWh car at
+80 % SoC that has to stop several times.
+
+Usage (from ml-service/):
+    python benchmarks/bench_charging.py --sizes 50 200 500 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.charging import optimize_charging_stops  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 500, 1000])
+    ap.add_argument("--route-km", type=float, default=900.0)
+    ap.add_argument("--steps", type=int, default=100, help="SoC levels")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(5)
+    print(f"{'stations':>9} {'plan ms':>9} {'stops':>6} {'charge min':>11}")
+    for n in args.sizes:
+        along = rng.uniform(0.0, args.route_km, n)
+        detour = rng.uniform(0.0, 10.0, n)
+        power = rng.choice([7.0, 22.0, 50.0, 100.0, 150.0], n)
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            plan = optimize_charging_stops(
+                args.route_km, along, detour, power,
+                battery_kwh=60.0, kwh_per_km=0.18, soc_start=0.8, min_arrival_soc=0.1, steps=args.steps,
+            )
+        t_plan = (time.perf_counter() - t0) / args.repeat
+        print(f"{n:>9} {t_plan * 1000:>9.1f} {len(plan['stops']):>6} {plan.get('charge_min', float('nan')):>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
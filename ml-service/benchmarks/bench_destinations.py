@@ -0,0 +1,88 @@
+# ml-service/benchmarks/bench_destinations.py
+"""
+Destination ranking: per-destination geodesic loop + full sort vs vectorized haversine top-k.
+
+Random destinations around Colombo; checks both pick the same k (the
+ellipsoid and the sphere can order near-ties differently). With
+--origins, also times one get_best_destination call per origin against a
+single get_best_destinations batch and checks they agree.
+
+Usage (from ml-service/):
+    python benchmarks/bench_destinations.py --sizes 100 1000 20000 --k 5
+    python benchmarks/bench_destinations.py --sizes 5000 --origins 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from geopy.distance import geodesic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import NoBookingPredictor  # noqa: E402
+
+
+def legacy_best(origin, destinations, speed):
+    results = []
+    for d in destinations:
+        km = geodesic(origin, d).km
+        results.append({"destination": d, "travel_time": km / speed * 3600.0})
+    results.sort(key=lambda x: x["travel_time"])
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 20000])
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--origins", type=int, default=0, help="also benchmark the multi-origin batch")
+    ap.add_argument("--max-travel-time", type=float, default=None, help="batch reachability cutoff (s)")
+    args = ap.parse_args()
+
+    origin = (6.9271, 79.8612)
+    predictor = NoBookingPredictor()
+    rng = np.random.default_rng(3)
+    print(f"{'destinations':>13} {'loop ms':>9} {'top-k ms':>9} {'speedup':>8} {'same k':>7}")
+    for n in args.sizes:
+        coords = np.c_[rng.uniform(5.9, 9.8, n), rng.uniform(79.7, 81.9, n)]
+        dests = [tuple(p) for p in coords.tolist()]
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            old = legacy_best(origin, dests, predictor.speed)[:args.k]
+        t_old = (time.perf_counter() - t0) / args.repeat
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            new = predictor.get_best_destination(origin, coords, k=args.k)
+        t_new = (time.perf_counter() - t0) / args.repeat
+
+        same = [r["destination"] for r in old] == [r["destination"] for r in new]
+        print(f"{n:>13} {t_old * 1000:>9.1f} {t_new * 1000:>9.2f} {t_old / t_new:>7.0f}x {str(same):>7}")
+
+    if args.origins:
+        print(f"\n{'origins':>8} {'destinations':>13} {'per-origin ms':>14} {'batch ms':>9} {'same':>5}")
+        origins = np.c_[rng.uniform(5.9, 9.8, args.origins), rng.uniform(79.7, 81.9, args.origins)]
+        for n in args.sizes:
+            coords = np.c_[rng.uniform(5.9, 9.8, n), rng.uniform(79.7, 81.9, n)]
+
+            t0 = time.perf_counter()
+            single = [
+                [r for r in predictor.get_best_destination(o, coords, k=args.k)
+                 if args.max_travel_time is None or r["travel_time"] <= args.max_travel_time]
+                for o in origins
+            ]
+            t_single = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            batch = predictor.get_best_destinations(origins, coords, k=args.k, max_travel_time=args.max_travel_time)
+            t_batch = time.perf_counter() - t0
+
+            print(f"{args.origins:>8} {n:>13} {t_single * 1000:>14.1f} {t_batch * 1000:>9.1f} {str(single == batch):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# ml-service/benchmarks/bench_model_load.py
+"""
+Activity model startup time and memory per worker: joblib pickle vs flat memory-mapped artifact.
+
+Starts --workers processes per format. Each one loads the model, predicts
+--warm-rows rows from the training CSV, then waits until all workers of that
+format are up. It then reports its load time and memory: RSS counts shared
+pages in full in every process, while PSS splits them between the processes
+sharing them, so the PSS total is what the workers really cost together.
+Linux only (reads /proc/self).
+
+Usage (from ml-service/):
+    python benchmarks/bench_model_load.py --pickle model/ev_recommendation_model.pkl \\
+        --flat model/ev_recommendation_model.flat --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+DATA_CSV = os.path.join(HERE, "model", "ev_activity_data_v2.csv")
+
+
+def _proc_kb(path, field):
+    with open(path) as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def worker(model_path, warm_rows):
+    t0 = time.perf_counter()
+    import pandas as pd
+
+    from services.activity import ActivityModel, parse_activity_row
+    imported = time.perf_counter()
+    rss_before = _proc_kb("/proc/self/status", "VmRSS")
+
+    model = ActivityModel.load(model_path, table_path=None)
+    loaded = time.perf_counter()
+
+    raw = pd.read_csv(DATA_CSV, nrows=warm_rows).drop(columns=["label", "city"]).to_dict("records")
+    rows = [parse_activity_row(r) for r in raw]
+    t_first = time.perf_counter()
+    model.predict(rows[:1])
+    first_ms = (time.perf_counter() - t_first) * 1000
+    model.predict(rows)
+
+    print("ready", flush=True)
+    sys.stdin.readline()  # every worker is up; measure with the pages shared
+    print(json.dumps({
+        "import_s": imported - t0,
+        "load_s": loaded - imported,
+        "first_predict_ms": first_ms,
+        "model_rss_mb": (_proc_kb("/proc/self/status", "VmRSS") - rss_before) / 1024,
+        "rss_mb": _proc_kb("/proc/self/status", "VmRSS") / 1024,
+        "pss_mb": _proc_kb("/proc/self/smaps_rollup", "Pss") / 1024,
+    }), flush=True)
+
+
+def run_format(model_path, workers, warm_rows):
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", model_path, "--warm-rows", str(warm_rows)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=HERE,
+        )
+        for _ in range(workers)
+    ]
+    for p in procs:
+        if p.stdout.readline().strip() != "ready":
+            raise RuntimeError("worker failed to start")
+    for p in procs:
+        p.stdin.write("\n")
+        p.stdin.flush()
+    reports = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.wait()
+    return reports
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--pickle", default=os.path.join(HERE, "model", "ev_recommendation_model.pkl"))
+    ap.add_argument("--flat", default=os.path.join(HERE, "model", "ev_recommendation_model.flat"))
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--warm-rows", type=int, default=2000, help="rows predicted before measuring memory")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.warm_rows)
+        return
+
+    # page cache warm for both, so load times compare parsing, not disk reads
+    print(f"{'format':<8} {'workers':>7} {'load s':>7} {'1st predict ms':>15} {'model RSS MB':>13} "
+          f"{'RSS MB':>7} {'PSS MB':>7} {'PSS total MB':>13}")
+    for name, path in (("pickle", args.pickle), ("flat", args.flat)):
+        if not os.path.exists(path):
+            print(f"{name:<8} missing: {path}")
+            continue
+        run_format(path, 1, args.warm_rows)
+        reports = run_format(path, args.workers, args.warm_rows)
+
+        def mean(key):
+            return sum(r[key] for r in reports) / len(reports)
+
+        print(f"{name:<8} {args.workers:>7} {mean('load_s'):>7.2f} {mean('first_predict_ms'):>15.1f} "
+              f"{mean('model_rss_mb'):>13.0f} {mean('rss_mb'):>7.0f} {mean('pss_mb'):>7.0f} "
+              f"{sum(r['pss_mb'] for r in reports):>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
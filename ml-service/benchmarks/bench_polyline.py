@@ -0,0 +1,80 @@
+# ml-service/benchmarks/bench_polyline.py
+"""
+Polyline codec throughput (old per-character decoder vs services.polyline) and
+path payload size (JSON coordinate arrays vs encoded polyline) on the recorded routes.
+
+Usage (from ml-service/):
+    python benchmarks/bench_polyline.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recorded_routes import load_recorded_routes  # noqa: E402
+from services.polyline import decode_polyline, encode_polyline  # noqa: E402
+
+
+def legacy_decode_polyline5(polyline_str):
+    """The decoder that used to be copy-pasted in all three planners."""
+    index, lat, lng, coordinates = 0, 0, 0, []
+    while index < len(polyline_str):
+        result, shift = 0, 0
+        while True:
+            b = ord(polyline_str[index]) - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        lat += ~(result >> 1) if result & 1 else (result >> 1)
+
+        result, shift = 0, 0
+        while True:
+            b = ord(polyline_str[index]) - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        lng += ~(result >> 1) if result & 1 else (result >> 1)
+
+        coordinates.append((lat / 1e5, lng / 1e5))
+    return coordinates
+
+
+def _timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    encoded = [encode_polyline(r) for rs in load_recorded_routes().values() for r in rs]
+    points = sum(len(decode_polyline(e)) for e in encoded)
+
+    t_old = sum(_timed(lambda: legacy_decode_polyline5(e), args.repeat) for e in encoded)
+    t_new = sum(_timed(lambda: decode_polyline(e), args.repeat) for e in encoded)
+    t_enc = sum(_timed(lambda: encode_polyline(decode_polyline(e)), args.repeat) for e in encoded) - t_new
+
+    json_bytes = sum(len(json.dumps(decode_polyline(e).tolist())) for e in encoded)
+    poly_bytes = sum(len(json.dumps(e)) for e in encoded)
+
+    print(f"polylines       : {len(encoded)} ({points} points)")
+    print(f"decode legacy   : {t_old * 1000:8.2f} ms total")
+    print(f"decode numpy    : {t_new * 1000:8.2f} ms total ({t_old / t_new:.1f}x)")
+    print(f"encode numpy    : {t_enc * 1000:8.2f} ms total")
+    print(f"path as coords  : {json_bytes / 1024:8.1f} KB")
+    print(f"path as polyline: {poly_bytes / 1024:8.1f} KB ({json_bytes / poly_bytes:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
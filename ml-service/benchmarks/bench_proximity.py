@@ -0,0 +1,96 @@
+# ml-service/benchmarks/bench_proximity.py
+"""
+Compare the old per-pair geodesic corridor scan (endpoints + midpoint
+sampling) with the exact vectorized projection in services.proximity.
+
+Usage (from ml-service/):
+    python benchmarks/bench_proximity.py --points 400 --stations 131
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from geopy.distance import geodesic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.proximity import distances_to_polyline_km  # noqa: E402
+
+COLOMBO = (6.9271, 79.8612)
+JAFFNA = (9.6615, 80.0255)
+
+
+def synthetic_route(n_points: int, seed: int = 7) -> np.ndarray:
+    """Wiggly Colombo -> Jaffna polyline with n_points vertices."""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0.0, 1.0, n_points)
+    lat = COLOMBO[0] + (JAFFNA[0] - COLOMBO[0]) * t
+    lon = COLOMBO[1] + (JAFFNA[1] - COLOMBO[1]) * t + 0.25 * np.sin(t * np.pi * 3)
+    lon += rng.normal(0.0, 0.002, n_points)
+    return np.column_stack([lat, lon])
+
+
+def synthetic_stations(n: int, seed: int = 11) -> np.ndarray:
+    """Stations scattered uniformly over the Sri Lanka bounding box."""
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(5.9, 9.85, n)
+    lon = rng.uniform(79.7, 81.9, n)
+    return np.column_stack([lat, lon])
+
+
+def legacy_distances_km(points, polyline):
+    """The loop the planners used before: geodesic to endpoints + midpoint."""
+    out = []
+    line = [tuple(p) for p in polyline]
+    for p in points:
+        p = tuple(p)
+        best = float("inf")
+        for a, b in zip(line, line[1:]):
+            mid = ((a[0] + b[0]) / 2.0, (a[1] + b[1]) / 2.0)
+            d = min(geodesic(p, a).km, geodesic(p, b).km, geodesic(p, mid).km)
+            if d < best:
+                best = d
+        out.append(best)
+    return np.array(out)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--points", type=int, default=400, help="polyline vertices")
+    ap.add_argument("--stations", type=int, default=131)
+    ap.add_argument("--threshold-km", type=float, default=5.0)
+    ap.add_argument("--repeat", type=int, default=20, help="runs of the vectorized path")
+    args = ap.parse_args()
+
+    route = synthetic_route(args.points)
+    stations = synthetic_stations(args.stations)
+
+    t0 = time.perf_counter()
+    legacy = legacy_distances_km(stations, route)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        fast = distances_to_polyline_km(stations, route)
+    t_fast = (time.perf_counter() - t0) / args.repeat
+
+    old_in = legacy <= args.threshold_km
+    new_in = fast <= args.threshold_km
+    superset = bool(np.all(new_in[old_in]))
+    # sampling can only overestimate, projection measures the true foot point
+    max_gain = float(np.max(legacy[old_in] - fast[old_in])) if old_in.any() else 0.0
+
+    print(f"polyline points : {args.points}")
+    print(f"stations        : {args.stations}")
+    print(f"legacy geodesic : {t_legacy * 1000:10.1f} ms")
+    print(f"vectorized      : {t_fast * 1000:10.2f} ms")
+    print(f"speedup         : {t_legacy / t_fast:10.0f}x")
+    print(f"matched legacy  : {int(old_in.sum())} within {args.threshold_km} km")
+    print(f"matched exact   : {int(new_in.sum())} ({'superset' if superset else 'MISSING legacy matches'})")
+    print(f"max closer km   : {max_gain:.4f} (projection vs sampled endpoints/midpoint)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# ml-service/benchmarks/bench_simplify.py
+"""
+Point reduction, proximity latency and /api/route payload size for Douglas-Peucker
+simplified vs full OSRM geometry on the recorded Sri Lankan routes in maps/.
+
+Usage (from ml-service/):
+    python benchmarks/bench_simplify.py --tolerance-m 10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_proximity import synthetic_stations  # noqa: E402
+from recorded_routes import load_recorded_routes  # noqa: E402
+from services.polyline import simplify_polyline  # noqa: E402
+from services.proximity import project_onto_polyline  # noqa: E402
+
+
+def _near_route_stations(route: np.ndarray, n: int, seed: int = 3) -> np.ndarray:
+    """Stations jittered up to ~6 km around random route vertices."""
+    rng = np.random.default_rng(seed)
+    picks = route[rng.integers(0, len(route), n)]
+    return picks + rng.uniform(-0.055, 0.055, picks.shape)
+
+
+def _timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - t0) / repeat
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--tolerance-m", type=float, default=10.0)
+    ap.add_argument("--stations", type=int, default=131)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    print(f"{'route':<38} {'points':>7} {'simpl':>6} {'ratio':>6} {'dp ms':>6} "
+          f"{'prox full':>9} {'prox simp':>9} {'KB full':>8} {'KB simp':>8} {'max err m':>9}")
+    for name, routes in load_recorded_routes().items():
+        full = routes[0]
+        simp, t_dp = _timed(lambda: simplify_polyline(full, args.tolerance_m), args.repeat)
+
+        stations = np.concatenate([synthetic_stations(args.stations), _near_route_stations(full, 50)])
+        (c_full, _), t_full = _timed(lambda: project_onto_polyline(stations, full), args.repeat)
+        (c_simp, _), t_simp = _timed(lambda: project_onto_polyline(stations, simp), args.repeat)
+        inside = c_full <= 5.0
+        err_m = float(np.max(np.abs(c_full[inside] - c_simp[inside])) * 1000) if inside.any() else 0.0
+
+        kb_full = len(json.dumps(full.tolist())) / 1024
+        kb_simp = len(json.dumps(simp.tolist())) / 1024
+        print(f"{name[:38]:<38} {len(full):>7} {len(simp):>6} {len(full) / len(simp):>5.1f}x {t_dp * 1000:>6.1f} "
+              f"{t_full * 1000:>9.1f} {t_simp * 1000:>9.1f} {kb_full:>8.1f} {kb_simp:>8.1f} {err_m:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
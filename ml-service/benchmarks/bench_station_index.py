@@ -0,0 +1,60 @@
+# ml-service/benchmarks/bench_station_index.py
+"""
+Corridor lookups with the grid StationIndex vs a full scan of every station.
+
+Usage (from ml-service/):
+    python benchmarks/bench_station_index.py --points 3000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_proximity import synthetic_route, synthetic_stations  # noqa: E402
+from services.proximity import distances_to_polyline_km  # noqa: E402
+from services.stations import StationIndex  # noqa: E402
+
+
+def _as_station_dicts(coords: np.ndarray):
+    return [{"lat": float(lat), "lon": float(lon)} for lat, lon in coords]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--points", type=int, default=3000, help="polyline vertices")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[131, 1000, 10000, 50000])
+    ap.add_argument("--threshold-km", type=float, default=5.0)
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    route = synthetic_route(args.points)
+    print(f"{'stations':>9} {'build ms':>9} {'scan ms':>9} {'index ms':>9} {'candidates':>11} {'matched':>8}")
+    for n in args.sizes:
+        coords = synthetic_stations(n)
+
+        t0 = time.perf_counter()
+        index = StationIndex(_as_station_dicts(coords))
+        t_build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            full = distances_to_polyline_km(coords, route)
+        t_scan = (time.perf_counter() - t0) / args.repeat
+
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            idx, _cross, _along = index.near_route(route, args.threshold_km)
+        t_index = (time.perf_counter() - t0) / args.repeat
+
+        expected = np.flatnonzero(full <= args.threshold_km)
+        assert np.array_equal(expected, idx), "index dropped or added stations"
+        n_cand = len(index.candidates(route, args.threshold_km))
+        print(f"{n:>9} {t_build * 1000:>9.2f} {t_scan * 1000:>9.2f} {t_index * 1000:>9.2f} {n_cand:>11} {len(idx):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# ml-service/benchmarks/fake_upstream.py
+"""
+Local stand-in for the routing upstreams, for load tests that must not hit the real APIs.
+
+Serves, on one port:
+    GET /route/v1/{profile}/{lon,lat;...}   OSRM route service
+    GET /table/v1/{profile}/{lon,lat;...}   OSRM table service (durations)
+    GET /maps/api/directions/json           Google Directions
+    GET /__stats, POST /__reset             request counts and served latency
+    GET/POST /__config                      read / change the fault settings
+
+Route answers are replayed from recordings: the real OSRM geometries in
+maps/*.html (recorded_routes.py), rendered as OSRM and Google responses, plus
+any raw OSRM / Google JSON responses saved in --responses DIR (one response
+per *.json file). A request gets the recording whose start and end are
+nearest its own, so every query in Sri Lanka gets a real-looking route. Table
+durations are straight-line distance at DRIVE_SPEED_KMH times DETOUR.
+
+Faults are injected per request: a fixed latency plus an exponential tail
+(--jitter-ms is its mean), --slow-rate requests held for --slow-s more
+(past the clients' read timeout by default), --error-rate answered with
+--error-status, and --empty-rate answered "no route" (OSRM NoRoute,
+Google ZERO_RESULTS). --seed makes the fault sequence repeatable.
+
+Usage (from ml-service/):
+    python benchmarks/fake_upstream.py --port 5055 --latency-ms 80 --jitter-ms 40 --error-rate 0.02
+    OSRM_BASE_URL=http://127.0.0.1:5055 \\
+    GOOGLE_DIRECTIONS_URL=http://127.0.0.1:5055/maps/api/directions/json python app.py
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+from recorded_routes import load_recorded_routes  # noqa: E402
+from services.polyline import decode_polyline, encode_polyline  # noqa: E402
+from services.proximity import haversine_km  # noqa: E402
+
+DEFAULT_PORT = 5055
+DRIVE_SPEED_KMH = 45.0
+# road distance over straight-line distance, for /table
+DETOUR = 1.3
+# served latencies kept for the /__stats percentiles
+STATS_WINDOW = 100_000
+
+# fault settings: name -> (type, default, help)
+FAULTS = {
+    "latency_ms": (float, 0.0, "fixed delay added to every answer"),
+    "jitter_ms": (float, 0.0, "mean of an exponential extra delay"),
+    "slow_rate": (float, 0.0, "fraction of requests held for slow_s more"),
+    "slow_s": (float, 10.0, "extra delay of a slow request"),
+    "error_rate": (float, 0.0, "fraction of requests answered with error_status"),
+    "error_status": (int, 503, "HTTP status of an injected error"),
+    "empty_rate": (float, 0.0, "fraction of requests answered with no route"),
+}
+
+
+def add_fault_args(ap: argparse.ArgumentParser, prefix: str = "", defaults: bool = True) -> None:
+    """--latency-ms, --error-rate, ... (with prefix, e.g. --upstream-latency-ms)."""
+    for name, (kind, default, text) in FAULTS.items():
+        ap.add_argument(f"--{prefix}{name.replace('_', '-')}", dest=f"{prefix.replace('-', '_')}{name}", type=kind,
+                        default=default if defaults else None, help=text)
+
+
+def fault_settings(args: argparse.Namespace, prefix: str = "") -> Dict[str, Any]:
+    """The fault values set in args (None values left out)."""
+    out = {}
+    for name in FAULTS:
+        value = getattr(args, f"{prefix.replace('-', '_')}{name}", None)
+        if value is not None:
+            out[name] = value
+    return out
+
+
+def path_km(path: np.ndarray) -> float:
+    if len(path) < 2:
+        return 0.0
+    return float(haversine_km(path[:-1, 0], path[:-1, 1], path[1:, 0], path[1:, 1]).sum())
+
+
+def osrm_route(path: np.ndarray) -> Dict[str, Any]:
+    distance = round(path_km(path) * 1000, 1)
+    duration = round(distance / (DRIVE_SPEED_KMH / 3.6), 1)
+    leg = {"distance": distance, "duration": duration, "weight": duration, "summary": "", "steps": []}
+    return {"geometry": encode_polyline(path), "distance": distance, "duration": duration, "weight": duration,
+            "weight_name": "routability", "legs": [leg]}
+
+
+def google_route(path: np.ndarray) -> Dict[str, Any]:
+    meters = int(round(path_km(path) * 1000))
+    seconds = int(round(meters / (DRIVE_SPEED_KMH / 3.6)))
+    leg = {
+        "distance": {"value": meters, "text": f"{meters / 1000:.1f} km"},
+        "duration": {"value": seconds, "text": f"{seconds // 60} mins"},
+        "start_location": {"lat": float(path[0, 0]), "lng": float(path[0, 1])},
+        "end_location": {"lat": float(path[-1, 0]), "lng": float(path[-1, 1])},
+        "steps": [],
+    }
+    return {"summary": "", "overview_polyline": {"points": encode_polyline(path)}, "legs": [leg],
+            "warnings": [], "waypoint_order": []}
+
+
+class Replay:
+    """Recorded responses of one API, looked up by the nearest start and end."""
+
+    def __init__(self):
+        self._ends: List[Tuple[float, float, float, float]] = []
+        self._responses: List[Dict[str, Any]] = []
+        self._bodies: Dict[Tuple[int, int], bytes] = {}
+        self._array: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def add(self, start: Tuple[float, float], end: Tuple[float, float], response: Dict[str, Any]) -> None:
+        self._ends.append((start[0], start[1], end[0], end[1]))
+        self._responses.append(response)
+        self._array = None
+
+    def body(self, start: Tuple[float, float], end: Tuple[float, float], max_routes: int) -> bytes:
+        """JSON of the nearest recording, cut to its first max_routes routes."""
+        if self._array is None:
+            self._array = np.asarray(self._ends, dtype=np.float64)
+        d = self._array - np.array([start[0], start[1], end[0], end[1]])
+        i = int(np.argmin((d * d).sum(axis=1)))
+        key = (i, max_routes)
+        body = self._bodies.get(key)
+        if body is None:
+            response = dict(self._responses[i])
+            response["routes"] = response["routes"][:max_routes]
+            body = self._bodies[key] = json.dumps(response).encode()
+        return body
+
+
+def load_replays(maps_dir: Optional[str] = None, responses_dir: Optional[str] = None) -> Tuple[Replay, Replay]:
+    """(OSRM replay, Google replay) from the recorded maps and saved responses."""
+    osrm, google = Replay(), Replay()
+    recorded = load_recorded_routes(maps_dir) if maps_dir else load_recorded_routes()
+    for paths in recorded.values():
+        start, end = tuple(paths[0][0]), tuple(paths[0][-1])
+        waypoints = [{"location": [p[1], p[0]], "name": "", "hint": ""} for p in (start, end)]
+        osrm.add(start, end, {"code": "Ok", "routes": [osrm_route(p) for p in paths], "waypoints": waypoints})
+        google.add(start, end, {"status": "OK", "routes": [google_route(p) for p in paths],
+                                "geocoded_waypoints": []})
+
+    for path in sorted(glob.glob(os.path.join(responses_dir, "*.json"))) if responses_dir else []:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("code") == "Ok" and data.get("routes"):
+            line = decode_polyline(data["routes"][0]["geometry"])
+            osrm.add(tuple(line[0]), tuple(line[-1]), data)
+        elif data.get("status") == "OK" and data.get("routes"):
+            legs = data["routes"][0]["legs"]
+            start, end = legs[0]["start_location"], legs[-1]["end_location"]
+            google.add((start["lat"], start["lng"]), (end["lat"], end["lng"]), data)
+        else:
+            print(f"skipping {path}: not a successful OSRM route or Google Directions response", file=sys.stderr)
+    if not osrm or not google:
+        raise RuntimeError("no recordings for one of the APIs; check maps/ and --responses")
+    return osrm, google
+
+
+class Upstream:
+    """Replays, fault settings and counters shared by the handler threads."""
+
+    def __init__(self, osrm: Replay, google: Replay, seed: Optional[int] = None, **faults: Any):
+        self.osrm = osrm
+        self.google = google
+        self.faults = {name: default for name, (_, default, _) in FAULTS.items()}
+        self.configure(faults)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def configure(self, faults: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = set(faults) - set(FAULTS)
+        if unknown:
+            raise ValueError(f"unknown fault settings: {sorted(unknown)}")
+        for name, value in faults.items():
+            self.faults[name] = FAULTS[name][0](value)
+        return dict(self.faults)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts: Dict[str, Dict[str, int]] = {}
+            self._served_ms: Dict[str, List[float]] = {}
+            self._started = time.monotonic()
+
+    def draw(self) -> Tuple[float, str]:
+        """(delay in seconds, outcome: "ok" | "error" | "empty" | "slow") for one request."""
+        f = self.faults
+        with self._lock:
+            u = self._rng.random()
+            tail = self._rng.expovariate(1.0 / f["jitter_ms"]) if f["jitter_ms"] > 0 else 0.0
+            slow = self._rng.random() < f["slow_rate"]
+        delay = (f["latency_ms"] + tail) / 1000.0 + (f["slow_s"] if slow else 0.0)
+        if u < f["error_rate"]:
+            return delay, "error"
+        if u < f["error_rate"] + f["empty_rate"]:
+            return delay, "empty"
+        return delay, "slow" if slow else "ok"
+
+    def count(self, api: str, outcome: str, served_ms: float) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(api, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+            served = self._served_ms.setdefault(api, [])
+            served.append(served_ms)
+            if len(served) > STATS_WINDOW:
+                del served[:len(served) - STATS_WINDOW]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            apis = {}
+            for api, counts in self._counts.items():
+                served = np.asarray(self._served_ms[api])
+                p50, p95, p99 = np.percentile(served, [50, 95, 99]) if len(served) else (0.0, 0.0, 0.0)
+                apis[api] = {"requests": sum(counts.values()), **counts,
+                             "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2),
+                             "p99_ms": round(float(p99), 2)}
+            return {"uptime_s": round(time.monotonic() - self._started, 3), "faults": dict(self.faults), "apis": apis}
+
+
+def _lat_lons(coords: str) -> List[Tuple[float, float]]:
+    """OSRM "lon,lat;lon,lat" -> [(lat, lon), ...]."""
+    out = []
+    for pair in unquote(coords).split(";"):
+        lon, lat = pair.split(",")
+        out.append((float(lat), float(lon)))
+    return out
+
+
+def _lat_lng(text: str) -> Tuple[float, float]:
+    lat, lng = text.split(",")
+    return float(lat), float(lng)
+
+
+def _indices(text: Optional[str], n: int) -> List[int]:
+    if not text or text == "all":
+        return list(range(n))
+    return [int(i) for i in text.split(";")]
+
+
+def _max_routes(value: Optional[str]) -> int:
+    """OSRM alternatives=true|false|N and Google alternatives=true|false -> routes to return."""
+    if value is None or value == "false":
+        return 1
+    if value == "true":
+        return 1_000
+    return 1 + int(value)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the real APIs
+    server_version = "fake-upstream"
+    upstream: Upstream = None  # set by make_server
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        self._send(status, json.dumps(payload).encode())
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if url.path == "/__stats":
+            return self._send_json(200, self.upstream.stats())
+        if url.path == "/__config":
+            return self._send_json(200, self.upstream.faults)
+        if len(parts) == 4 and parts[0] in ("route", "table") and parts[1] == "v1":
+            return self._serve(f"osrm_{parts[0]}", lambda: self._osrm(parts[0], parts[3], query))
+        if url.path == "/maps/api/directions/json":
+            return self._serve("google", lambda: self._google(query))
+        self._send_json(404, {"code": "InvalidUrl", "message": f"no such endpoint: {url.path}"})
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if url.path == "/__reset":
+            self.upstream.reset()
+            return self._send_json(200, {"ok": True})
+        if url.path == "/__config":
+            try:
+                return self._send_json(200, self.upstream.configure(json.loads(raw or b"{}")))
+            except (TypeError, ValueError) as ex:
+                return self._send_json(400, {"error": str(ex)})
+        self._send_json(404, {"error": f"no such endpoint: {url.path}"})
+
+    def _serve(self, api: str, answer) -> None:
+        t0 = time.perf_counter()
+        delay, outcome = self.upstream.draw()
+        try:
+            status, body = answer() if outcome not in ("error", "empty") else (None, None)
+        except (KeyError, TypeError, ValueError) as ex:
+            outcome, status, body = "bad_request", 400, json.dumps({"code": "InvalidQuery", "message": str(ex)}).encode()
+        if outcome == "error":
+            status, body = self.upstream.faults["error_status"], b'{"code": "ServiceUnavailable"}'
+        elif outcome == "empty":
+            status, body = (200, b'{"status": "ZERO_RESULTS", "routes": []}') if api == "google" else (
+                400, b'{"code": "NoRoute", "message": "Impossible route between points"}')
+        time.sleep(max(0.0, delay - (time.perf_counter() - t0)))
+        try:
+            self._send(status, body)
+        finally:
+            self.upstream.count(api, outcome, (time.perf_counter() - t0) * 1000)
+
+    def _osrm(self, service: str, coords: str, query: Dict[str, str]) -> Tuple[int, bytes]:
+        points = _lat_lons(coords)
+        if len(points) < 2:
+            raise ValueError("need at least two coordinates")
+        if service == "route":
+            return 200, self.upstream.osrm.body(points[0], points[-1], _max_routes(query.get("alternatives")))
+        sources = _indices(query.get("sources"), len(points))
+        destinations = _indices(query.get("destinations"), len(points))
+        src = np.asarray([points[i] for i in sources])
+        dst = np.asarray([points[i] for i in destinations])
+        km = haversine_km(src[:, None, 0], src[:, None, 1], dst[None, :, 0], dst[None, :, 1])
+        seconds = np.round(km * DETOUR / DRIVE_SPEED_KMH * 3600, 1)
+        waypoints = [{"location": [lon, lat], "name": ""} for lat, lon in points]
+        return 200, json.dumps({
+            "code": "Ok",
+            "durations": seconds.tolist(),
+            "sources": [waypoints[i] for i in sources],
+            "destinations": [waypoints[i] for i in destinations],
+        }).encode()
+
+    def _google(self, query: Dict[str, str]) -> Tuple[int, bytes]:
+        if not query.get("key"):
+            return 200, b'{"status": "REQUEST_DENIED", "error_message": "missing key", "routes": []}'
+        start, end = _lat_lng(query["origin"]), _lat_lng(query["destination"])
+        return 200, self.upstream.google.body(start, end, _max_routes(query.get("alternatives")))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the listen backlog; the default 5 drops connections under load
+
+
+def make_server(upstream: Upstream, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    return _Server((host, port), type("UpstreamHandler", (Handler,), {"upstream": upstream}))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--responses", default=None, help="directory of saved OSRM / Google JSON responses")
+    ap.add_argument("--seed", type=int, default=None, help="repeatable fault sequence")
+    add_fault_args(ap)
+    args = ap.parse_args()
+
+    osrm, google = load_replays(responses_dir=args.responses)
+    upstream = Upstream(osrm, google, seed=args.seed, **fault_settings(args))
+    server = make_server(upstream, args.host, args.port)
+    print(f"fake upstream on http://{args.host}:{server.server_port} ({len(osrm)} OSRM, {len(google)} Google "
+          f"recordings; faults {json.dumps(upstream.faults)})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
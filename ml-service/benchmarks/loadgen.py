@@ -0,0 +1,411 @@
+# ml-service/benchmarks/loadgen.py
+"""
+Open-loop load generator for the ml-service API: throughput, latency percentiles and error rates per stage.
+
+Requests go out on a fixed schedule (--rps) whatever the service does, so a
+slow service shows up as queueing in the latencies instead of as a lower
+offered load; latency is measured from each request's scheduled send time
+(service time, from the actual send, is reported next to it).
+
+Stages in the report:
+    client    transport failures and timeouts seen here
+    app       HTTP status of the answers
+    server    per-metric durations from the app's Server-Timing header, if it sends one
+    upstream  the fake upstream's counts and served latency (fake_upstream.py /__stats)
+plus the changes in the app's /api/health counters (route cache, OSRM
+client, coalescing) over the measured run.
+
+Route bodies start and end near the recorded trips in maps/ (both ways).
+A --repeat-ratio share of requests reuses a trip sent before (route cache
+hits, coalescing); the rest move both ends 0.5-2 km so they miss the cache.
+
+With --spawn flask|asgi everything runs locally: fake_upstream.py, a
+seeded SQLite station table (--stations), and the app pointed at both
+(OSRM_BASE_URL, GOOGLE_DIRECTIONS_URL, DATABASE_URL, no disk route cache).
+Otherwise --url and --upstream-url name running services. --upstream-*
+fault settings are sent to the fake upstream before the run.
+
+Usage (from ml-service/):
+    python benchmarks/loadgen.py --spawn flask --rps 20 --duration 30 --upstream-latency-ms 80
+    python benchmarks/loadgen.py --spawn asgi --rps 200 --backend google --upstream-error-rate 0.05
+    python benchmarks/loadgen.py --url http://127.0.0.1:8000 --upstream-url http://127.0.0.1:5055 \\
+        --endpoint activity --rps 500 --out /tmp/activity.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+from fake_upstream import add_fault_args, fault_settings  # noqa: E402
+from recorded_routes import load_recorded_routes  # noqa: E402
+from services.activity import DAYS, MONTHS  # noqa: E402
+
+ENDPOINTS = {"route": "/api/route", "plan": "/api/plan", "activity": "/api/activity"}
+APP_COMMANDS = {
+    "flask": ["-m", "flask", "--app", "app", "run", "--with-threads", "--no-reload", "--no-debugger"],
+    "asgi": ["-m", "uvicorn", "asgi:app", "--log-level", "warning"],
+}
+# a send this far behind schedule means the generator itself is saturated
+LATE_SEND_S = 0.01
+READY_TIMEOUT_S = 120.0
+
+
+class Workload:
+    """Request bodies for one endpoint, seeded."""
+
+    def __init__(self, endpoint: str, repeat_ratio: float = 0.0, backend: Optional[str] = None, seed: int = 0):
+        self.endpoint = endpoint
+        self.repeat_ratio = repeat_ratio
+        self.backend = backend
+        self.rng = random.Random(seed)
+        trips = []
+        for paths in load_recorded_routes().values():
+            start, end = tuple(paths[0][0].tolist()), tuple(paths[0][-1].tolist())
+            trips += [(start, end), (end, start)]
+        self.trips = trips
+        self.sent: List[Dict[str, Any]] = []
+
+    def _shift(self, point):
+        bearing, km = self.rng.uniform(0, 2 * np.pi), self.rng.uniform(0.5, 2.0)
+        return {"lat": round(point[0] + km / 111.0 * np.cos(bearing), 6),
+                "lng": round(point[1] + km / 111.0 * np.sin(bearing), 6)}
+
+    def _route_body(self) -> Dict[str, Any]:
+        start, end = self.rng.choice(self.trips)
+        body = {"start": self._shift(start), "end": self._shift(end)}
+        if self.backend:
+            body["backend"] = self.backend
+        if self.endpoint == "plan":
+            body.update(vehicle={"battery_kwh": 60, "range_km": 330}, soc_percent=self.rng.choice([40, 60, 80]))
+        return body
+
+    def _activity_body(self) -> Dict[str, Any]:
+        return {"charging_time": self.rng.choice([15, 30, 45, 60, 75, 90]),
+                "time": f"{self.rng.randrange(24):02d}:{self.rng.randrange(60):02d}",
+                "day": self.rng.choice(DAYS), "month": self.rng.choice(MONTHS)}
+
+    def next(self) -> Dict[str, Any]:
+        if self.sent and self.rng.random() < self.repeat_ratio:
+            return self.rng.choice(self.sent)
+        body = self._activity_body() if self.endpoint == "activity" else self._route_body()
+        self.sent.append(body)
+        return body
+
+
+def server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Server-Timing "name;dur=12.3;desc=..., name2;dur=4" -> {name: ms}."""
+    out = {}
+    for metric in (header or "").split(","):
+        name, *params = [p.strip() for p in metric.split(";")]
+        for p in params:
+            key, _, value = p.partition("=")
+            if name and key == "dur":
+                try:
+                    out[name] = float(value)
+                except ValueError:
+                    pass
+    return out
+
+
+async def _one(client: httpx.AsyncClient, path: str, body: Dict[str, Any], scheduled: float, samples: List[Dict]):
+    loop = asyncio.get_running_loop()
+    sent = loop.time()
+    sample = {"late_s": sent - scheduled, "status": None, "error": None, "timing": {}}
+    try:
+        r = await client.post(path, json=body)
+        sample["status"] = r.status_code
+        sample["timing"] = server_timing(r.headers.get("server-timing"))
+        if r.status_code >= 400:
+            with contextlib.suppress(ValueError):
+                sample["error"] = str(r.json().get("error", ""))[:120]
+    except httpx.HTTPError as ex:
+        sample["error"] = type(ex).__name__
+    done = loop.time()
+    sample["latency_ms"] = (done - scheduled) * 1000
+    sample["service_ms"] = (done - sent) * 1000
+    samples.append(sample)
+
+
+async def run_phase(url: str, path: str, workload: Workload, rps: float, duration_s: float, concurrency: int,
+                    timeout_s: float) -> Dict[str, Any]:
+    """Send rps requests per second for duration_s on a fixed schedule; wait for all answers."""
+    samples: List[Dict[str, Any]] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout_s, limits=limits) as client:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = []
+        for i in range(int(rps * duration_s)):
+            scheduled = start + i / rps
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(_one(client, path, workload.next(), scheduled, samples)))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - start
+    return {"samples": samples, "elapsed_s": elapsed}
+
+
+def _percentiles(values) -> Dict[str, float]:
+    if not len(values):
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(np.max(values)), 2)}
+
+
+def summarize(phase: Dict[str, Any], rps: float) -> Dict[str, Any]:
+    samples, elapsed = phase["samples"], phase["elapsed_s"]
+    n = len(samples)
+    ok = [s for s in samples if s["status"] is not None and s["status"] < 400]
+    transport: Dict[str, int] = {}
+    statuses: Dict[str, int] = {}
+    examples: Dict[str, str] = {}
+    for s in samples:
+        if s["status"] is None:
+            transport[s["error"]] = transport.get(s["error"], 0) + 1
+            continue
+        statuses[str(s["status"])] = statuses.get(str(s["status"]), 0) + 1
+        if s["error"]:
+            examples.setdefault(str(s["status"]), s["error"])
+    answered = n - sum(transport.values())
+    timings: Dict[str, List[float]] = {}
+    for s in ok:
+        for name, ms in s["timing"].items():
+            timings.setdefault(name, []).append(ms)
+    return {
+        "target_rps": rps,
+        "requests": n,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(1 - len(ok) / n, 4) if n else 0.0,
+        "late_sends": sum(s["late_s"] > LATE_SEND_S for s in samples),
+        "latency": _percentiles([s["latency_ms"] for s in ok]),
+        "service": _percentiles([s["service_ms"] for s in ok]),
+        "stages": {
+            "client": {"requests": n, "errors": transport,
+                       "error_rate": round(sum(transport.values()) / n, 4) if n else 0.0},
+            "app": {"answered": answered, "status": statuses, "error_examples": examples,
+                    "error_rate": round(1 - len(ok) / answered, 4) if answered else 0.0},
+            "server": {name: {"count": len(v), **_percentiles(v)} for name, v in sorted(timings.items())},
+        },
+    }
+
+
+def upstream_stage(stats: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for api, s in stats.get("apis", {}).items():
+        failed = s.get("error", 0) + s.get("empty", 0) + s.get("bad_request", 0)
+        out[api] = {**s, "error_rate": round(failed / s["requests"], 4) if s["requests"] else 0.0}
+    return out
+
+
+def _flatten(d: Any, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    if isinstance(d, dict):
+        for k, v in d.items():
+            out.update(_flatten(v, f"{prefix}{k}."))
+    elif isinstance(d, (int, float)) and not isinstance(d, bool):
+        out[prefix[:-1]] = d
+    return out
+
+
+def _is_gauge(key: str) -> bool:
+    return key.endswith("_ms") or key.rsplit(".", 1)[-1].startswith("mean")
+
+
+def health_delta(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, float]:
+    """/api/health counters that changed over the run, as after - before (latency / mean gauges left out)."""
+    a, b = _flatten(before), _flatten(after)
+    return {k: round(b[k] - a.get(k, 0), 4) for k in sorted(b) if b[k] != a.get(k, 0) and not _is_gauge(k)}
+
+
+def _get_json(url: str) -> Dict[str, Any]:
+    try:
+        r = httpx.get(url, timeout=10)
+        return r.json() if r.status_code == 200 else {}
+    except (httpx.HTTPError, ValueError):
+        return {}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, log_path: str) -> None:
+    deadline = time.monotonic() + READY_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f"{proc.args} exited with {proc.returncode}:\n{tail}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} not ready after {READY_TIMEOUT_S:.0f}s")
+
+
+def _start(stack: contextlib.ExitStack, cmd: List[str], env: Dict[str, str], log_path: str,
+           ready_url: str) -> subprocess.Popen:
+    log = stack.enter_context(open(log_path, "w", encoding="utf-8"))
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    def stop():
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    stack.callback(stop)
+    _wait_ready(ready_url, proc, log_path)
+    return proc
+
+
+def seed_stations(db_path: str, n: int) -> str:
+    """SQLite file with the app's station/charger tables holding n seeded stations; returns its URL."""
+    from sqlalchemy import create_engine
+
+    from models import Charger, Station, db
+    from suite import _fill_tables, station_rows
+
+    url = f"sqlite:///{db_path}"
+    engine = create_engine(url)
+    try:
+        db.metadata.create_all(engine)
+        _fill_tables(engine, Station.__table__, Charger.__table__, station_rows(n), string_ids=True)
+    finally:
+        engine.dispose()
+    return url
+
+
+def spawn(stack: contextlib.ExitStack, args: argparse.Namespace, tmp: str) -> None:
+    """Start the fake upstream and the app; sets args.url / args.upstream_url."""
+    upstream_port, app_port = _free_port(), _free_port()
+    args.upstream_url = f"http://127.0.0.1:{upstream_port}"
+    fake = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_upstream.py"),
+            "--port", str(upstream_port)]
+    if args.seed is not None:
+        fake += ["--seed", str(args.seed)]
+    if getattr(args, "responses", None):
+        fake += ["--responses", args.responses]
+    _start(stack, fake, dict(os.environ), os.path.join(tmp, "fake_upstream.log"), f"{args.upstream_url}/__stats")
+    print(f"fake upstream on {args.upstream_url}", flush=True)
+
+    env = dict(
+        os.environ,
+        OSRM_BASE_URL=args.upstream_url,
+        GOOGLE_DIRECTIONS_URL=f"{args.upstream_url}/maps/api/directions/json",
+        GOOGLE_MAPS_API_KEY=os.getenv("GOOGLE_MAPS_API_KEY", "fake"),
+        DATABASE_URL=seed_stations(os.path.join(tmp, "stations.db"), args.stations),
+        ROUTE_CACHE_PATH="",
+    )
+    args.url = f"http://127.0.0.1:{app_port}"
+    cmd = [sys.executable, *APP_COMMANDS[args.spawn], "--port", str(app_port)]
+    _start(stack, cmd, env, os.path.join(tmp, f"{args.spawn}.log"), f"{args.url}/api/health")
+    print(f"{args.spawn} app on {args.url} ({args.stations:,} stations)", flush=True)
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    r = report["result"]
+    print(f"\n{report['endpoint']} @ {r['target_rps']} rps: {r['requests']} requests in {r['elapsed_s']}s, "
+          f"{r['throughput_rps']} ok/s, error rate {r['error_rate']:.2%}, {r['late_sends']} late sends")
+    for name in ("latency", "service"):
+        if r[name]:
+            print(f"  {name:<8} " + "  ".join(f"{k[:-3]} {v:.1f} ms" for k, v in r[name].items()))
+    stages = r["stages"]
+    print(f"  client   errors {stages['client']['errors'] or '-'} ({stages['client']['error_rate']:.2%})")
+    print(f"  app      status {stages['app']['status']} ({stages['app']['error_rate']:.2%} errors)")
+    for status, example in stages["app"]["error_examples"].items():
+        print(f"           {status}: {example}")
+    for name, t in stages["server"].items():
+        print(f"  server   {name:<14} n={t['count']:<6} p50 {t['p50_ms']:.1f}  p95 {t['p95_ms']:.1f}  "
+              f"p99 {t['p99_ms']:.1f} ms")
+    for api, u in report["upstream"].items():
+        print(f"  upstream {api:<14} n={u['requests']:<6} p50 {u['p50_ms']:.1f}  p95 {u['p95_ms']:.1f}  "
+              f"p99 {u['p99_ms']:.1f} ms  ({u['error_rate']:.2%} errors)")
+    for key, delta in report["health_delta"].items():
+        print(f"  health   {key} {delta:+g}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    target = ap.add_mutually_exclusive_group()
+    target.add_argument("--spawn", choices=sorted(APP_COMMANDS), help="start the fake upstream and this app locally")
+    target.add_argument("--url", default="http://127.0.0.1:8000", help="a running app")
+    ap.add_argument("--upstream-url", default=None, help="the running fake_upstream.py the app talks to")
+    ap.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="route")
+    ap.add_argument("--backend", choices=["osrm", "google"], default=None, help="ASGI app only")
+    ap.add_argument("--rps", type=float, default=20.0)
+    ap.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=5.0, help="seconds at --rps before measuring")
+    ap.add_argument("--concurrency", type=int, default=512, help="max open connections")
+    ap.add_argument("--timeout", type=float, default=30.0, help="per-request timeout, seconds")
+    ap.add_argument("--repeat-ratio", type=float, default=0.0, help="share of requests repeating an earlier body")
+    ap.add_argument("--stations", type=int, default=1000, help="seeded stations with --spawn")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--responses", default=None, help="saved OSRM/Google responses for the spawned fake upstream")
+    ap.add_argument("--out", default=None, help="write the report as JSON here")
+    add_fault_args(ap, prefix="upstream-", defaults=False)
+    args = ap.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if args.spawn:
+            spawn(stack, args, stack.enter_context(tempfile.TemporaryDirectory(prefix="loadgen_")))
+        faults = fault_settings(args, prefix="upstream-")
+        if faults:
+            if not args.upstream_url:
+                ap.error("--upstream-* fault settings need --upstream-url or --spawn")
+            httpx.post(f"{args.upstream_url}/__config", json=faults, timeout=10).raise_for_status()
+
+        workload = Workload(args.endpoint, args.repeat_ratio, args.backend, args.seed)
+        path = ENDPOINTS[args.endpoint]
+        phase = (args.url, path, workload, args.rps)
+        if args.warmup > 0:
+            asyncio.run(run_phase(*phase, args.warmup, args.concurrency, args.timeout))
+        if args.upstream_url:
+            httpx.post(f"{args.upstream_url}/__reset", timeout=10)
+        health_before = _get_json(f"{args.url}/api/health")
+        result = summarize(asyncio.run(run_phase(*phase, args.duration, args.concurrency, args.timeout)), args.rps)
+        upstream = _get_json(f"{args.upstream_url}/__stats") if args.upstream_url else {}
+        health_after = _get_json(f"{args.url}/api/health")
+
+        report = {
+            "endpoint": path,
+            "app": args.spawn or args.url,
+            "args": vars(args),
+            "upstream_faults": upstream.get("faults"),
+            "result": result,
+            "upstream": upstream_stage(upstream),
+            "health_delta": health_delta(health_before, health_after),
+            "health_after": health_after,
+        }
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# ml-service/benchmarks/recorded_routes.py
+"""
+Real OSRM overview geometries recorded in maps/*.html by EnhancedEVPlanner.build_map.
+Each file holds the folium polylines of one request (main route + alternatives).
+"""
+import glob
+import json
+import os
+import re
+from typing import Dict, List
+
+import numpy as np
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "maps")
+
+_POLYLINE_RE = re.compile(r"L\.polyline\(\s*(\[\[.*?\]\])", re.S)
+
+
+def load_recorded_routes(maps_dir: str = MAPS_DIR) -> Dict[str, List[np.ndarray]]:
+    """{map file stem: [route (N, 2) array, ...]} for every recorded map."""
+    out = {}
+    for path in sorted(glob.glob(os.path.join(maps_dir, "route_*.html"))):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        routes = [np.asarray(json.loads(m), dtype=np.float64) for m in _POLYLINE_RE.findall(html)]
+        if routes:
+            out[os.path.splitext(os.path.basename(path))[0]] = routes
+    return out
@@ -0,0 +1,129 @@
+# ml-service/benchmarks/replay_capture.py
+"""
+Send a saved profiling capture (services.profiling, PROFILE_DIR/<id>.json) back through the app.
+
+A capture recorded with PROFILE_KEEP_BODY=1 holds the request (method, path,
+query, JSON body) and the upstream responses the pipeline used. With --spawn
+flask|asgi those responses are served by a local fake_upstream.py
+(--responses), next to a seeded SQLite station table, so the slow case runs
+offline against the same routes; --url sends it to a running app instead.
+Each run prints the status, the total time and the Server-Timing stages next
+to the captured ones.
+
+--profile turns profiling on for every replayed request of the spawned app
+(PROFILE_SAMPLE_RATE=1, PROFILE_DIR=--profile-dir, a one-off ML_ADMIN_TOKEN
+to read them back), to compare profiles before and after a change.
+
+Usage (from ml-service/):
+    python benchmarks/replay_capture.py profiles/20261018T101500-4242-17.json --spawn flask --repeat 5
+    python benchmarks/replay_capture.py CAPTURE.json --spawn asgi --profile --profile-dir /tmp/replayed
+    python benchmarks/replay_capture.py CAPTURE.json --url http://127.0.0.1:8000
+"""
+import argparse
+import contextlib
+import json
+import os
+import secrets
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+from loadgen import APP_COMMANDS, server_timing, spawn  # noqa: E402
+
+
+def write_responses(record: Dict[str, Any], directory: str) -> int:
+    """The capture's upstream responses as one JSON file each (fake_upstream.py --responses); returns the count."""
+    n = 0
+    for api, responses in (record.get("upstream") or {}).items():
+        for i, data in enumerate(responses):
+            with open(os.path.join(directory, f"{api}_{i}.json"), "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            n += 1
+    return n
+
+
+def replay(url: str, record: Dict[str, Any], repeat: int, timeout: float) -> List[Dict[str, Any]]:
+    target = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    runs = []
+    with httpx.Client(base_url=url, timeout=timeout) as client:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            r = client.request(record["method"], target, json=record.get("body"))
+            runs.append({
+                "status": r.status_code,
+                "elapsed_ms": (time.perf_counter() - t0) * 1000,
+                "stages_ms": server_timing(r.headers.get("server-timing")),
+            })
+    return runs
+
+
+def print_runs(record: Dict[str, Any], runs: List[Dict[str, Any]]) -> None:
+    print(f"{record['method']} {record['path']}  capture {record['id']} ({record['reason']}): "
+          f"status {record['status']}, {record['elapsed_ms']:.1f} ms")
+    stages = list(record.get("stages_ms") or {})
+    for run in runs:
+        stages += [s for s in run["stages_ms"] if s not in stages and s != "total"]
+    print(f"  {'':<10}" + "".join(f"{s[:12]:>13}" for s in stages))
+    rows = [("captured", record.get("stages_ms") or {})] + [(f"run {i + 1}", r["stages_ms"]) for i, r in enumerate(runs)]
+    for label, timing in rows:
+        print(f"  {label:<10}" + "".join(f"{timing[s]:>13.1f}" if s in timing else f"{'-':>13}" for s in stages))
+    for i, run in enumerate(runs):
+        print(f"  run {i + 1}: status {run['status']}, {run['elapsed_ms']:.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("capture", help="a capture .json file from PROFILE_DIR or /debug/profiles/<id>")
+    target = ap.add_mutually_exclusive_group()
+    target.add_argument("--spawn", choices=sorted(APP_COMMANDS), help="start the fake upstream and this app locally")
+    target.add_argument("--url", default="http://127.0.0.1:8000", help="a running app")
+    ap.add_argument("--repeat", type=int, default=3, help="times to send the request")
+    ap.add_argument("--timeout", type=float, default=60.0, help="per-request timeout, seconds")
+    ap.add_argument("--stations", type=int, default=1000, help="seeded stations with --spawn")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--profile", action="store_true", help="profile every replayed request of the spawned app")
+    ap.add_argument("--profile-dir", default=None, help="PROFILE_DIR for --profile (default: a temporary directory)")
+    args = ap.parse_args()
+
+    with open(args.capture, encoding="utf-8") as f:
+        record = json.load(f)
+    if record.get("body") is None and record["method"] != "GET":
+        ap.error("the capture has no request body; record it with PROFILE_KEEP_BODY=1")
+    if args.profile and not args.spawn:
+        ap.error("--profile needs --spawn")
+
+    with contextlib.ExitStack() as stack:
+        if args.spawn:
+            tmp = stack.enter_context(tempfile.TemporaryDirectory(prefix="replay_"))
+            args.responses = os.path.join(tmp, "responses")
+            os.makedirs(args.responses)
+            print(f"{write_responses(record, args.responses)} captured upstream responses", flush=True)
+            if args.profile:
+                args.profile_dir = os.path.abspath(args.profile_dir or os.path.join(tmp, "profiles"))
+                token = secrets.token_urlsafe(16)
+                os.environ.update(PROFILE_SAMPLE_RATE="1", PROFILE_SLOW_MS="0", PROFILE_DIR=args.profile_dir,
+                                  ML_ADMIN_TOKEN=token)
+            spawn(stack, args, tmp)
+        runs = replay(args.url, record, args.repeat, args.timeout)
+        print_runs(record, runs)
+        if args.profile:
+            time.sleep(0.5)  # captures are written by a background thread
+            headers = {"Authorization": f"Bearer {token}"}
+            with httpx.Client(base_url=args.url, timeout=10, headers=headers) as client:
+                for c in client.get("/debug/profiles").json()["captures"]:
+                    detail = client.get(f"/debug/profiles/{c['id']}").json()
+                    top = ", ".join(f"{t['function']} {t.get('self_pct', t.get('self_ms'))}"
+                                    for t in detail["profile"]["top"][:5])
+                    print(f"  profile {c['id']}: {c['elapsed_ms']:.1f} ms; top: {top}")
+            if not args.profile_dir.startswith(tmp):
+                print(f"Profiles kept in {args.profile_dir}")
+
+
+if __name__ == "__main__":
+    main()
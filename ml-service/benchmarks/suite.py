@@ -0,0 +1,427 @@
+# ml-service/benchmarks/suite.py
+"""
+Offline benchmark suite for the ml-service hot paths, written as JSON so runs can be compared across commits.
+
+Benchmarks (pick with --only):
+    polyline       decode_polyline / encode_polyline over the recorded routes in maps/
+    corridor       stations_near_route of EnhancedEVPlanner and of the async
+                   GoogleEVPlanner (enhanced_ev_planner_google), and
+                   planner_google's stations_near_any_route, on the recorded routes
+    load_stations  both planners' station loading (full reload, snapshot hit,
+                   fingerprint revalidation) against SQLite, or --database-url
+    destinations   NoBookingPredictor.get_best_destination / get_best_destinations
+    dataset        model/dataset.py and create_dataset.py chunk generation (CSV text, Arrow)
+    activity       ActivityModel.predict on one row and on a batch: pickle, flat
+                   artifact and lookup table
+
+Station sets are the 131 named stations of create_dataset.py, placed at random
+over Sri Lanka and repeated under numbered names up to each --stations size.
+Every input is seeded, so two runs differ only in code and machine. Nothing
+talks to the network.
+
+Usage (from ml-service/):
+    python benchmarks/suite.py                      # benchmarks/results/<commit>.json
+    python benchmarks/suite.py --quick --only corridor activity
+    python benchmarks/suite.py --compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+from bench_proximity import synthetic_stations  # noqa: E402
+from recorded_routes import load_recorded_routes  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DATA_CSV = os.path.join(HERE, "model", "ev_activity_data_v2.csv")
+SIZES = [131, 1000, 10000, 50000]
+QUICK_SIZES = [131, 1000, 10000]
+BENCHES = ["polyline", "corridor", "load_stations", "destinations", "dataset", "activity"]
+
+
+# ---------- helpers ----------
+def timed(fn, repeat, warmup=1):
+    """Median and min wall time of fn() in ms."""
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000)
+    return {"median_ms": round(float(np.median(runs)), 4), "min_ms": round(float(np.min(runs)), 4)}
+
+
+def record(results, bench, case, params, metrics):
+    results.append({"bench": bench, "case": case, "params": params, "metrics": metrics})
+    shown = ", ".join(f"{k}={v}" for k, v in metrics.items())
+    print(f"  {bench:<13} {case:<22} {json.dumps(params):<34} {shown}", flush=True)
+
+
+def station_rows(n, seed=11):
+    """n station dicts: create_dataset.py's names at seeded random Sri Lankan coordinates."""
+    from create_dataset import stations as named
+
+    rng = np.random.default_rng(seed)
+    coords = synthetic_stations(n, seed)
+    power = rng.choice([7.0, 22.0, 50.0, 120.0], size=n)
+    count = rng.integers(1, 5, size=n)
+    rows = []
+    for i, (lat, lon) in enumerate(coords.tolist()):
+        name, city = named[i % len(named)]
+        rows.append({
+            "station_id": i + 1,
+            "name": name if i < len(named) else f"{name} #{i // len(named)}",
+            "address": city,
+            "lat": lat,
+            "lon": lon,
+            "max_power_kw": float(power[i]),
+            "charger_count": int(count[i]),
+        })
+    return rows
+
+
+def _load_script(name, path):
+    """Import a script that is not reachable as a module (model/ is shadowed by model.py)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=HERE, capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run_meta(args):
+    import sklearn
+
+    return {
+        "commit": _git("rev-parse", "HEAD") or None,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k != "compare"},
+    }
+
+
+# ---------- benchmarks ----------
+def bench_polyline(results, args):
+    from services.polyline import decode_polyline, encode_polyline
+
+    routes = [r for rs in load_recorded_routes().values() for r in rs]
+    points = sum(len(r) for r in routes)
+    encoded = [encode_polyline(r) for r in routes]
+    params = {"routes": len(routes), "points": points}
+    for case, fn in (
+        ("decode", lambda: [decode_polyline(s) for s in encoded]),
+        ("encode", lambda: [encode_polyline(r) for r in routes]),
+    ):
+        t = timed(fn, args.repeat * 4)
+        record(results, "polyline", case, params, {**t, "points_per_s": round(points / t["median_ms"] * 1000)})
+
+
+def bench_corridor(results, args):
+    import enhanced_ev_planner_google as google_enhanced
+    import planner_google
+    from enhanced_ev_planner import EnhancedEVPlanner
+    from services.cache import LRUTTLCache, TieredCache
+    from services.stations import StationSet
+
+    recorded = list(load_recorded_routes().values())
+    mains = [rs[0] for rs in recorded]
+    flask_planner = EnhancedEVPlanner(route_cache=TieredCache(LRUTTLCache()))
+    async_planner = google_enhanced.GoogleEVPlanner("benchmark")
+    any_planner = planner_google.GoogleEVPlanner("benchmark")
+    route_dtos = [
+        [planner_google.RouteDTO(distance_km=0.0, duration_min=0.0, path=[tuple(p) for p in r.tolist()]) for r in rs]
+        for rs in recorded
+    ]
+
+    for n in args.stations:
+        rows = station_rows(n)
+        t0 = time.perf_counter()
+        dicts = StationSet(rows)
+        index_ms = round((time.perf_counter() - t0) * 1000, 3)
+        dtos = StationSet(google_enhanced.StationDTO(**r) for r in rows)
+        any_dtos = StationSet(planner_google.StationDTO(**r) for r in rows)
+        params = {"stations": n, "routes": len(mains), "points": sum(len(r) for r in mains)}
+
+        matched = sum(len(flask_planner.stations_near_route(r, dicts)) for r in mains)
+        t = timed(lambda: [flask_planner.stations_near_route(r, dicts) for r in mains], args.repeat)
+        record(results, "corridor", "enhanced_ev_planner", params, {**t, "matched": matched, "index_ms": index_ms})
+
+        matched_dto = sum(len(async_planner.stations_near_route(r, dtos)) for r in mains)
+        t = timed(lambda: [async_planner.stations_near_route(r, dtos) for r in mains], args.repeat)
+        record(results, "corridor", "enhanced_ev_planner_google", params, {**t, "matched": matched_dto})
+
+        any_params = {**params, "routes": sum(len(rs) for rs in recorded),
+                      "points": sum(len(r) for rs in recorded for r in rs)}
+        matched_any = sum(len(any_planner.stations_near_any_route(rs, any_dtos)) for rs in route_dtos)
+        t = timed(lambda: [any_planner.stations_near_any_route(rs, any_dtos) for rs in route_dtos], args.repeat)
+        record(results, "corridor", "planner_google_any_route", any_params, {**t, "matched": matched_any})
+        if matched != matched_dto:
+            raise AssertionError(f"planners disagree on {n} stations: {matched} vs {matched_dto}")
+
+
+def _fill_tables(engine, station_table, charger_table, rows, string_ids):
+    """Station rows plus charger_count chargers each, via SQLAlchemy Core."""
+    def key(v):
+        return str(v) if string_ids else v
+
+    stations, chargers = [], []
+    for r in rows:
+        stations.append({"station_id": key(r["station_id"]), "name": r["name"], "address": r["address"],
+                         "latitude": r["lat"], "longitude": r["lon"]})
+        for c in range(r["charger_count"]):
+            charger = {"charger_id": key(len(chargers) + 1), "station_id": key(r["station_id"]),
+                       "power_kw": r["max_power_kw"] if c == 0 else 7.0}
+            chargers.append(charger)
+    with engine.begin() as conn:
+        conn.execute(station_table.insert(), stations)
+        conn.execute(charger_table.insert(), chargers)
+    return len(chargers)
+
+
+def _snapshot_metrics(snapshot, repeat):
+    """Full reload, TTL hit and fingerprint-only revalidation of a StationSnapshot."""
+    def reload():
+        snapshot.invalidate()
+        snapshot.get()
+
+    reload_t = timed(reload, repeat)
+    hit_t = timed(snapshot.get, repeat * 20)
+    ttl = snapshot.ttl_s
+    snapshot.ttl_s = 0.0
+    try:
+        revalidate_t = timed(snapshot.get, repeat)
+    finally:
+        snapshot.ttl_s = ttl
+    return {
+        "reload_ms": reload_t["median_ms"],
+        "hit_ms": hit_t["median_ms"],
+        "revalidate_ms": revalidate_t["median_ms"],
+        "loaded": len(snapshot.get()),
+    }
+
+
+def bench_load_stations(results, args):
+    import enhanced_ev_planner_google as google_enhanced
+    from flask import Flask
+    from sqlalchemy import create_engine
+
+    from enhanced_ev_planner import EnhancedEVPlanner
+    from models import Charger, Station, db
+    from services.cache import LRUTTLCache, TieredCache
+
+    def flask_planner_metrics(url, rows):
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = url
+        db.init_app(app)
+        with app.app_context():
+            if rows is not None:
+                db.create_all()
+                _fill_tables(db.engine, Station.__table__, Charger.__table__, rows, string_ids=True)
+            planner = EnhancedEVPlanner(route_cache=TieredCache(LRUTTLCache()))
+            return _snapshot_metrics(planner.station_snapshot, args.repeat)
+
+    def async_planner_metrics(url, rows):
+        engine = create_engine(url)
+        if rows is not None:
+            google_enhanced.Base.metadata.create_all(engine)
+            _fill_tables(engine, google_enhanced.Station.__table__, google_enhanced.Charger.__table__, rows,
+                         string_ids=False)
+        planner = google_enhanced.GoogleEVPlanner("benchmark")
+        planner.engine = engine
+        try:
+            return _snapshot_metrics(planner.station_snapshot, args.repeat)
+        finally:
+            engine.dispose()
+
+    with tempfile.TemporaryDirectory(prefix="bench_stations_") as tmp:
+        if args.database_url:
+            # an existing database with the app's station/charger tables; read only
+            cases = [("existing", args.database_url, args.database_url, None)]
+        else:
+            cases = [
+                (n, f"sqlite:///{os.path.join(tmp, f'flask_{n}.db')}",
+                 f"sqlite:///{os.path.join(tmp, f'async_{n}.db')}", station_rows(n))
+                for n in args.stations
+            ]
+        for n, flask_url, async_url, rows in cases:
+            params = {"stations": n, "db": flask_url.split(":", 1)[0]}
+            for case, fn, url in (("enhanced_ev_planner", flask_planner_metrics, flask_url),
+                                  ("enhanced_ev_planner_google", async_planner_metrics, async_url)):
+                try:
+                    record(results, "load_stations", case, params, fn(url, rows))
+                except Exception as e:  # e.g. the async planner's integer ids against UUID keys
+                    record(results, "load_stations", case, params, {"error": f"{type(e).__name__}: {e}"[:200]})
+
+
+def bench_destinations(results, args):
+    from model import NoBookingPredictor
+
+    predictor = NoBookingPredictor()
+    origin = (6.9271, 79.8612)  # Colombo
+    origins = synthetic_stations(100, seed=5)
+    for n in args.stations:
+        dest = synthetic_stations(n, seed=13)
+        params = {"destinations": n, "k": 5}
+        record(results, "destinations", "get_best_destination", params,
+               timed(lambda: predictor.get_best_destination(origin, dest, k=5), args.repeat * 4))
+        record(results, "destinations", "get_best_destinations", {**params, "origins": len(origins)},
+               timed(lambda: predictor.get_best_destinations(origins, dest, k=5), args.repeat))
+
+
+def bench_dataset(results, args):
+    import create_dataset
+
+    activity = _load_script("ev_activity_dataset", os.path.join(HERE, "model", "dataset.py"))
+    seed = np.random.SeedSequence(0)
+    n = args.dataset_rows
+    for module, name in ((activity, "model/dataset.py"), (create_dataset, "create_dataset.py")):
+        for case, fn in (("csv", module.csv_chunk), ("arrow", module.arrow_chunk)):
+            t = timed(lambda: fn(0, n, seed), max(1, args.repeat // 2))
+            record(results, "dataset", f"{name}:{case}", {"rows": n},
+                   {**t, "rows_per_s": round(n / t["median_ms"] * 1000)})
+
+
+def bench_activity(results, args):
+    with tempfile.TemporaryDirectory(prefix="bench_activity_") as tmp:
+        _bench_activity(results, args, tmp)
+
+
+def _bench_activity(results, args, tmp):
+    import joblib
+    import pandas as pd
+
+    from services.activity import ActivityModel, ActivityTable, load_dataset
+    from services.forest import export_forest
+    from train_activity_model import build_pipeline, package, serial, serving_rows
+
+    if args.activity_model:
+        model_path = args.activity_model
+        source = args.activity_model
+    else:
+        # a small model of the notebook's shape, so the suite runs without a trained package
+        X, y, labels = load_dataset(DATA_CSV)
+        pipeline = serial(build_pipeline(args.activity_trees, 12, n_jobs=1, n_labels=len(labels)).fit(X, y))
+        model_path = os.path.join(tmp, "model.pkl")
+        joblib.dump(package(pipeline, labels), model_path)
+        source = f"trained: {args.activity_trees} trees, depth 12"
+    given = ActivityModel.load(model_path, table_path=None)
+    cases = []
+    if given.pipeline is None:
+        # already a flat artifact: nothing to export, and no pickle case
+        flat_dir = model_path
+    else:
+        cases.append(("pickle", given))
+        flat_dir = os.path.join(tmp, "flat")
+        export_forest(given.classifier, flat_dir, extra={"labels": given.labels, "columns": given.columns,
+                                                        "source_sha256": given.sha256, "encoding": given.encoding})
+    flat = ActivityModel.load(flat_dir, table_path=None)
+    tabled = ActivityModel.load(flat_dir, table_path=None)
+    tabled.table = ActivityTable.build(given)
+    cases += [("flat", flat), ("table", tabled)]
+
+    rows = serving_rows(pd.read_csv(DATA_CSV, nrows=1000).drop(columns=["label", "city"]))
+    params = {"model": source, "batch": len(rows)}
+    for case, model in cases:
+        single = timed(lambda: model.predict(rows[:1]), args.repeat * 10)
+        batch = timed(lambda: model.predict(rows), args.repeat)
+        record(results, "activity", case, params, {
+            "single_ms": single["median_ms"],
+            "batch_ms": batch["median_ms"],
+            "batch_us_per_row": round(batch["median_ms"] * 1000 / len(rows), 2),
+        })
+
+
+# ---------- comparison ----------
+def compare(old_path, new_path, threshold):
+    """Print new/old time ratios for every (bench, case, params) present in both runs."""
+    def keyed(path):
+        with open(path, encoding="utf-8") as f:
+            run = json.load(f)
+        return run["meta"], {(r["bench"], r["case"], json.dumps(r["params"], sort_keys=True)): r["metrics"]
+                             for r in run["results"]}
+
+    old_meta, old = keyed(old_path)
+    new_meta, new = keyed(new_path)
+    print(f"old: {(old_meta.get('commit') or '?')[:10]}  new: {(new_meta.get('commit') or '?')[:10]}")
+    print(f"{'bench':<13} {'case':<28} {'params':<34} {'metric':<16} {'old':>10} {'new':>10} {'new/old':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        for metric, before in old[key].items():
+            after = new[key].get(metric)
+            if not metric.endswith(("_ms", "_us_per_row")) or not isinstance(after, (int, float)) or not before:
+                continue
+            ratio = after / before
+            flag = "  slower" if ratio > threshold else ("  faster" if ratio < 1 / threshold else "")
+            print(f"{key[0]:<13} {key[1]:<28} {key[2]:<34} {metric:<16} {before:>10.3f} {after:>10.3f} "
+                  f"{ratio:>8.2f}{flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--only", nargs="+", choices=BENCHES, default=BENCHES)
+    ap.add_argument("--stations", type=int, nargs="+", default=None, help=f"station set sizes (default {SIZES})")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--quick", action="store_true", help=f"sizes {QUICK_SIZES}, fewer repeats and rows")
+    ap.add_argument("--database-url", default=None,
+                    help="run load_stations read-only against this database instead of seeded SQLite files")
+    ap.add_argument("--dataset-rows", type=int, default=None, help="rows per generated chunk (default 200000)")
+    ap.add_argument("--activity-model", default=None,
+                    help="model package or flat artifact (default: train a small one on the repo's dataset)")
+    ap.add_argument("--activity-trees", type=int, default=50)
+    ap.add_argument("--out", default=None, help="JSON file (default benchmarks/results/<commit>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    ap.add_argument("--threshold", type=float, default=1.10, help="ratio flagged as slower / faster")
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare, args.threshold)
+        return
+    if args.stations is None:
+        args.stations = QUICK_SIZES if args.quick else SIZES
+    if args.dataset_rows is None:
+        args.dataset_rows = 50_000 if args.quick else 200_000
+    if args.quick:
+        args.repeat = min(args.repeat, 3)
+
+    meta = run_meta(args)
+    results = []
+    t0 = time.perf_counter()
+    for name in args.only:
+        print(name, flush=True)
+        globals()[f"bench_{name}"](results, args)
+    meta["duration_s"] = round(time.perf_counter() - t0, 1)
+
+    out = args.out
+    if out is None:
+        tag = (meta["commit"] or "nogit")[:10] + ("-dirty" if meta["dirty"] else "")
+        out = os.path.join(RESULTS_DIR, f"{tag}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Wrote {out} ({len(results)} results, {meta['duration_s']}s)")
+
+
+if __name__ == "__main__":
+    main()
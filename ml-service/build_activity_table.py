@@ -0,0 +1,44 @@
+# ml-service/build_activity_table.py
+"""
+Precompute the activity model's predictions over its whole input grid
+(services.activity.ActivityTable) and check them against the model.
+
+    python build_activity_table.py --model model/ev_recommendation_model.pkl
+
+Writes ACTIVITY_TABLE_PATH (next to the model by default), which the service
+picks up at startup. Rerun after retraining; a table built from another model
+file is ignored. Exits non-zero if the consistency check fails.
+"""
+import argparse
+import json
+import sys
+import time
+
+from services.activity import ACTIVITY_MODEL_PATH, ACTIVITY_TABLE_PATH, ActivityModel, ActivityTable
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--model", default=ACTIVITY_MODEL_PATH)
+    ap.add_argument("--out", default=ACTIVITY_TABLE_PATH)
+    ap.add_argument("--pipeline-samples", type=int, default=200,
+                    help="grid cells also checked through the full pipeline, one row at a time")
+    args = ap.parse_args()
+
+    model = ActivityModel.load(args.model, table_path=None)
+    t0 = time.perf_counter()
+    table = ActivityTable.build(model)
+    built_s = time.perf_counter() - t0
+
+    report = table.check(model, pipeline_samples=args.pipeline_samples)
+    report["build_s"] = round(built_s, 2)
+    print(json.dumps(report, indent=2))
+    if not report["ok"]:
+        sys.exit("Table does not match the model; not written")
+
+    table.save(args.out)
+    print(f"Wrote {args.out} ({table.codes.nbytes} bytes of label sets)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
-import csv
-import random
-from datetime import datetime, timedelta
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from services.datagen import DEFAULT_CHUNK_ROWS, default_workers, output_format, write_chunks
 
 # ------------------------------------------------------------
 # 1. STATION DATA (131 Stations from the original list)
@@ -141,225 +146,236 @@ stations = [
 film_start_times = ["12:15", "14:30", "17:00", "19:30", "22:00"]
 film_arrival_times = ["11:45", "14:00", "16:30", "19:00", "21:30"]
 
+free_time_options = [0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 2.5, 2.75, 3.0, 3.5, 4.0, 4.5, 5.0]
+free_time_weights = [0.05, 0.10, 0.10, 0.10, 0.10, 0.10, 0.10, 0.10, 0.10, 0.05, 0.05, 0.025, 0.025]
+
+# Every label(s) value the rules can produce
+LABELS = [
+    "none",
+    "tea/coffee shop",
+    "breakfast, tea/coffee shop",
+    "breakfast",
+    "lunch",
+    "dinner",
+    "shopping",
+    "dinner, shopping",
+    "lunch, shopping",
+    "watch film",
+    "visit beautiful place",
+    "breakfast, visit beautiful place",
+    "lunch, visit beautiful place",
+    "watch film, visit beautiful place",
+]
+_L = {label: i for i, label in enumerate(LABELS)}
+# Single activities as bits, for the columnar formats; "none" is 0
+ACTIVITIES = ["breakfast", "lunch", "dinner", "tea/coffee shop", "shopping", "watch film", "visit beautiful place"]
+LABEL_BITS = np.array(
+    [sum(1 << ACTIVITIES.index(a) for a in label.split(", ") if a != "none") for label in LABELS], dtype=np.uint8
+)
 
-def is_film_time(time_str):
-    """Check if time is within 30 minutes before a film"""
-    return time_str in film_arrival_times
-
-
-def get_time_period(time_str):
-    """Get time period: breakfast, lunch, dinner, or other"""
-    time_obj = datetime.strptime(time_str, "%H:%M")
-    hour = time_obj.hour
+TIME_TEXT = [f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60)]
+FILM_MINUTES = np.array([TIME_TEXT.index(t) for t in film_arrival_times])
 
-    if 7 <= hour < 9:
-        return "breakfast"
-    elif 11 <= hour < 15:
-        return "lunch"
-    elif 19 <= hour < 22:
-        return "dinner"
-    else:
-        return "other"
 
+def time_periods(hour):
+    """Time period per row: 0 breakfast, 1 lunch, 2 dinner, 3 other"""
+    return np.select(
+        [(7 <= hour) & (hour < 9), (11 <= hour) & (hour < 15), (19 <= hour) & (hour < 22)],
+        [0, 1, 2],
+        default=3,
+    )
 
-def is_tea_coffee_time(time_str):
-    """Check if time is valid for tea/coffee shop"""
-    time_obj = datetime.strptime(time_str, "%H:%M")
-    hour = time_obj.hour
-    minute = time_obj.minute
-    total_minutes = hour * 60 + minute
 
+def tea_coffee_times(hour):
+    """Rows at a valid time for tea/coffee shop"""
     # Morning: 6:00-7:00
     # Afternoon: 15:00-18:00
     # Night: 22:00-5:00 (next day)
-    return ((6 <= hour < 7) or
-            (15 <= hour < 18) or
-            (22 <= hour <= 23) or
-            (0 <= hour < 5))
-
-
-def generate_label(free_time, time_str):
-    """Generate label based on rules"""
-    time_period = get_time_period(time_str)
-
-    # RULE 1: Less than 15 minutes
-    if free_time < 0.25:
-        return "none"
-
-    # RULE 2: 30 minutes (0.5 hours)
-    elif free_time == 0.5:
-        if is_tea_coffee_time(time_str):
-            return "tea/coffee shop"
-        else:
-            return "none"  # Shouldn't happen if we generate properly
-
-    # RULE 3: 45 minutes (0.75 hours)
-    elif free_time == 0.75:
-        if time_period == "breakfast":
-            return "breakfast, tea/coffee shop"
-        elif time_period == "lunch":
-            return "lunch"
-        elif time_period == "dinner":
-            return "dinner"
-        else:
-            return "shopping"
-
-    # RULE 4: 1.0, 1.5, 2.0 hours
-    elif free_time in [1.0, 1.5, 2.0]:
-        if time_period == "breakfast":
-            return "breakfast"
-        elif time_period == "lunch":
-            return "lunch"
-        elif time_period == "dinner":
-            return "dinner"
-        else:
-            return "shopping"
-
-    # RULE 5: 2.5, 3.0 hours
-    elif free_time in [2.5, 3.0]:
-        if time_period == "dinner":
-            return "dinner, shopping"
-        elif time_period == "lunch":
-            return "lunch, shopping"
-        elif is_film_time(time_str):
-            return "watch film"
-        else:
-            return "visit beautiful place"
-
-    # RULE 6: 2.75 hours
-    elif free_time == 2.75:
-        if time_period == "breakfast":
-            return "breakfast, visit beautiful place"
-        elif time_period == "lunch":
-            return "lunch, visit beautiful place"
-        else:
-            return "visit beautiful place"
-
-    # RULE 7: More than 3.0 hours
-    elif free_time > 3.0:
-        if is_film_time(time_str):
-            return "watch film, visit beautiful place"
-        else:
-            return "visit beautiful place"
-
-    return "none"
-
-
-def generate_time_for_free_time(free_time):
-    """Generate appropriate time for given free_time"""
-    hour = random.randint(5, 22)  # 5 AM to 10 PM
-    minute = random.choice([0, 15, 30, 45])
-
-    # Adjust time based on rules
-    if free_time == 0.5:  # Tea/coffee shop times
-        time_options = [
-            (6, random.randint(0, 59)),  # 6:00-7:00
-            (random.randint(15, 17), random.randint(0, 59)),  # 15:00-18:00
-            (22, random.randint(0, 59)),  # 22:00-23:00
-            (random.randint(0, 4), random.randint(0, 59))  # 00:00-05:00
-        ]
-        hour, minute = random.choice(time_options)
-
-    elif free_time == 0.75:  # 45 minutes
-        if random.random() < 0.25:  # breakfast
-            hour = random.randint(7, 8)
-        elif random.random() < 0.5:  # lunch
-            hour = random.randint(11, 14)
-        elif random.random() < 0.75:  # dinner
-            hour = random.randint(19, 21)
-        else:  # shopping
-            hour = random.choice([5, 9, 10, 15, 16, 17, 18, 22])
-
-    elif free_time in [1.0, 1.5, 2.0]:
-        if random.random() < 0.33:  # breakfast
-            hour = random.randint(7, 8)
-        elif random.random() < 0.66:  # lunch
-            hour = random.randint(11, 14)
-        else:  # dinner or shopping
-            if random.random() < 0.5:
-                hour = random.randint(19, 21)
-            else:
-                hour = random.choice([5, 6, 9, 10, 15, 16, 17, 18, 22])
-
-    elif free_time in [2.5, 3.0]:
-        rand_val = random.random()
-        if rand_val < 0.25:  # dinner + shopping
-            hour = random.randint(19, 21)
-        elif rand_val < 0.5:  # lunch + shopping
-            hour = random.randint(11, 14)
-        elif rand_val < 0.75:  # film time
-            return random.choice(film_arrival_times)
-        else:  # visit beautiful place
-            hour = random.choice([5, 6, 7, 8, 9, 10, 15, 16, 17, 18, 22])
-
-    elif free_time == 2.75:
-        if random.random() < 0.33:  # breakfast + visit
-            hour = random.randint(7, 8)
-        elif random.random() < 0.66:  # lunch + visit
-            hour = random.randint(11, 14)
-        else:  # just visit
-            hour = random.choice([5, 6, 9, 10, 15, 16, 17, 18, 19, 20, 21, 22])
-
-    elif free_time > 3.0:
-        if random.random() < 0.3:  # film time
-            return random.choice(film_arrival_times)
-        else:  # visit beautiful place
-            hour = random.randint(5, 22)
-
-    # Format time as HH:MM
-    return f"{hour:02d}:{minute:02d}"
+    return (((6 <= hour) & (hour < 7)) |
+            ((15 <= hour) & (hour < 18)) |
+            ((22 <= hour) & (hour <= 23)) |
+            ((0 <= hour) & (hour < 5)))
+
+
+def generate_labels(free_time, minute_of_day):
+    """Label per row (position in LABELS) based on rules, one mask per rule"""
+    hour = minute_of_day // 60
+    period = time_periods(hour)
+    breakfast, lunch, dinner = period == 0, period == 1, period == 2
+    film = np.isin(minute_of_day, FILM_MINUTES)
+
+    def pick(*cases, default):
+        return np.select([c for c, _ in cases], [_L[l] for _, l in cases], default=_L[default])
+
+    rules = [
+        # RULE 1: Less than 15 minutes (and 15 minutes itself, as before)
+        (free_time <= 0.25, np.full(len(free_time), _L["none"])),
+        # RULE 2: 30 minutes (0.5 hours)
+        (free_time == 0.5, pick((tea_coffee_times(hour), "tea/coffee shop"), default="none")),
+        # RULE 3: 45 minutes (0.75 hours)
+        (free_time == 0.75, pick((breakfast, "breakfast, tea/coffee shop"), (lunch, "lunch"), (dinner, "dinner"),
+                                 default="shopping")),
+        # RULE 4: 1.0, 1.5, 2.0 hours
+        (np.isin(free_time, [1.0, 1.5, 2.0]), pick((breakfast, "breakfast"), (lunch, "lunch"), (dinner, "dinner"),
+                                                   default="shopping")),
+        # RULE 5: 2.5, 3.0 hours
+        (np.isin(free_time, [2.5, 3.0]), pick((dinner, "dinner, shopping"), (lunch, "lunch, shopping"),
+                                              (film, "watch film"), default="visit beautiful place")),
+        # RULE 6: 2.75 hours
+        (free_time == 2.75, pick((breakfast, "breakfast, visit beautiful place"),
+                                 (lunch, "lunch, visit beautiful place"), default="visit beautiful place")),
+        # RULE 7: More than 3.0 hours
+        (free_time > 3.0, pick((film, "watch film, visit beautiful place"), default="visit beautiful place")),
+    ]
+    return np.select([m for m, _ in rules], [l for _, l in rules], default=_L["none"])
+
+
+def generate_times(free_time, rng):
+    """Appropriate minute of day per row for its free_time"""
+    n = len(free_time)
+    u = rng.random((3, n))
+
+    def hours(lo, hi):  # inclusive, like random.randint
+        return rng.integers(lo, hi + 1, size=n)
+
+    def one_of(values):
+        return np.asarray(values)[rng.integers(len(values), size=n)]
+
+    film = one_of(FILM_MINUTES)
+    minute = one_of([0, 15, 30, 45])
+    hour = hours(5, 22)  # 5 AM to 10 PM
+
+    # Tea/coffee shop times: 6:00-7:00, 15:00-18:00, 22:00-23:00, 00:00-05:00, any minute
+    tea_option = rng.integers(4, size=n)
+    tea_hour = np.choose(tea_option, [np.full(n, 6), hours(15, 17), np.full(n, 22), hours(0, 4)])
+    tea = tea_hour * 60 + rng.integers(0, 60, size=n)
+
+    h45 = np.select(
+        [u[0] < 0.25, u[1] < 0.5, u[2] < 0.75],  # breakfast, lunch, dinner
+        [hours(7, 8), hours(11, 14), hours(19, 21)],
+        default=one_of([5, 9, 10, 15, 16, 17, 18, 22]),  # shopping
+    )
+    h1_2 = np.select(
+        [u[0] < 0.33, u[1] < 0.66, u[2] < 0.5],  # breakfast, lunch, dinner
+        [hours(7, 8), hours(11, 14), hours(19, 21)],
+        default=one_of([5, 6, 9, 10, 15, 16, 17, 18, 22]),  # shopping
+    )
+    h2_5 = np.select(
+        [u[0] < 0.25, u[0] < 0.5],  # dinner + shopping, lunch + shopping
+        [hours(19, 21), hours(11, 14)],
+        default=one_of([5, 6, 7, 8, 9, 10, 15, 16, 17, 18, 22]),  # visit beautiful place
+    )
+    h2_75 = np.select(
+        [u[0] < 0.33, u[1] < 0.66],  # breakfast + visit, lunch + visit
+        [hours(7, 8), hours(11, 14)],
+        default=one_of([5, 6, 9, 10, 15, 16, 17, 18, 19, 20, 21, 22]),  # just visit
+    )
+
+    return np.select(
+        [
+            free_time == 0.5,
+            free_time == 0.75,
+            np.isin(free_time, [1.0, 1.5, 2.0]),
+            np.isin(free_time, [2.5, 3.0]) & (u[0] >= 0.5) & (u[0] < 0.75),  # film time
+            np.isin(free_time, [2.5, 3.0]),
+            free_time == 2.75,
+            (free_time > 3.0) & (u[0] < 0.3),  # film time
+        ],
+        [tea, h45 * 60 + minute, h1_2 * 60 + minute, film, h2_5 * 60 + minute, h2_75 * 60 + minute, film],
+        default=hour * 60 + minute,
+    )
 
 
 # ------------------------------------------------------------
 # 3. GENERATE DATASET
 # ------------------------------------------------------------
-def generate_dataset(num_rows=2000):
-    """Generate the dataset with specified number of rows"""
-    dataset = []
-    free_time_options = [0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 2.5, 2.75, 3.0, 3.5, 4.0, 4.5, 5.0]
-
-    for i in range(num_rows):
-        # Select random station
-        station_name, city = random.choice(stations)
-
-        # Select free_time with weighted distribution
-        free_time = random.choices(
-            free_time_options,
-            weights=[0.05, 0.10, 0.10, 0.10, 0.10, 0.10, 0.10, 0.10, 0.10, 0.05, 0.05, 0.025, 0.025]
-        )[0]
-
-        # Generate appropriate time
-        time_str = generate_time_for_free_time(free_time)
-
-        # Generate label based on rules
-        label = generate_label(free_time, time_str)
-
-        dataset.append({
-            "free_time": free_time,
-            "station_name": station_name,
-            "time": time_str,
-            "city": city,
-            "label(s)": label
-        })
-
-    return dataset
+HEADER = ["free_time", "station_name", "time", "city", "label(s)"]
+
+
+def draw(n, seed_seq):
+    """n rows as code arrays: free_time option, station, minute of day, label"""
+    rng = np.random.default_rng(seed_seq)
+    station = rng.integers(len(stations), size=n)
+    # free_time with weighted distribution
+    option = rng.choice(len(free_time_options), size=n, p=free_time_weights)
+    free_time = np.asarray(free_time_options)[option]
+    minute_of_day = generate_times(free_time, rng)
+    return {
+        "free_time": option,
+        "station": station,
+        "minute_of_day": minute_of_day,
+        "label": generate_labels(free_time, minute_of_day),
+    }
+
+
+def generate_chunk(index, n, seed_seq):
+    """n rows as a DataFrame with the CSV's columns"""
+    rows = draw(n, seed_seq)
+    return pd.DataFrame({
+        "free_time": np.asarray(free_time_options)[rows["free_time"]],
+        "station_name": np.array([s for s, _ in stations], dtype=object)[rows["station"]],
+        "time": np.asarray(TIME_TEXT, dtype=object)[rows["minute_of_day"]],
+        "city": np.array([c for _, c in stations], dtype=object)[rows["station"]],
+        "label(s)": np.asarray(LABELS, dtype=object)[rows["label"]],
+    }, columns=HEADER)
 
 
 # ------------------------------------------------------------
 # 4. SAVE TO CSV
 # ------------------------------------------------------------
-def save_to_csv(dataset, filename="ev_charging_activities.csv"):
-    """Save dataset to CSV file"""
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['free_time', 'station_name', 'time', 'city', 'label(s)']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for row in dataset:
-            writer.writerow(row)
+def _csv_field(value):
+    value = str(value)
+    return '"' + value.replace('"', '""') + '"' if any(c in value for c in ',"\n') else value
+
+
+# A CSV line from pre-rendered pieces: "free_time,station_name," + "time," + "city,label(s)\n"
+_CSV_FREE_STATION = np.array(
+    [f"{f},{_csv_field(s)}," for f in free_time_options for s, _ in stations], dtype=object
+)
+_CSV_TIME = np.array([t + "," for t in TIME_TEXT], dtype=object)
+_CSV_CITY_LABEL = np.array(
+    [f"{_csv_field(c)},{_csv_field(l)}\n" for _, c in stations for l in LABELS], dtype=object
+)
+
+
+def csv_chunk(index, n, seed_seq):
+    """The same rows as generate_chunk, as CSV text (header on the first chunk)"""
+    rows = draw(n, seed_seq)
+    parts = np.empty(3 * n, dtype=object)
+    parts[0::3] = _CSV_FREE_STATION[rows["free_time"] * len(stations) + rows["station"]]
+    parts[1::3] = _CSV_TIME[rows["minute_of_day"]]
+    parts[2::3] = _CSV_CITY_LABEL[rows["station"] * len(LABELS) + rows["label"]]
+    header = ",".join(HEADER) + "\n" if index == 0 else ""
+    return header + "".join(parts.tolist())
+
+
+def arrow_chunk(index, n, seed_seq):
+    """
+    The same rows as generate_chunk as a pyarrow Table: time as minute_of_day,
+    station/city dictionary-encoded in station list order, label(s) as an
+    ACTIVITIES bitmask (bit order in the schema metadata under "labels")
+    """
+    import pyarrow as pa
+
+    rows = draw(n, seed_seq)
+    station = rows["station"].astype(np.int16)
+    cities = list(dict.fromkeys(c for _, c in stations))
+    city = np.array([cities.index(c) for _, c in stations], dtype=np.int16)[station]
+    return pa.table({
+        "free_time": pa.array(np.asarray(free_time_options, dtype=np.float32)[rows["free_time"]]),
+        "station_name": pa.DictionaryArray.from_arrays(pa.array(station), pa.array([s for s, _ in stations])),
+        "minute_of_day": pa.array(rows["minute_of_day"].astype(np.uint16)),
+        "city": pa.DictionaryArray.from_arrays(pa.array(city), pa.array(cities)),
+        "label": pa.array(LABEL_BITS[rows["label"]]),
+    }, metadata={"labels": json.dumps(ACTIVITIES)})
+
+
+def save_to_csv(num_rows, filename, seed=None, workers=1, chunk_rows=DEFAULT_CHUNK_ROWS, fmt="csv"):
+    """Generate num_rows rows straight into a file, chunk by chunk (CSV, or Parquet / Arrow with fmt)"""
+    written = write_chunks(csv_chunk, arrow_chunk, filename, fmt, num_rows, chunk_rows, seed, workers)
 
     print(f"✅ Dataset saved to {filename}")
-    print(f"📊 Total rows: {len(dataset)}")
+    print(f"📊 Total rows: {num_rows:,} ({written / 1e6:.1f} MB)")
     print(f"📁 File ready for download")
 
 
@@ -367,6 +383,17 @@ def save_to_csv(dataset, filename="ev_charging_activities.csv"):
 # 5. MAIN EXECUTION
 # ------------------------------------------------------------
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Generate the EV charging activities dataset (CSV, Parquet or Arrow).")
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--out", default=None,
+                    help="default ml_model/ev_charging_dataset_2000_rules_applied.csv, with the format's extension")
+    ap.add_argument("--format", choices=["csv", "parquet", "arrow"], default=None,
+                    help="default: from the --out extension, else csv")
+    ap.add_argument("--seed", type=int, default=None, help="same seed and chunk size, same file")
+    ap.add_argument("--workers", type=int, default=default_workers())
+    ap.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = ap.parse_args()
+
     print("🚗 Generating EV Charging Activities Dataset...")
     print("📝 Rules applied:")
     print("   1. <0.25h: none")
@@ -378,15 +405,20 @@ if __name__ == "__main__":
     print("   7. >3.0h: watch film+visit or visit")
     print("")
 
-    # Generate dataset
-    dataset = generate_dataset(2000)
+    fmt = output_format(args.out or "", args.format)
+    out = args.out or "ml_model/ev_charging_dataset_2000_rules_applied." + fmt
 
-    # Save to CSV
-    save_to_csv(dataset, "ml_model/ev_charging_dataset_2000_rules_applied.csv")
+    # Generate dataset and save it
+    t0 = time.perf_counter()
+    save_to_csv(args.rows, out, args.seed, args.workers, args.chunk_rows, fmt)
+    print(f"⏱️ {time.perf_counter() - t0:.1f}s")
 
     # Show sample
     print("\n📋 Sample rows:")
-    for i in range(5):
-        row = dataset[i]
-        print(
-            f"Row {i + 1}: {row['free_time']}h at {row['station_name']}, {row['time']}, {row['city']} → {row['label(s)']}")
\ No newline at end of file
+    if fmt == "csv":
+        for i, row in pd.read_csv(out, nrows=5).iterrows():
+            print(
+                f"Row {i + 1}: {row['free_time']}h at {row['station_name']}, {row['time']}, {row['city']} → "
+                f"{row['label(s)']}")
+    else:
+        print((pd.read_parquet(out) if fmt == "parquet" else pd.read_feather(out)).head())
@@ -4,60 +4,65 @@ import math
 import os
 from typing import List, Tuple, Dict, Any
 
-import requests
-from geopy.distance import geodesic
 from flask import current_app
 from sqlalchemy import func
 
 from models import db, Station, Charger
-
-OSRM_URL = "https://router.project-osrm.org/route/v1/driving"
-
-def _haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
-  # quick haversine in km
-  return geodesic(a, b).km
-
-def _decode_polyline5(polyline_str: str) -> List[Tuple[float, float]]:
-    # Polyline algorithm (Google, precision 1e-5)
-    index, lat, lng, coordinates = 0, 0, 0, []
-    while index < len(polyline_str):
-        result, shift = 0, 0
-        while True:
-            b = ord(polyline_str[index]) - 63
-            index += 1
-            result |= (b & 0x1f) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlat = ~(result >> 1) if result & 1 else (result >> 1)
-        lat += dlat
-
-        result, shift = 0, 0
-        while True:
-            b = ord(polyline_str[index]) - 63
-            index += 1
-            result |= (b & 0x1f) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlng = ~(result >> 1) if result & 1 else (result >> 1)
-        lng += dlng
-
-        coordinates.append((lat / 1e5, lng / 1e5))
-    return coordinates
-
-def _point_segment_distance_km(p: Tuple[float, float], a: Tuple[float, float], b: Tuple[float, float]) -> float:
-    # distance from point p to segment ab by sampling — use geodesic for accuracy
-    # project approximately by subdividing segment if very long; here direct min of endpoints + midpoint is fine for short polylines
-    d_pa = _haversine_km(p, a)
-    d_pb = _haversine_km(p, b)
-    mid = ((a[0] + b[0]) / 2.0, (a[1] + b[1]) / 2.0)
-    d_pm = _haversine_km(p, mid)
-    return min(d_pa, d_pb, d_pm)
+from services.cache import TieredCache, get_route_cache, route_cache_key
+from services.charging import DETOUR_FACTOR, optimize_charging_stops
+from services.metrics import stage
+from services.profiling import attach
+from services.polyline import decode_polyline
+from services.proximity import as_coords
+from services.routing import AsyncOSRMClient, OSRMClient
+from services.singleflight import SingleFlight
+from services.stations import StationSnapshot, station_index, stations_fingerprint
 
 class EnhancedEVPlanner:
-    def __init__(self, max_station_distance_km: float = 5.0):
+    def __init__(
+        self,
+        max_station_distance_km: float = 5.0,
+        route_cache: TieredCache = None,
+        osrm: OSRMClient = None,
+    ):
         self.max_station_distance_km = max_station_distance_km
+        self.route_cache = route_cache or get_route_cache()
+        self.osrm = osrm or OSRMClient()
+        self.station_snapshot = StationSnapshot(
+            self._query_stations,
+            self._stations_fingerprint,
+        )
+        # concurrent identical corridor requests share one computation
+        self.flights = SingleFlight()
+
+    # ---------- CORRIDOR (routes + nearby stations) ----------
+    def route_corridor(
+        self,
+        start: Tuple[float, float],
+        end: Tuple[float, float],
+        waypoints: List[Tuple[float, float]] = None,
+        alternatives: int = 2,
+        stations: List[Dict[str, Any]] = None,
+    ) -> Tuple[List[Dict[str, Any]], List[List[Dict[str, Any]]]]:
+        """
+        (routes, stations near each route: one list per route, same order).
+        Requests whose grid-snapped start/end/waypoints match one already in
+        flight wait for it and get the same result (treat it as read-only).
+        stations: an already loaded snapshot (batch jobs share one); when None the
+        snapshot is read after routing, which needs an app context.
+        """
+        cache_key = self._osrm_request(start, end, waypoints, alternatives)[0]
+        return self.flights.do(cache_key, lambda: self._route_corridor(start, end, waypoints, alternatives, stations))
+
+    def _route_corridor(self, start, end, waypoints, alternatives, stations):
+        routes = self.get_routes_from_osrm(start, end, waypoints=waypoints, alternatives=alternatives)
+        if not routes:
+            return routes, []
+        if stations is None:
+            stations = self.load_stations()
+        # Proximity on the full geometry: the station index keeps it cheaper than
+        # simplifying first (responses simplify only the paths they return)
+        return routes, self.stations_near_routes([r["path"] for r in routes], stations)
 
     # ---------- ROUTING (OSRM) ----------
     def get_routes_from_osrm(
@@ -69,15 +74,43 @@ class EnhancedEVPlanner:
     ) -> List[Dict[str, Any]]:
         """
         Returns a list of alternative routes sorted by duration (ascending).
-        Each route: { distance_km, duration_min, path: [(lat,lon), ...] }
+        Each route: { distance_km, duration_min, path }, with path as a float64
+        (N, 2) array of (lat, lon).
         """
-        coords_chain = [f"{start[1]},{start[0]}"]
-        waypoints = waypoints or []
-        for w in waypoints:
-            coords_chain.append(f"{w[1]},{w[0]}")
-        coords_chain.append(f"{end[1]},{end[0]}")
+        cache_key, points, params = self._osrm_request(start, end, waypoints, alternatives)
+        data = self.route_cache.get(cache_key)
+        if data is None:
+            with stage("osrm"):
+                data = self.osrm.route(points, params)
+            if data.get("code") == "Ok" and data.get("routes"):
+                self.route_cache.set(cache_key, data)
+        attach("osrm", data)
+        return self.routes_from_osrm_json(data)
 
-        url = f"{OSRM_URL}/{';'.join(coords_chain)}"
+    async def aget_routes_from_osrm(
+        self,
+        client: AsyncOSRMClient,
+        start: Tuple[float, float],
+        end: Tuple[float, float],
+        waypoints: List[Tuple[float, float]] = None,
+        alternatives: int = 2
+    ) -> Dict[str, Any]:
+        """
+        Event-loop variant of get_routes_from_osrm: same cache, but returns the raw
+        OSRM JSON so the caller can run routes_from_osrm_json off the loop.
+        """
+        cache_key, points, params = self._osrm_request(start, end, waypoints, alternatives)
+        data = await self.route_cache.aget(cache_key)
+        if data is None:
+            with stage("osrm"):
+                data = await client.route(points, params)
+            if data.get("code") == "Ok" and data.get("routes"):
+                await self.route_cache.aset(cache_key, data)
+        attach("osrm", data)
+        return data
+
+    def _osrm_request(self, start, end, waypoints, alternatives):
+        waypoints = waypoints or []
         params = {
             "overview": "full",
             "alternatives": str(alternatives).lower(),  # 'true' or 'false'
@@ -90,45 +123,71 @@ class EnhancedEVPlanner:
         # requesting 'true' and OSRM returns up to 3. Set 'alternatives=true'.
         params["alternatives"] = "true" if alternatives and alternatives > 0 else "false"
 
-        r = requests.get(url, params=params, timeout=20)
-        r.raise_for_status()
-        data = r.json()
+        # Raw OSRM JSON is cached under grid-snapped coordinates
+        cache_key = route_cache_key("osrm", start, end, waypoints, alternatives=params["alternatives"])
+        return cache_key, [start, *waypoints, end], params
+
+    def routes_from_osrm_json(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Decode an OSRM /route response, shortest duration first."""
         if data.get("code") != "Ok" or not data.get("routes"):
             return []
 
-        routes = []
-        for rt in data["routes"]:
-            dist_km = (rt["distance"] or 0) / 1000.0
-            dur_min = (rt["duration"] or 0) / 60.0
-            path = _decode_polyline5(rt["geometry"])
-            routes.append({
-                "distance_km": dist_km,
-                "duration_min": dur_min,
-                "path": path
-            })
+        with stage("decode"):
+            rows = [
+                (
+                    (rt["distance"] or 0) / 1000.0,
+                    (rt["duration"] or 0) / 60.0,
+                    decode_polyline(rt["geometry"]),
+                )
+                for rt in data["routes"]
+            ]
+        routes = self.route_entries(rows)
 
         # Sort by duration ascending, shortest first
         routes.sort(key=lambda x: x["duration_min"])
         return routes
 
+    def route_entries(self, rows: List[Tuple[float, float, Any]]) -> List[Dict[str, Any]]:
+        """
+        Route dicts in the shape the endpoints expect from (distance_km,
+        duration_min, path) rows of any routing backend.
+        """
+        return [
+            {"distance_km": distance_km, "duration_min": duration_min, "path": as_coords(path)}
+            for distance_km, duration_min, path in rows
+        ]
+
     # ---------- STATIONS ----------
     def load_stations(self) -> List[Dict[str, Any]]:
+        """
+        All stations + their charger info, served from the process-level snapshot
+        (reloaded only when the station/charger tables change or on invalidate).
+        """
+        with stage("stations"):
+            return self.station_snapshot.get()
+
+    def _stations_fingerprint(self):
+        with stage("db_fingerprint"):
+            return stations_fingerprint(db.session, Station, Charger)
+
+    def _query_stations(self) -> List[Dict[str, Any]]:
         """
         Load all stations + their charger info (max power, status counts).
         """
-        # Pull stations
-        stations = db.session.query(Station).all()
+        with stage("db_stations"):
+            # Pull stations
+            stations = db.session.query(Station).all()
 
-        # Build map for chargers grouped by station
-        chargers = (
-            db.session.query(
-                Charger.station_id,
-                func.max(Charger.power_kw).label("max_power_kw"),
-                func.count(Charger.charger_id).label("charger_count")
+            # Build map for chargers grouped by station
+            chargers = (
+                db.session.query(
+                    Charger.station_id,
+                    func.max(Charger.power_kw).label("max_power_kw"),
+                    func.count(Charger.charger_id).label("charger_count")
+                )
+                .group_by(Charger.station_id)
+                .all()
             )
-            .group_by(Charger.station_id)
-            .all()
-        )
         chargers_by_station = {c.station_id: {"max_power_kw": float(c.max_power_kw or 0.0),
                                               "charger_count": int(c.charger_count or 0)}
                                for c in chargers}
@@ -150,30 +209,94 @@ class EnhancedEVPlanner:
     def stations_near_route(self, route_polyline: List[Tuple[float, float]], stations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Returns stations within self.max_station_distance_km from the route polyline.
-        Adds distance_to_route_km to each matched station and sorts by it.
+        Adds distance_to_route_km (cross-track) and distance_from_start_km (progress
+        along the route) to each matched station and sorts by distance_to_route_km.
+        """
+        if not stations:
+            return []
+
+        with stage("proximity"):
+            idx, cross, along = station_index(stations).near_route(route_polyline, self.max_station_distance_km)
+            return self._tag_near(stations, idx, cross, along)
+
+    def stations_near_routes(self, route_polylines: List[Any], stations: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        stations_near_route for every alternative, one list per route (same order),
+        each station also tagged with its route_index. Segments the alternatives
+        share are only measured once.
         """
+        if not stations:
+            return [[] for _ in route_polylines]
+
+        with stage("proximity"):
+            matched = station_index(stations).near_routes(route_polylines, self.max_station_distance_km)
+            return [self._tag_near(stations, *m, route_index=i) for i, m in enumerate(matched)]
+
+    @staticmethod
+    def _tag_near(stations, idx, cross, along, route_index=None) -> List[Dict[str, Any]]:
         near = []
-        for s in stations:
-            p = (s["lat"], s["lon"])
-            # min distance to any route segment (sample endpoints + midpoint)
-            best = float("inf")
-            for i in range(len(route_polyline) - 1):
-                a = route_polyline[i]
-                b = route_polyline[i + 1]
-                d = _point_segment_distance_km(p, a, b)
-                if d < best:
-                    best = d
-                    if best <= self.max_station_distance_km:
-                        # small optimization: if already inside threshold and very close, break early
-                        if best < 0.1:
-                            break
-            if best <= self.max_station_distance_km:
-                s2 = dict(s)
-                s2["distance_to_route_km"] = round(best, 2)
-                near.append(s2)
+        for i, d, a in zip(idx.tolist(), cross.tolist(), along.tolist()):
+            s2 = dict(stations[i])
+            s2["distance_to_route_km"] = round(d, 2)
+            s2["distance_from_start_km"] = round(a, 2)
+            if route_index is not None:
+                s2["route_index"] = route_index
+            near.append(s2)
         near.sort(key=lambda x: x["distance_to_route_km"])
         return near
 
+    # ---------- CHARGING PLAN ----------
+    def plan_charging_stops(self, route: Dict[str, Any], near: List[Dict[str, Any]], req: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Minimum-time charging stops along one route (see services.charging) over its
+        corridor stations. req carries the vehicle and SoC fields of
+        services.route_api.parse_plan_request. Adds drive/total minutes and the
+        station dicts to the optimizer's result; SoC values are percentages.
+        """
+        power = [s.get("max_power_kw") or 0.0 for s in near]
+        if req["max_charge_kw"] is not None:
+            power = [min(p, req["max_charge_kw"]) for p in power]
+        avg_speed_kmh = route["distance_km"] / (route["duration_min"] / 60.0) if route["duration_min"] > 0 else 60.0
+
+        with stage("charging_plan"):
+            plan = optimize_charging_stops(
+                route["distance_km"],
+                [s["distance_from_start_km"] for s in near],
+                [DETOUR_FACTOR * s["distance_to_route_km"] for s in near],
+                power,
+                battery_kwh=req["battery_kwh"],
+                kwh_per_km=req["kwh_per_km"],
+                soc_start=req["soc"],
+                min_arrival_soc=req["min_arrival_soc"],
+                max_charge_soc=req["max_charge_soc"],
+                avg_speed_kmh=avg_speed_kmh,
+            )
+        if not plan["feasible"]:
+            return plan
+
+        stops = []
+        for st in plan["stops"]:
+            station = dict(near[st["station"]])
+            station.pop("route_index", None)
+            stops.append({
+                "station": station,
+                "arrival_soc_percent": round(st["arrival_soc"] * 100),
+                "departure_soc_percent": round(st["departure_soc"] * 100),
+                "energy_kwh": round((st["departure_soc"] - st["arrival_soc"]) * req["battery_kwh"], 1),
+                "charge_min": round(st["charge_min"], 1),
+            })
+        stop_min = plan["charge_min"] + plan["detour_min"] + plan["overhead_min"]
+        return {
+            "feasible": True,
+            "stops": stops,
+            "drive_min": round(route["duration_min"] + plan["detour_min"], 0),
+            "charge_min": round(plan["charge_min"], 1),
+            "detour_km": round(plan["detour_km"], 2),
+            "overhead_min": plan["overhead_min"],
+            "total_min": round(route["duration_min"] + stop_min, 0),
+            "arrival_soc_percent": round(plan["arrival_soc"] * 100),
+        }
+
     # ---------- Optional map builder (Folium) ----------
     def build_map(self, start, end, routes, stations, filename=None):
         """
@@ -194,7 +317,7 @@ class EnhancedEVPlanner:
         colors = ["#3498db", "#e74c3c", "#2ecc71"]
         for idx, r in enumerate(routes[:3]):
             folium.PolyLine(
-                r["path"],
+                r["path"].tolist(),
                 color=colors[idx % len(colors)],
                 weight=5,
                 opacity=0.8,
@@ -1,15 +1,21 @@
 # enhanced_ev_planner_google.py
+import asyncio
 import os
 import math
 from typing import Any, Dict, List, Tuple
 
-import async_lru
 import httpx
-from geopy.distance import geodesic
 from pydantic import BaseModel
 from sqlalchemy import Column, Float, Integer, String, create_engine, func
 from sqlalchemy.orm import Session, declarative_base
 
+from services.cache import get_route_cache, route_cache_key
+from services.metrics import record_upstream_error, stage
+from services.polyline import decode_polyline
+from services.profiling import attach
+from services.routing import GOOGLE_DIRECTIONS_URL
+from services.stations import StationSnapshot, station_index, stations_fingerprint
+
 # ---------------- Pydantic DTOs ----------------
 class RouteDTO(BaseModel):
     distance_km: float
@@ -25,6 +31,8 @@ class StationDTO(BaseModel):
     max_power_kw: float = 0.0
     charger_count: int = 0
     distance_to_route_km: float | None = None
+    distance_from_start_km: float | None = None
+    route_index: int | None = None
 
 # ---------------- SQLAlchemy Models ----------------
 Base = declarative_base()
@@ -43,48 +51,6 @@ class Charger(Base):
     station_id = Column(Integer)
     power_kw = Column(Float)
 
-# ---------------- Helpers ----------------
-def _decode_polyline5(polyline_str: str) -> List[Tuple[float, float]]:
-    index = lat = lng = 0
-    coordinates = []
-
-    while index < len(polyline_str):
-        result = shift = 0
-        while True:
-            b = ord(polyline_str[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlat = ~(result >> 1) if result & 1 else (result >> 1)
-        lat += dlat
-
-        result = shift = 0
-        while True:
-            b = ord(polyline_str[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlng = ~(result >> 1) if result & 1 else (result >> 1)
-        lng += dlng
-
-        coordinates.append((lat / 1e5, lng / 1e5))
-    return coordinates
-
-def _haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
-    return geodesic(a, b).km
-
-def _point_segment_distance_km(p: Tuple[float, float], a: Tuple[float, float], b: Tuple[float, float]) -> float:
-    # sample endpoints + midpoint (fast & accurate enough for overview polylines)
-    d_pa = _haversine_km(p, a)
-    d_pb = _haversine_km(p, b)
-    mid = ((a[0] + b[0]) / 2.0, (a[1] + b[1]) / 2.0)
-    d_pm = _haversine_km(p, mid)
-    return min(d_pa, d_pb, d_pm)
-
 # ---------------- Planner ----------------
 class GoogleEVPlanner:
     def __init__(self, google_api_key: str, max_station_distance_km: float = 5.0):
@@ -106,6 +72,8 @@ class GoogleEVPlanner:
             pool_size=10,
             max_overflow=20,
         )
+        self.station_snapshot = StationSnapshot(self._query_stations, self._stations_fingerprint)
+        self.route_cache = get_route_cache()
 
         # single async client with connection pool
         self._client = httpx.AsyncClient(
@@ -115,7 +83,6 @@ class GoogleEVPlanner:
         )
 
     # --------------- Google Directions ---------------
-    @async_lru.alru_cache(maxsize=256)
     async def _google_directions_cached(
         self,
         origin: Tuple[float, float],
@@ -123,8 +90,29 @@ class GoogleEVPlanner:
         waypoints: Tuple[Tuple[float, float], ...],
         alternatives: bool,
     ) -> Dict[str, Any]:
-        base_url = "https://maps.googleapis.com/maps/api/directions/json"
-
+        cache_key = route_cache_key("google", origin, destination, waypoints, alternatives=bool(alternatives))
+        data = await self.route_cache.aget(cache_key)
+        if data is None:
+            with stage("google"):
+                try:
+                    data = await self._google_directions(origin, destination, waypoints, alternatives)
+                except httpx.HTTPError as ex:
+                    record_upstream_error("google", type(ex).__name__)
+                    raise
+            if data.get("status") == "OK":
+                await self.route_cache.aset(cache_key, data)
+            else:
+                record_upstream_error("google", str(data.get("status")))
+        attach("google", data)
+        return data
+
+    async def _google_directions(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        waypoints: Tuple[Tuple[float, float], ...],
+        alternatives: bool,
+    ) -> Dict[str, Any]:
         origin_str = f"{origin[0]},{origin[1]}"
         dest_str = f"{destination[0]},{destination[1]}"
 
@@ -140,7 +128,7 @@ class GoogleEVPlanner:
             w = "|".join([f"{lat},{lng}" for (lat, lng) in waypoints])
             params["waypoints"] = w
 
-        r = await self._client.get(base_url, params=params)
+        r = await self._client.get(GOOGLE_DIRECTIONS_URL, params=params)
         r.raise_for_status()
         return r.json()
 
@@ -160,34 +148,42 @@ class GoogleEVPlanner:
             return []
 
         routes: List[RouteDTO] = []
-        for rt in data.get("routes", []):
-            overview = rt.get("overview_polyline", {}).get("points")
-            if not overview:
-                continue
-            path = _decode_polyline5(overview)
-
-            # Sum over legs
-            dist_m = 0
-            dur_s = 0
-            for leg in rt.get("legs", []):
-                dist_m += leg.get("distance", {}).get("value", 0)
-                dur_s += leg.get("duration", {}).get("value", 0)
-
-            routes.append(
-                RouteDTO(
-                    distance_km=round(dist_m / 1000.0, 2),
-                    duration_min=round(dur_s / 60.0, 1),
-                    path=path,
+        with stage("decode"):
+            for rt in data.get("routes", []):
+                overview = rt.get("overview_polyline", {}).get("points")
+                if not overview:
+                    continue
+                path = decode_polyline(overview).tolist()
+
+                # Sum over legs
+                dist_m = 0
+                dur_s = 0
+                for leg in rt.get("legs", []):
+                    dist_m += leg.get("distance", {}).get("value", 0)
+                    dur_s += leg.get("duration", {}).get("value", 0)
+
+                routes.append(
+                    RouteDTO(
+                        distance_km=round(dist_m / 1000.0, 2),
+                        duration_min=round(dur_s / 60.0, 1),
+                        path=path,
+                    )
                 )
-            )
 
         # fastest first (Google already orders, but ensure)
         routes.sort(key=lambda r: r.duration_min)
         return routes
 
     # --------------- Stations ---------------
-    @async_lru.alru_cache(maxsize=1)
     async def load_stations(self) -> List[StationDTO]:
+        """Stations from the shared snapshot; DB work runs off the event loop."""
+        return await asyncio.to_thread(self.station_snapshot.get)
+
+    def _stations_fingerprint(self):
+        with Session(self.engine) as s:
+            return stations_fingerprint(s, Station, Charger)
+
+    def _query_stations(self) -> List[StationDTO]:
         """Load stations and aggregate charger power/count."""
         with Session(self.engine) as s:
             stations = s.query(Station).all()
@@ -232,31 +228,33 @@ class GoogleEVPlanner:
         stations: List[StationDTO],
     ) -> List[StationDTO]:
         """Return stations within threshold from the route polyline."""
-        near: List[StationDTO] = []
-        n = len(route_polyline)
+        if not stations:
+            return []
 
-        for st in stations:
-            p = (st.lat, st.lon)
-            best = float("inf")
-
-            # scan in coarse steps to reduce checks on long polylines
-            # but sample neighbors to maintain accuracy
-            step = 3 if n > 300 else 1
-            i = 0
-            while i < n - 1:
-                a = route_polyline[i]
-                b = route_polyline[i + 1]
-                d = _point_segment_distance_km(p, a, b)
-                if d < best:
-                    best = d
-                    if best < 0.15:  # ~150m early stop
-                        break
-                i += step
-
-            if best <= self.max_station_distance_km:
-                st_copy = st.copy()
-                st_copy.distance_to_route_km = round(best, 2)
-                near.append(st_copy)
+        idx, cross, along = station_index(stations).near_route(route_polyline, self.max_station_distance_km)
+        return self._tag_near(stations, idx, cross, along)
+
+    def stations_near_routes(
+        self,
+        route_polylines: List[List[Tuple[float, float]]],
+        stations: List[StationDTO],
+    ) -> List[List[StationDTO]]:
+        """stations_near_route for every alternative (shared segments measured once), tagged with route_index."""
+        if not stations:
+            return [[] for _ in route_polylines]
+
+        matched = station_index(stations).near_routes(route_polylines, self.max_station_distance_km)
+        return [self._tag_near(stations, *m, route_index=i) for i, m in enumerate(matched)]
+
+    @staticmethod
+    def _tag_near(stations, idx, cross, along, route_index=None) -> List[StationDTO]:
+        near: List[StationDTO] = []
+        for i, d, a in zip(idx.tolist(), cross.tolist(), along.tolist()):
+            st_copy = stations[i].copy()
+            st_copy.distance_to_route_km = round(d, 2)
+            st_copy.distance_from_start_km = round(a, 2)
+            st_copy.route_index = route_index
+            near.append(st_copy)
 
         near.sort(key=lambda s: (s.distance_to_route_km or 0.0, -s.max_power_kw))
         return near
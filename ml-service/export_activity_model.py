@@ -0,0 +1,71 @@
+# ml-service/export_activity_model.py
+"""
+Export the activity model's forest to a flat, memory-mappable artifact
+(services.forest) and check it predicts exactly what the pickle does.
+
+    python export_activity_model.py --model model/ev_recommendation_model.pkl
+
+Writes model/ev_recommendation_model.flat/ by default. Point
+ACTIVITY_MODEL_PATH at that directory to serve from it: workers then start
+without unpickling and share the tree arrays through the page cache. A lookup
+table built from the pickle stays valid for the artifact. Exits non-zero if
+the check fails.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from services.activity import ACTIVITY_MODEL_PATH, ActivityModel, ActivityTable
+from services.forest import export_forest
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--model", default=ACTIVITY_MODEL_PATH)
+    ap.add_argument("--out", default=None, help="artifact directory (default: next to the model, .flat)")
+    args = ap.parse_args()
+    out = args.out or os.path.splitext(args.model)[0] + ".flat"
+
+    model = ActivityModel.load(args.model, table_path=None)
+    staging = out + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    t0 = time.perf_counter()
+    meta = export_forest(
+        model.classifier,
+        staging,
+        extra={"labels": model.labels, "columns": model.columns, "source_sha256": model.sha256,
+               "encoding": model.encoding},
+    )
+    export_s = time.perf_counter() - t0
+
+    # every on-grid input, through both models
+    flat = ActivityModel.load(staging, table_path=None)
+    X = model.features(*ActivityTable.grid())
+    mismatches = int(np.count_nonzero(
+        np.asarray(model.classifier.predict(X)) != flat.classifier.predict(X)
+    ))
+    size = sum(os.path.getsize(os.path.join(staging, f)) for f in os.listdir(staging))
+    print(json.dumps({
+        "trees": sum(o["trees"] for o in meta["outputs"]),
+        "nodes": int(len(flat.classifier.feature)),
+        "bytes": size,
+        "export_s": round(export_s, 2),
+        "checked_rows": len(X),
+        "mismatches": mismatches,
+    }, indent=2))
+    if mismatches:
+        shutil.rmtree(staging)
+        sys.exit("Flat artifact does not match the model; not written")
+
+    shutil.rmtree(out, ignore_errors=True)
+    os.replace(staging, out)
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,137 @@
 # model.py
-from geopy.distance import geodesic
+import numpy as np
+
+from services.proximity import as_coords, haversine_km
+
+# Origin x destination cells per pass in get_best_destinations (~16 MB float64)
+MATRIX_CHUNK_CELLS = 2_000_000
+# Destinations returned per origin unless k is given (None: all of them)
+DEFAULT_TOP_K = 5
+
+
+def _unit_vectors(coords):
+    """(lat, lon) degrees -> (N, 3) points on the unit sphere."""
+    lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=1)
+
+
+def _destination(destinations, coords, i):
+    """The caller's own destination object at i; rows of an array input come back as (lat, lon) tuples."""
+    if isinstance(destinations, np.ndarray):
+        return tuple(coords[i].tolist())
+    return destinations[i]
+
+
+def _indexable(destinations):
+    return destinations if isinstance(destinations, (list, tuple, np.ndarray)) else list(destinations)
+
 
 class NoBookingPredictor:
     """
     Simple heuristic predictor: ranks destinations by estimated travel time.
-    Uses straight-line distance / avg_speed_kmph to approximate seconds.
-    Replace with your real ML or OSRM table API when ready.
+    Uses straight-line distance / avg_speed_kmph to approximate seconds, or
+    driving times from an OSRM /table call when use_table is set.
+    Replace with your real ML model when ready.
     """
 
-    def __init__(self, avg_speed_kmph=50.0):
+    def __init__(self, avg_speed_kmph=50.0, osrm=None, table_candidates=25):
         self.speed = max(10.0, float(avg_speed_kmph))  # prevent zero/too small
+        # services.routing.OSRMClient for use_table; created on first use
+        self.osrm = osrm
+        # straight-line shortlist size sent to /table when ranking top-k
+        self.table_candidates = table_candidates
 
-    def get_best_destination(self, origin, destinations):
+    def straight_line_seconds(self, origin, destinations):
+        """Travel-time estimate (s) for every destination, as one array."""
+        coords = as_coords(destinations)
+        km = haversine_km(origin[0], origin[1], coords[:, 0], coords[:, 1])
+        return km / self.speed * 3600.0
+
+    def get_best_destination(self, origin, destinations, k=DEFAULT_TOP_K, use_table=False):
         """
         origin: (lat, lon)
-        destinations: [(lat, lon), ...]
-        returns: [{destination:(lat,lon), travel_time: seconds}, ...] sorted asc
+        destinations: [(lat, lon), ...] or an (N, 2) array
+        k: only return the k fastest (None: all of them)
+        use_table: rank by OSRM driving time; only the max(k, table_candidates)
+                   straight-line nearest are sent to OSRM, and destinations it
+                   cannot route to are left out
+        returns: [{destination, travel_time: seconds}, ...] sorted asc, where
+                 destination is the caller's object ((lat, lon) for array rows)
+        """
+        destinations = _indexable(destinations)
+        coords = as_coords(destinations)
+        seconds = self.straight_line_seconds(origin, coords)
+        picked = self._fastest(seconds, k)
+
+        if use_table and len(picked):
+            shortlist = self._fastest(seconds, max(k or len(coords), self.table_candidates))
+            durations = self._table_client().table_durations(tuple(origin), [tuple(p) for p in coords[shortlist].tolist()])
+            routed = np.array([np.inf if d is None else d for d in durations])
+            seconds = np.full(len(coords), np.inf)
+            seconds[shortlist] = routed
+            picked = [i for i in self._fastest(seconds, k) if np.isfinite(seconds[i])]
+
+        return [
+            {"destination": _destination(destinations, coords, i), "travel_time": float(seconds[i])}
+            for i in picked
+        ]
+
+    def get_best_destinations(self, origins, destinations, k=DEFAULT_TOP_K, max_travel_time=None,
+                              chunk_cells=MATRIX_CHUNK_CELLS):
+        """
+        Batch form of get_best_destination for many origins (straight-line only).
+        origins, destinations: [(lat, lon), ...] or (N, 2) arrays
+        k: fastest destinations kept per origin (None: all of them)
+        max_travel_time: drop destinations further than this many seconds
+        chunk_cells: bound on the origin x destination block computed at once
+        returns: one list per origin, shaped like get_best_destination's
         """
-        results = []
-        for d in destinations:
-            km = geodesic(origin, d).km
-            hours = km / self.speed
-            seconds = hours * 3600.0
-            results.append({"destination": d, "travel_time": seconds})
-        results.sort(key=lambda x: x["travel_time"])
-        return results
+        orig = as_coords(origins)
+        destinations = _indexable(destinations)
+        dest = as_coords(destinations)
+        n = len(dest)
+        keep = n if k is None else max(0, min(int(k), n))
+        rows = max(1, int(chunk_cells) // max(n, 1))
+        # great-circle distance falls as the unit vectors' dot product rises, so
+        # ranking is one matmul per block; haversine only for the kept cells
+        dest_xyz = _unit_vectors(dest)
+        out = []
+        for lo in range(0, len(orig), rows):
+            block = orig[lo:lo + rows]
+            closeness = _unit_vectors(block) @ dest_xyz.T
+            if keep == 0:
+                top = np.empty((len(block), 0), dtype=np.intp)
+            elif keep < n:
+                top = np.argpartition(-closeness, keep - 1, axis=1)[:, :keep]
+            else:
+                top = np.broadcast_to(np.arange(n), closeness.shape)
+            km = haversine_km(block[:, :1], block[:, 1:], dest[top, 0], dest[top, 1])
+            seconds = km / self.speed * 3600.0
+            order = np.argsort(seconds, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            seconds = np.take_along_axis(seconds, order, axis=1)
+            for idx, secs in zip(top, seconds):
+                if max_travel_time is not None:
+                    cut = np.searchsorted(secs, max_travel_time, side="right")
+                    idx, secs = idx[:cut], secs[:cut]
+                out.append([
+                    {"destination": _destination(destinations, dest, i), "travel_time": float(t)}
+                    for i, t in zip(idx, secs)
+                ])
+        return out
+
+    @staticmethod
+    def _fastest(seconds, k):
+        """Positions of the k smallest values, ascending (argpartition, then sort only those)."""
+        if k is None or k >= len(seconds):
+            return np.argsort(seconds, kind="stable")
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        top = np.argpartition(seconds, k - 1)[:k]
+        return top[np.argsort(seconds[top], kind="stable")]
+
+    def _table_client(self):
+        if self.osrm is None:
+            from services.routing import OSRMClient
+            self.osrm = OSRMClient()
+        return self.osrm
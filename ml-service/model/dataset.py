@@ -1,5 +1,15 @@
-import csv
-import random
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.datagen import DEFAULT_CHUNK_ROWS, default_workers, output_format, write_chunks  # noqa: E402
 
 # Configuration
 NUM_ROWS = 20000
@@ -10,108 +20,185 @@ cities = ["Colombo", "Kandy", "Galle", "Negombo", "Katunayake", "Matara", "Kurun
 months = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November",
           "December"]
 days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+charging_times = [15, 30, 45, 60, 75, 90]
+festival_months = ["April", "December"]
+weekend_days = ["Saturday", "Sunday"]
 
+HEADER = ["charging_time", "time", "day", "month", "is_festival", "is_weekend", "city", "label"]
 
-def generate_label(charging_time, hour, is_festival, is_weekend):
+# Label set as a bitmask; a row's labels are written in this order
+LABELS = ["breakfast", "lunch", "dinner", "tea/coffee shop", "shopping", "visit beautiful place"]
+BREAKFAST, LUNCH, DINNER, TEA, SHOPPING, VISIT = (1 << i for i in range(len(LABELS)))
+# "a, b, c" text for every bitmask; 0 is "none"
+LABEL_TEXT = np.array(
+    [", ".join(l for i, l in enumerate(LABELS) if code >> i & 1) or "none" for code in range(1 << len(LABELS))],
+    dtype=object,
+)
+TIME_TEXT = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60)], dtype=object)
+
+
+def generate_labels(charging_time, hour, is_festival, is_weekend, rng):
     """
-    ML Logic Engine: Probabilistic Rule-Based Labeling
+    ML Logic Engine: Probabilistic Rule-Based Labeling, one mask per rule over
+    whole columns. Returns the label bitmask per row (0 = "none").
     Gaps are removed by checking hour ranges continuously.
     """
-    labels = []
+    n = len(charging_time)
+    # one draw for whichever random rule applies to the row (rules are exclusive), one for noise
+    u = rng.random((2, n))
+    festival = is_festival.astype(bool)
+    weekend = is_weekend.astype(bool)
+    labels = np.zeros(n, dtype=np.uint8)
 
-    # Probability Factor for Overfitting Prevention (Noise)
-    if random.random() < 0.05:
-        return "none"
+    def add(mask, bit):
+        labels[mask] |= bit
+
+    def meals(mask, breakfast, lunch, dinner):
+        add(mask & (breakfast[0] <= hour) & (hour <= breakfast[1]), BREAKFAST)
+        add(mask & (lunch[0] <= hour) & (hour <= lunch[1]), LUNCH)
+        add(mask & (dinner[0] <= hour) & (hour <= dinner[1]), DINNER)
 
     # --- Rule 1: 15 Minutes ---
-    if charging_time == 15:
-        if is_festival or random.random() < 0.15:
-            labels.append("shopping")
-        else:
-            labels.append("none")
+    m = charging_time == 15
+    add(m & (festival | (u[0] < 0.15)), SHOPPING)
 
     # --- Rule 2: 30 Minutes ---
-    elif charging_time == 30:
-        if (6 <= hour <= 9) or (15 <= hour <= 18) or (21 <= hour <= 23):
-            labels.append("tea/coffee shop")
-        if is_festival or (is_weekend and random.random() < 0.4):
-            labels.append("shopping")
-        if not labels: labels.append("none")
+    m = charging_time == 30
+    add(m & (((6 <= hour) & (hour <= 9)) | ((15 <= hour) & (hour <= 18)) | ((21 <= hour) & (hour <= 23))), TEA)
+    add(m & (festival | (weekend & (u[0] < 0.4))), SHOPPING)
 
     # --- Rule 3: 45 Minutes ---
-    elif charging_time == 45:
-        if 7 <= hour <= 9:
-            labels.append("breakfast")
-        elif 12 <= hour <= 14:
-            labels.append("lunch")
-        elif 19 <= hour <= 21:
-            labels.append("dinner")
-        else:
-            labels.append("tea/coffee shop")
-
-        if is_festival or random.random() < 0.5:
-            labels.append("shopping")
+    m = charging_time == 45
+    meals(m, (7, 9), (12, 14), (19, 21))
+    add(m & (labels == 0), TEA)
+    add(m & (festival | (u[0] < 0.5)), SHOPPING)
 
     # --- Rule 4: 60 Minutes ---
-    elif charging_time == 60:
-        if 7 <= hour <= 9:
-            labels.append("breakfast")
-        elif 12 <= hour <= 14:
-            labels.append("lunch")
-        elif 19 <= hour <= 21:
-            labels.append("dinner")
-
-        labels.append("shopping")  # High probability for shopping in 1 hour
-        if is_weekend: labels.append("visit beautiful place")
+    m = charging_time == 60
+    meals(m, (7, 9), (12, 14), (19, 21))
+    add(m, SHOPPING)  # High probability for shopping in 1 hour
+    add(m & weekend, VISIT)
 
     # --- Rule 5: 75 & 90 Minutes ---
-    elif charging_time >= 75:
-        # Meals are high priority
-        if 7 <= hour <= 10:
-            labels.append("breakfast")
-        elif 11 <= hour <= 15:
-            labels.append("lunch")
-        elif 18 <= hour <= 22:
-            labels.append("dinner")
-
-        # Leisure activities
-        if is_weekend or random.random() < 0.6:
-            labels.append("visit beautiful place")
-
-        labels.append("shopping")
-
-    # Cleanup and format
-    unique_labels = list(set(labels))
-    if len(unique_labels) > 1 and "none" in unique_labels:
-        unique_labels.remove("none")
+    m = charging_time >= 75
+    meals(m, (7, 10), (11, 15), (18, 22))  # Meals are high priority
+    add(m & (weekend | (u[0] < 0.6)), VISIT)  # Leisure activities
+    add(m, SHOPPING)
 
-    return ", ".join(unique_labels) if unique_labels else "none"
-
-
-# --- Main Generation Loop ---
-dataset = []
-for _ in range(NUM_ROWS):
-    city = random.choice(cities)
-    month = random.choice(months)
-    day = random.choice(days)
-    charging_time = random.choice([15, 30, 45, 60, 75, 90])
-
-    hour = random.randint(0, 23)
-    minute = random.choice([0, 15, 30, 45])
-    time_str = f"{hour:02d}:{minute:02d}"
-
-    is_festival = 1 if month in ["April", "December"] else 0
-    is_weekend = 1 if day in ["Saturday", "Sunday"] else 0
-
-    label = generate_label(charging_time, hour, is_festival, is_weekend)
-
-    dataset.append([charging_time, time_str, day, month, is_festival, is_weekend, city, label])
-
-# --- Save to CSV ---
-header = ["charging_time", "time", "day", "month", "is_festival", "is_weekend", "city", "label"]
-with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-    writer.writerow(header)
-    writer.writerows(dataset)
-
-print(f"Dataset generated successfully: {OUTPUT_FILE} (20,000 rows)")
\ No newline at end of file
+    # Probability Factor for Overfitting Prevention (Noise)
+    labels[u[1] < 0.05] = 0
+    return labels
+
+
+def draw(n, seed_seq):
+    """n rows as code arrays (positions in the metadata lists, minute of day, label bitmask)."""
+    rng = np.random.default_rng(seed_seq)
+    city = rng.integers(len(cities), size=n)
+    month = rng.integers(len(months), size=n)
+    day = rng.integers(len(days), size=n)
+    charging_time = rng.integers(len(charging_times), size=n)
+
+    hour = rng.integers(0, 24, size=n)
+    minute = rng.integers(0, 4, size=n) * 15
+
+    is_festival = np.isin(month, [months.index(m) for m in festival_months]).astype(np.int8)
+    is_weekend = np.isin(day, [days.index(d) for d in weekend_days]).astype(np.int8)
+
+    label = generate_labels(np.asarray(charging_times)[charging_time], hour, is_festival, is_weekend, rng)
+    return {
+        "charging_time": charging_time,
+        "minute_of_day": hour * 60 + minute,
+        "day": day,
+        "month": month,
+        "is_festival": is_festival,
+        "is_weekend": is_weekend,
+        "city": city,
+        "label": label,
+    }
+
+
+def generate_chunk(index, n, seed_seq):
+    """n rows as a DataFrame with the CSV's columns."""
+    rows = draw(n, seed_seq)
+    return pd.DataFrame({
+        "charging_time": np.asarray(charging_times)[rows["charging_time"]],
+        "time": TIME_TEXT[rows["minute_of_day"]],
+        "day": np.asarray(days, dtype=object)[rows["day"]],
+        "month": np.asarray(months, dtype=object)[rows["month"]],
+        "is_festival": rows["is_festival"],
+        "is_weekend": rows["is_weekend"],
+        "city": np.asarray(cities, dtype=object)[rows["city"]],
+        "label": LABEL_TEXT[rows["label"]],
+    }, columns=HEADER)
+
+
+# Every column is low-cardinality, so a CSV line is three pre-rendered pieces:
+# "charging_time,time,", "day,month,is_festival,is_weekend,city," and "label\n"
+# (quoted like csv.writer when it holds a comma).
+_CSV_TIME = np.array([f"{c},{t}," for c in charging_times for t in TIME_TEXT], dtype=object)
+_CSV_PLACE = np.array(
+    [f"{d},{m},{int(m in festival_months)},{int(d in weekend_days)},{c}," for d in days for m in months for c in cities],
+    dtype=object,
+)
+_CSV_LABEL = np.array([(f'"{t}"' if "," in t else t) + "\n" for t in LABEL_TEXT], dtype=object)
+
+
+def csv_chunk(index, n, seed_seq):
+    """The same rows as generate_chunk, rendered as CSV text (header on the first chunk)."""
+    rows = draw(n, seed_seq)
+    parts = np.empty(3 * n, dtype=object)
+    parts[0::3] = _CSV_TIME[rows["charging_time"] * len(TIME_TEXT) + rows["minute_of_day"]]
+    parts[1::3] = _CSV_PLACE[(rows["day"] * len(months) + rows["month"]) * len(cities) + rows["city"]]
+    parts[2::3] = _CSV_LABEL[rows["label"]]
+    header = ",".join(HEADER) + "\n" if index == 0 else ""
+    return header + "".join(parts.tolist())
+
+
+def arrow_chunk(index, n, seed_seq):
+    """
+    The same rows as generate_chunk as a pyarrow Table: time as minute_of_day,
+    day/month/city dictionary-encoded over the fixed lists above (codes are
+    list positions in every file), labels as the bitmask with its bit order in
+    the schema metadata under "labels".
+    """
+    import pyarrow as pa
+
+    rows = draw(n, seed_seq)
+
+    def categorical(codes, values):
+        return pa.DictionaryArray.from_arrays(pa.array(codes.astype(np.int8)), pa.array(values))
+
+    return pa.table({
+        "charging_time": pa.array(np.asarray(charging_times, dtype=np.uint8)[rows["charging_time"]]),
+        "minute_of_day": pa.array(rows["minute_of_day"].astype(np.uint16)),
+        "day": categorical(rows["day"], days),
+        "month": categorical(rows["month"], months),
+        "is_festival": pa.array(rows["is_festival"]),
+        "is_weekend": pa.array(rows["is_weekend"]),
+        "city": categorical(rows["city"], cities),
+        "label": pa.array(rows["label"]),
+    }, metadata={"labels": json.dumps(LABELS)})
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate the synthetic EV activity dataset (CSV, Parquet or Arrow).")
+    ap.add_argument("--rows", type=int, default=NUM_ROWS)
+    ap.add_argument("--out", default=None, help=f"default {OUTPUT_FILE}, with the format's extension")
+    ap.add_argument("--format", choices=["csv", "parquet", "arrow"], default=None,
+                    help="default: from the --out extension, else csv")
+    ap.add_argument("--seed", type=int, default=None, help="same seed and chunk size, same file")
+    ap.add_argument("--workers", type=int, default=default_workers())
+    ap.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = ap.parse_args()
+
+    fmt = output_format(args.out or "", args.format)
+    out = args.out or os.path.splitext(OUTPUT_FILE)[0] + "." + fmt
+
+    t0 = time.perf_counter()
+    written = write_chunks(csv_chunk, arrow_chunk, out, fmt, args.rows, args.chunk_rows, args.seed, args.workers)
+    print(f"Dataset generated successfully: {out} ({args.rows:,} rows, {written / 1e6:.1f} MB, "
+          f"{time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 # ml-service/planner_google.py
-import time
-from typing import List, Tuple, Any
+from typing import List, Tuple
 import httpx
-from geopy.distance import geodesic
 from pydantic import BaseModel
 
-GOOGLE_DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+from services.cache import get_route_cache, route_cache_key
+from services.polyline import decode_polyline
+from services.routing import GOOGLE_DIRECTIONS_URL
+from services.stations import station_index
 
 # ---------------- DTOs ----------------
 class RouteDTO(BaseModel):
@@ -22,99 +23,26 @@ class StationDTO(BaseModel):
     max_power_kw: float = 0
     charger_count: int = 0
     distance_to_route_km: float | None = None
-
-# ---------------- Polyline decode ----------------
-def decode_polyline5(polyline_str: str) -> List[Tuple[float, float]]:
-    index, lat, lng, coordinates = 0, 0, 0, []
-    while index < len(polyline_str):
-        result, shift = 0, 0
-        while True:
-            b = ord(polyline_str[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlat = ~(result >> 1) if result & 1 else result >> 1
-        lat += dlat
-
-        result, shift = 0, 0
-        while True:
-            b = ord(polyline_str[index]) - 63
-            index += 1
-            result |= (b & 0x1F) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlng = ~(result >> 1) if result & 1 else result >> 1
-        lng += dlng
-
-        coordinates.append((lat / 1e5, lng / 1e5))
-
-    return coordinates
-
-
-def haversine_km(a, b):
-    return geodesic(a, b).km
-
-
-def point_segment_distance_km(p, a, b):
-    # simple & fast midpoint heuristic
-    return min(
-        haversine_km(p, a),
-        haversine_km(p, b),
-        haversine_km(p, ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)),
-    )
+    distance_from_start_km: float | None = None
+    route_indexes: List[int] = []
 
 # ---------------- Directions + stations ----------------
-class TTLCache:
-    def __init__(self, ttl=25):
-        self.ttl = ttl
-        self.store = {}
-
-    def get(self, key):
-        item = self.store.get(key)
-        if not item:
-            return None
-        ts, val = item
-        if time.time() - ts > self.ttl:
-            self.store.pop(key, None)
-            return None
-        return val
-
-    def set(self, key, val):
-        self.store[key] = (time.time(), val)
-
-
 class GoogleEVPlanner:
     def __init__(self, google_api_key: str, max_station_distance_km: float = 5):
         self.key = google_api_key
         self.max_station_distance_km = max_station_distance_km
-        self.cache = TTLCache(ttl=25)
+        self.cache = get_route_cache()
 
     async def get_routes_from_google(self, start, end, waypoints=None):
         waypoints = waypoints or []
         wp_string = "|".join(f"{lat},{lng}" for (lat, lng) in waypoints) if waypoints else None
 
-        cache_key = f"{start}-{end}-{wp_string}"
-        cached = self.cache.get(cache_key)
-        if cached:
-            return cached
-
-        params = {
-            "origin": f"{start[0]},{start[1]}",
-            "destination": f"{end[0]},{end[1]}",
-            "mode": "driving",
-            "key": self.key,
-            "alternatives": "true",
-        }
-
-        if wp_string:
-            params["waypoints"] = f"optimize:true|{wp_string}"
-
-        async with httpx.AsyncClient(timeout=8.5) as client:
-            r = await client.get(GOOGLE_DIRECTIONS_URL, params=params)
-            data = r.json()
+        cache_key = route_cache_key("google", start, end, waypoints, alternatives=True, optimize=True)
+        data = await self.cache.aget(cache_key)
+        if data is None:
+            data = await self._fetch_directions(start, end, wp_string)
+            if data.get("status") == "OK":
+                await self.cache.aset(cache_key, data)
 
         routes = []
         for rt in data.get("routes", []):
@@ -122,7 +50,7 @@ class GoogleEVPlanner:
             dist_m = sum(l.get("distance", {}).get("value", 0) for l in legs)
             dur_s = sum(l.get("duration", {}).get("value", 0) for l in legs)
             poly = rt.get("overview_polyline", {}).get("points", "")
-            path = decode_polyline5(poly)
+            path = decode_polyline(poly).tolist()
 
             routes.append(
                 RouteDTO(
@@ -133,34 +61,46 @@ class GoogleEVPlanner:
             )
 
         routes.sort(key=lambda r: r.duration_min)
-        self.cache.set(cache_key, routes)
         return routes
 
-    def stations_near_any_route(self, routes: List[RouteDTO], stations: List[StationDTO]):
-        if not routes:
-            return []
+    async def _fetch_directions(self, start, end, wp_string):
+        params = {
+            "origin": f"{start[0]},{start[1]}",
+            "destination": f"{end[0]},{end[1]}",
+            "mode": "driving",
+            "key": self.key,
+            "alternatives": "true",
+        }
 
-        path = routes[0].path
-        if len(path) < 2:
-            return []
+        if wp_string:
+            params["waypoints"] = f"optimize:true|{wp_string}"
 
-        near = []
-        for s in stations:
-            p = (s.lat, s.lon)
-            best = 9999
-            for i in range(len(path) - 1):
-                a = path[i]
-                b = path[i + 1]
-                d = point_segment_distance_km(p, a, b)
-                if d < best:
-                    best = d
-                    if best <= self.max_station_distance_km:
-                        break
+        async with httpx.AsyncClient(timeout=8.5) as client:
+            r = await client.get(GOOGLE_DIRECTIONS_URL, params=params)
+            return r.json()
 
-            if best <= self.max_station_distance_km:
-                s2 = s.model_copy()
-                s2.distance_to_route_km = round(best, 2)
-                near.append(s2)
+    def stations_near_any_route(self, routes: List[RouteDTO], stations: List[StationDTO]):
+        """
+        Stations within the threshold of any of the routes, each listed once with
+        route_indexes (which routes pass it) and its distances to the closest one.
+        """
+        paths = [r.path for r in routes]
+        if not any(len(p) >= 2 for p in paths):
+            return []
 
+        best = {}
+        for route_i, (idx, cross, along) in enumerate(station_index(stations).near_routes(paths, self.max_station_distance_km)):
+            for i, d, a in zip(idx.tolist(), cross.tolist(), along.tolist()):
+                s2 = best.get(i)
+                if s2 is None:
+                    s2 = best[i] = stations[i].model_copy(
+                        update={"route_indexes": [], "distance_to_route_km": None, "distance_from_start_km": None}
+                    )
+                s2.route_indexes.append(route_i)
+                if s2.distance_to_route_km is None or d < s2.distance_to_route_km:
+                    s2.distance_to_route_km = round(d, 2)
+                    s2.distance_from_start_km = round(a, 2)
+
+        near = list(best.values())
         near.sort(key=lambda s: s.distance_to_route_km or 9999)
         return near
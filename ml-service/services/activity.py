@@ -0,0 +1,475 @@
+# ml-service/services/activity.py
+"""
+Activity recommendations from the model trained in model/model.ipynb: a
+Pipeline(encode_features -> MultiOutputClassifier(RandomForest)) saved
+with joblib as {"pipeline", "mlb", "target_names"}, or its classifier
+exported to a memory-mapped flat artifact (export_activity_model.py).
+
+The package is loaded once and rows are predicted in batches with one
+classifier call per batch, or read from an ActivityTable built ahead of time
+(build_activity_table.py) when they fall on the training data's grid.
+
+Packages trained before encode_features used the notebook's
+transform_features, which numbers day/month with pd.factorize over whatever
+frame it is given, so pushing a batch through the pipeline would let a row's
+prediction depend on the other rows in its batch. For those, encode()
+produces what the pipeline gives for that row alone (the notebook's
+predict_activity call), so batched and one-at-a-time predictions agree.
+Models trained with encode_features number day/month by calendar position,
+the same in training and serving, and are fed the real codes.
+"""
+import hashlib
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+ACTIVITY_MODEL_PATH = os.getenv(
+    "ACTIVITY_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model", "ev_recommendation_model.pkl"),
+)
+# precomputed predictions over the feature grid (ActivityTable, build_activity_table.py)
+ACTIVITY_TABLE_PATH = os.getenv("ACTIVITY_TABLE_PATH", os.path.splitext(ACTIVITY_MODEL_PATH)[0] + "_table.npz")
+# micro-batching of single-row requests (services.microbatch)
+ACTIVITY_BATCH_MAX = int(os.getenv("ACTIVITY_BATCH_MAX", "64"))
+ACTIVITY_BATCH_WAIT_MS = float(os.getenv("ACTIVITY_BATCH_WAIT_MS", "2"))
+MAX_ACTIVITY_ROWS = 1000
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December"]
+# as in model/dataset.py, which generated the training data
+FESTIVAL_MONTHS = {"April", "December"}
+WEEKEND_DAYS = {"Saturday", "Sunday"}
+GRID_CHARGING_TIMES = (15, 30, 45, 60, 75, 90)
+GRID_SLOT_MINUTES = 15
+
+_DAY_INDEX = {d: i for i, d in enumerate(DAYS)}
+_MONTH_INDEX = {m: i for i, m in enumerate(MONTHS)}
+
+# transform_features output, i.e. the classifier's input columns
+FEATURE_COLUMNS = ["charging_time", "is_festival", "is_weekend", "total_minutes", "day_code", "month_code"]
+
+
+# ActivityModel.encoding: how the pipeline it was trained with numbers day/month
+ENCODING_FACTORIZE = "factorize"  # transform_features, order of appearance
+ENCODING_CALENDAR = "calendar"  # encode_features, position in DAYS / MONTHS
+
+
+class ActivityRequestError(ValueError):
+    """The request body is invalid; endpoints answer 400 with the message."""
+
+
+def transform_features(X_df):
+    """model/model.ipynb's feature step; the pickled pipeline refers to it by name."""
+    X_copy = X_df.copy()
+
+    # Convert HH:MM time string to total minutes
+    time_split = X_copy['time'].str.split(':', expand=True).astype(int)
+    X_copy['total_minutes'] = (time_split[0] * 60) + time_split[1]
+
+    # Encode 'day' and 'month' columns into numerical codes
+    X_copy['day_code'] = pd.factorize(X_copy['day'])[0]
+    X_copy['month_code'] = pd.factorize(X_copy['month'])[0]
+
+    # Drop original string columns
+    return X_copy.drop(['time', 'day', 'month'], axis=1)
+
+
+def _calendar_codes(values: pd.Series, names: List[str], field: str) -> np.ndarray:
+    codes = pd.Categorical(values, categories=names).codes.astype(np.int64)
+    if (codes < 0).any():
+        raise ValueError(f"{field} must be one of {names}")
+    return codes
+
+
+def encode_features(X_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Feature step with stable codes: day_code / month_code are positions in
+    DAYS / MONTHS rather than order of appearance, so a row is encoded the
+    same in training, in a batch and on its own. Takes the CSV layout ("HH:MM"
+    time, day/month strings) or the columnar one written by model/dataset.py
+    --format parquet|arrow (minute_of_day, categorical day/month), which needs
+    no string parsing.
+    """
+    if "minute_of_day" in X_df.columns:
+        minutes = X_df["minute_of_day"].to_numpy(dtype=np.int64)
+    else:
+        hh_mm = X_df["time"].astype(str).str.partition(":")
+        minutes = hh_mm[0].astype(np.int64).to_numpy() * 60 + hh_mm[2].astype(np.int64).to_numpy()
+    return pd.DataFrame({
+        "charging_time": X_df["charging_time"].to_numpy(),
+        "is_festival": X_df["is_festival"].to_numpy(dtype=np.int64),
+        "is_weekend": X_df["is_weekend"].to_numpy(dtype=np.int64),
+        "total_minutes": minutes,
+        "day_code": _calendar_codes(X_df["day"], DAYS, "day"),
+        "month_code": _calendar_codes(X_df["month"], MONTHS, "month"),
+    }, index=X_df.index)[FEATURE_COLUMNS]
+
+
+def load_dataset(path: str) -> Tuple[pd.DataFrame, np.ndarray, List[str]]:
+    """
+    (pipeline input X, multi-hot targets y, label names) from a file written
+    by model/dataset.py: CSV, Parquet (.parquet) or Arrow IPC (.arrow). Label
+    names come out sorted with "none" for rows without labels, as the
+    notebook's MultiLabelBinarizer gives for the CSV, so every format trains
+    the same label space.
+    """
+    if path.endswith((".parquet", ".arrow")):
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(path)
+        else:
+            import pyarrow as pa
+
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        bit_labels = json.loads(table.schema.metadata[b"labels"])
+        mask = table.column("label").to_numpy().astype(np.int64)
+        X = table.drop_columns(["label", "city"]).to_pandas()
+        bits = (mask[:, None] >> np.arange(len(bit_labels))) & 1
+        by_name = dict(zip(bit_labels, bits.T))
+        by_name["none"] = (mask == 0).astype(np.int64)
+        names = sorted(by_name)
+        return X, np.column_stack([by_name[n] for n in names]), names
+
+    from sklearn.preprocessing import MultiLabelBinarizer
+
+    df = pd.read_csv(path)
+    mlb = MultiLabelBinarizer()
+    y = mlb.fit_transform(df["label"].fillna("none").str.split(", "))
+    return df.drop(columns=["label", "city"]), y, [str(c) for c in mlb.classes_]
+
+
+def _flag(value: Any, field: str) -> int:
+    if value in (0, 1, True, False):
+        return int(value)
+    raise ActivityRequestError(f"{field} must be 0 or 1")
+
+
+def parse_activity_row(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Row:
+    {
+      "charging_time": <minutes>,
+      "time": "HH:MM",
+      "day": "Monday" ... "Sunday",
+      "month": "January" ... "December",
+      "is_festival": 0 | 1,   # optional, default from month
+      "is_weekend": 0 | 1     # optional, default from day
+    }
+    """
+    if not isinstance(data, dict):
+        raise ActivityRequestError("Each row must be an object")
+    try:
+        charging_time = float(data["charging_time"])
+        hh, mm = (int(x) for x in str(data["time"]).split(":"))
+        day, month = data["day"], data["month"]
+    except KeyError as ex:
+        raise ActivityRequestError(f"Missing field {ex.args[0]}")
+    except (TypeError, ValueError):
+        raise ActivityRequestError("charging_time must be a number and time HH:MM")
+    if not (0 <= hh < 24 and 0 <= mm < 60):
+        raise ActivityRequestError("time must be HH:MM within a day")
+    if charging_time <= 0:
+        raise ActivityRequestError("charging_time must be positive")
+    if day not in DAYS:
+        raise ActivityRequestError(f"day must be one of {DAYS}")
+    if month not in MONTHS:
+        raise ActivityRequestError(f"month must be one of {MONTHS}")
+    return {
+        "charging_time": charging_time,
+        "total_minutes": hh * 60 + mm,
+        "day": day,
+        "month": month,
+        "is_festival": _flag(data.get("is_festival", month in FESTIVAL_MONTHS), "is_festival"),
+        "is_weekend": _flag(data.get("is_weekend", day in WEEKEND_DAYS), "is_weekend"),
+    }
+
+
+def parse_activity_request(data: Any) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    A single row (see parse_activity_row), or {"rows": [row, ...]}.
+    Returns (parsed rows, whether the body was the "rows" form).
+    """
+    if isinstance(data, dict) and "rows" in data:
+        rows = data["rows"]
+        if not isinstance(rows, list) or not rows:
+            raise ActivityRequestError("rows must be a non-empty list")
+        if len(rows) > MAX_ACTIVITY_ROWS:
+            raise ActivityRequestError(f"At most {MAX_ACTIVITY_ROWS} rows per request")
+        return [parse_activity_row(r) for r in rows], True
+    return [parse_activity_row(data)], False
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ActivityModel:
+    """
+    The trained classifier plus what serving needs around it. Loaded either
+    from the notebook's joblib package or from a flat artifact directory
+    (services.forest, written by export_activity_model.py) whose arrays are
+    memory-mapped; only the former keeps the full pipeline.
+    """
+
+    def __init__(self, classifier: Any, labels: Sequence[str], columns: Sequence[str] = FEATURE_COLUMNS,
+                 path: str = None, pipeline: Any = None, sha256: str = None,
+                 encoding: str = ENCODING_FACTORIZE):
+        self.classifier = classifier
+        self._labels = [str(c) for c in labels]
+        self.columns = list(columns)
+        self.path = path
+        self.pipeline = pipeline
+        self._sha256 = sha256
+        self.encoding = encoding
+        self.table: "ActivityTable" = None
+
+    @classmethod
+    def from_package(cls, package: Dict[str, Any], path: str = None) -> "ActivityModel":
+        pipeline = package["pipeline"]
+        classifier = pipeline.steps[-1][1]
+        names = getattr(classifier, "feature_names_in_", None)
+        columns = list(names) if names is not None else FEATURE_COLUMNS
+        step = pipeline.steps[0][1]
+        encoding = ENCODING_CALENDAR if getattr(step, "func", None) is encode_features else ENCODING_FACTORIZE
+        return cls(classifier, package["mlb"].classes_, columns, path, pipeline, encoding=encoding)
+
+    @classmethod
+    def load(cls, path: str = ACTIVITY_MODEL_PATH, table_path: str = ACTIVITY_TABLE_PATH) -> "ActivityModel":
+        """
+        Load a model package (.pkl) or flat artifact (directory), plus the
+        lookup table if one was built from the same trained model.
+        """
+        if os.path.isdir(path):
+            from services.forest import FlatForest
+
+            forest = FlatForest.load(path)
+            extra = forest.meta["extra"]
+            model = cls(forest, extra["labels"], extra["columns"], path, sha256=extra["source_sha256"],
+                        encoding=extra.get("encoding", ENCODING_FACTORIZE))
+        else:
+            import joblib
+
+            # pickled from the notebook, so the pipeline looks for __main__.transform_features
+            main = sys.modules["__main__"]
+            if not hasattr(main, "transform_features"):
+                main.transform_features = transform_features
+            model = cls.from_package(joblib.load(path), path)
+        if table_path and os.path.exists(table_path):
+            table = ActivityTable.load(table_path)
+            if table.model_sha256 == model.sha256 and table.labels == model.labels:
+                model.table = table
+        return model
+
+    @property
+    def sha256(self) -> str:
+        """SHA-256 of the model package the classifier came from."""
+        if self._sha256 is None:
+            self._sha256 = _file_sha256(self.path)
+        return self._sha256
+
+    @property
+    def labels(self) -> List[str]:
+        return list(self._labels)
+
+    def decode(self, binary: np.ndarray) -> List[List[str]]:
+        """Label lists from (rows, labels) 0/1 predictions."""
+        return [[self._labels[j] for j in np.flatnonzero(row)] for row in np.asarray(binary)]
+
+    def features(self, charging_time, is_festival, is_weekend, total_minutes, day, month) -> pd.DataFrame:
+        """
+        Classifier input from per-row feature arrays (day / month as positions
+        in DAYS / MONTHS), each row encoded as if predicted on its own.
+        """
+        if self.encoding == ENCODING_CALENDAR:
+            day_code, month_code = np.asarray(day, dtype=np.int64), np.asarray(month, dtype=np.int64)
+        else:
+            # pd.factorize over a single row always gives code 0
+            day_code = month_code = np.zeros(len(charging_time), dtype=np.int64)
+        cols = {
+            "charging_time": np.asarray(charging_time, dtype=np.float64),
+            "is_festival": np.asarray(is_festival, dtype=np.int64),
+            "is_weekend": np.asarray(is_weekend, dtype=np.int64),
+            "total_minutes": np.asarray(total_minutes, dtype=np.int64),
+            "day_code": day_code,
+            "month_code": month_code,
+        }
+        return pd.DataFrame({c: cols[c] for c in self.columns})
+
+    def encode(self, rows: Sequence[Dict[str, Any]]) -> pd.DataFrame:
+        """Classifier input for parsed rows."""
+        return self.features(
+            [r["charging_time"] for r in rows],
+            [r["is_festival"] for r in rows],
+            [r["is_weekend"] for r in rows],
+            [r["total_minutes"] for r in rows],
+            [_DAY_INDEX[r["day"]] for r in rows],
+            [_MONTH_INDEX[r["month"]] for r in rows],
+        )
+
+    def predict(self, rows: Sequence[Dict[str, Any]]) -> List[List[str]]:
+        """
+        Activity labels per parsed row: table lookups where the row is on the
+        grid, one classifier call for the rest.
+        """
+        if not rows:
+            return []
+        out = self.lookup(rows)
+        missed = [i for i, labels in enumerate(out) if labels is None]
+        if missed:
+            binary = self.classifier.predict(self.encode([rows[i] for i in missed]))
+            for i, labels in zip(missed, self.decode(binary)):
+                out[i] = labels
+        return out
+
+    def lookup(self, rows: Sequence[Dict[str, Any]]) -> List[Optional[List[str]]]:
+        """Table answers per parsed row; None where there is no table or the row is off the grid."""
+        if self.table is None:
+            return [None] * len(rows)
+        return [self.table.get(r) for r in rows]
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "format": "pickle" if self.pipeline is not None else "flat",
+            "encoding": self.encoding,
+            "labels": self.labels,
+            "table": self.table.info() if self.table is not None else None,
+        }
+
+
+class ActivityTable:
+    """
+    The model evaluated over every input model/dataset.py can generate:
+    GRID_CHARGING_TIMES x GRID_SLOT_MINUTES time slots x days x months, with
+    is_festival / is_weekend following from month and day. Each cell holds
+    the predicted labels as a bitset (bit i = labels[i]), so serving an
+    on-grid row is one array index. Rows off the grid (other charging times
+    or minutes, or flags that disagree with day/month) go to the model.
+
+    Saved as .npz next to the model, with the SHA-256 of the model file it
+    was built from so a retrained model never serves a stale table.
+    """
+
+    def __init__(self, codes: np.ndarray, labels: List[str], model_sha256: str,
+                 charging_times: Sequence[float] = GRID_CHARGING_TIMES, slot_minutes: int = GRID_SLOT_MINUTES):
+        self.codes = codes
+        self.labels = list(labels)
+        self.model_sha256 = model_sha256
+        self.charging_times = [float(c) for c in charging_times]
+        self.slot_minutes = int(slot_minutes)
+        self._ct_index = {c: i for i, c in enumerate(self.charging_times)}
+        self._decoded = {int(c): self.decode(int(c)) for c in np.unique(codes)}
+
+    @staticmethod
+    def grid(charging_times: Sequence[float] = GRID_CHARGING_TIMES, slot_minutes: int = GRID_SLOT_MINUTES):
+        """Feature arrays (charging_time, is_festival, is_weekend, total_minutes, day, month) in table order."""
+        ct, slot, day, month = np.meshgrid(
+            np.asarray(charging_times, dtype=np.float64),
+            np.arange(0, 24 * 60, slot_minutes),
+            np.arange(len(DAYS)),
+            np.arange(len(MONTHS)),
+            indexing="ij",
+        )
+        ct, slot, day, month = (a.ravel() for a in (ct, slot, day, month))
+        festival = np.isin(np.array(MONTHS)[month], list(FESTIVAL_MONTHS)).astype(np.int64)
+        weekend = np.isin(np.array(DAYS)[day], list(WEEKEND_DAYS)).astype(np.int64)
+        return ct, festival, weekend, slot, day, month
+
+    @classmethod
+    def build(cls, model: ActivityModel, charging_times: Sequence[float] = GRID_CHARGING_TIMES,
+              slot_minutes: int = GRID_SLOT_MINUTES) -> "ActivityTable":
+        """Evaluate the model over the whole grid with one classifier call."""
+        n_labels = len(model.labels)
+        if n_labels > 64:
+            raise ValueError(f"{n_labels} labels do not fit a 64-bit label set")
+        dtype = next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64) if np.iinfo(t).bits >= n_labels)
+        binary = np.asarray(model.classifier.predict(model.features(*cls.grid(charging_times, slot_minutes))))
+        weights = np.left_shift(np.ones(n_labels, dtype=np.uint64), np.arange(n_labels, dtype=np.uint64))
+        codes = (binary.astype(np.uint64) * weights).sum(axis=1).astype(dtype)
+        shape = (len(charging_times), 24 * 60 // slot_minutes, len(DAYS), len(MONTHS))
+        return cls(codes.reshape(shape), model.labels, model.sha256, charging_times, slot_minutes)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                codes=self.codes,
+                labels=np.array(self.labels),
+                model_sha256=np.array(self.model_sha256),
+                charging_times=np.array(self.charging_times),
+                slot_minutes=np.array(self.slot_minutes),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "ActivityTable":
+        with np.load(path) as z:
+            return cls(
+                z["codes"], [str(x) for x in z["labels"]], str(z["model_sha256"]),
+                z["charging_times"].tolist(), int(z["slot_minutes"]),
+            )
+
+    def decode(self, code: int) -> List[str]:
+        return [label for i, label in enumerate(self.labels) if code >> i & 1]
+
+    def index(self, row: Dict[str, Any]) -> Optional[Tuple[int, int, int, int]]:
+        """Table cell for a parsed row, or None when it is off the grid."""
+        ct = self._ct_index.get(row["charging_time"])
+        slot, rest = divmod(row["total_minutes"], self.slot_minutes)
+        if ct is None or rest:
+            return None
+        if row["is_festival"] != (row["month"] in FESTIVAL_MONTHS) or row["is_weekend"] != (row["day"] in WEEKEND_DAYS):
+            return None
+        return ct, slot, _DAY_INDEX[row["day"]], _MONTH_INDEX[row["month"]]
+
+    def get(self, row: Dict[str, Any]) -> Optional[List[str]]:
+        cell = self.index(row)
+        return None if cell is None else list(self._decoded[int(self.codes[cell])])
+
+    def check(self, model: ActivityModel, pipeline_samples: int = 200, seed: int = 0) -> Dict[str, Any]:
+        """
+        Compare the table with the model: every cell against the classifier,
+        and pipeline_samples random cells against model.pipeline.predict on a
+        one-row frame (the notebook's predict_activity path) when the model
+        was loaded with its pipeline.
+        """
+        fresh = ActivityTable.build(model, self.charging_times, self.slot_minutes)
+        grid_mismatches = int(np.count_nonzero(fresh.codes != self.codes))
+
+        ct, festival, weekend, minutes, day, month = self.grid(self.charging_times, self.slot_minutes)
+        rng = np.random.default_rng(seed)
+        samples = pipeline_samples if model.pipeline is not None else 0
+        picked = rng.choice(len(ct), size=min(samples, len(ct)), replace=False)
+        pipeline_mismatches = []
+        for i in picked:
+            frame = pd.DataFrame([{
+                "charging_time": ct[i],
+                "time": f"{minutes[i] // 60:02d}:{minutes[i] % 60:02d}",
+                "day": DAYS[day[i]],
+                "month": MONTHS[month[i]],
+                "is_festival": festival[i],
+                "is_weekend": weekend[i],
+            }])
+            expected = model.decode(model.pipeline.predict(frame))[0]
+            if self.decode(int(self.codes.reshape(-1)[i])) != expected:
+                pipeline_mismatches.append(frame.iloc[0].to_dict())
+        return {
+            "cells": int(self.codes.size),
+            "grid_mismatches": grid_mismatches,
+            "pipeline_checked": len(picked),
+            "pipeline_mismatches": pipeline_mismatches,
+            "ok": grid_mismatches == 0 and not pipeline_mismatches,
+        }
+
+    def info(self) -> Dict[str, Any]:
+        return {"cells": int(self.codes.size), "bytes": int(self.codes.nbytes), "model_sha256": self.model_sha256}
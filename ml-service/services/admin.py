@@ -0,0 +1,21 @@
+# ml-service/services/admin.py
+"""
+Access check for operator endpoints (station snapshot invalidation, profiling
+captures). They only answer requests carrying "Authorization: Bearer
+<ML_ADMIN_TOKEN>"; while ML_ADMIN_TOKEN is unset they refuse everyone.
+"""
+import hmac
+import os
+from typing import Optional
+
+ADMIN_REQUIRED = "Admin token required (Authorization: Bearer <ML_ADMIN_TOKEN>)"
+
+
+def admin_allowed(authorization: Optional[str], token: Optional[str] = None) -> bool:
+    """Whether an Authorization header value carries the admin token (default: ML_ADMIN_TOKEN as set now)."""
+    if token is None:
+        token = os.getenv("ML_ADMIN_TOKEN", "")
+    if not token:
+        return False
+    scheme, _, value = (authorization or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(value.strip().encode(), token.encode())
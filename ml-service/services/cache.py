@@ -0,0 +1,269 @@
+# ml-service/services/cache.py
+"""
+Routing-result cache shared by all planners.
+
+Keys are built from coordinates snapped to a grid (ROUTE_CACHE_SNAP_DEG,
+~110 m by default), so requests a few metres apart share an entry. Values are
+the raw upstream JSON (OSRM / Google Directions), kept in a bounded in-memory
+LRU with TTL and backed by a local SQLite file so warm routes survive restarts
+and are shared between worker processes. The file is bounded too: every
+ROUTE_CACHE_PRUNE_EVERY writes, expired rows are dropped and the oldest rows
+beyond ROUTE_CACHE_DISK_SIZE are evicted.
+
+Event-loop code uses TieredCache.aget/aset, which read and write the SQLite
+tier in a worker thread (a write locked by another process can wait up to the
+connection timeout).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from services.metrics import record_cache
+
+DEFAULT_SNAP_DEG = float(os.getenv("ROUTE_CACHE_SNAP_DEG", "0.001"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_SIZE", "1024"))
+DEFAULT_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "900"))
+DEFAULT_DISK_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_DISK_SIZE", "20000"))
+DEFAULT_PRUNE_EVERY = int(os.getenv("ROUTE_CACHE_PRUNE_EVERY", "256"))
+# Empty string disables the disk tier
+DEFAULT_DB_PATH = os.getenv(
+    "ROUTE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "routes.sqlite"),
+)
+
+
+def snap_point(p: Sequence[float], grid_deg: float = DEFAULT_SNAP_DEG) -> Tuple[float, float]:
+    """Round (lat, lon) to the nearest grid node."""
+    return (round(round(p[0] / grid_deg) * grid_deg, 7), round(round(p[1] / grid_deg) * grid_deg, 7))
+
+
+def route_cache_key(
+    provider: str,
+    start: Sequence[float],
+    end: Sequence[float],
+    waypoints: Iterable[Sequence[float]] = (),
+    grid_deg: float = DEFAULT_SNAP_DEG,
+    **options: Any,
+) -> str:
+    """Stable key for one routing request; options are provider flags such as alternatives."""
+    payload = {
+        "p": provider,
+        "s": snap_point(start, grid_deg),
+        "e": snap_point(end, grid_deg),
+        "w": [snap_point(w, grid_deg) for w in waypoints or ()],
+        "o": options,
+    }
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class LRUTTLCache:
+    """Bounded, thread-safe LRU where entries also expire after ttl_s."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_s: float = DEFAULT_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if time.time() >= expires_at:
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, expires_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (expires_at or time.time() + self.ttl_s, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """JSON values in a local SQLite file (WAL mode, safe across processes), pruned every prune_every writes."""
+
+    def __init__(
+        self,
+        path: str,
+        ttl_s: float = DEFAULT_TTL_S,
+        max_entries: int = DEFAULT_DISK_MAX_ENTRIES,
+        prune_every: int = DEFAULT_PRUNE_EVERY,
+    ):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.prune_every = max(1, prune_every)
+        self.evictions = 0
+        self.expirations = 0
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS route_cache ("
+            " key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS route_cache_expires ON route_cache (expires_at)")
+        self.prune()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        """(expires_at, value) or None when missing/expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, value FROM route_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, value: Any) -> float:
+        expires_at = time.time() + self.ttl_s
+        raw = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO route_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, raw),
+            )
+            self._writes += 1
+            due = self._writes % self.prune_every == 0
+        if due:
+            self.prune()
+        return expires_at
+
+    def prune(self) -> int:
+        """
+        Delete expired rows, then the soonest-expiring (oldest written) rows
+        beyond max_entries; returns how many were removed.
+        """
+        with self._lock:
+            expired = self._conn.execute("DELETE FROM route_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM route_cache").fetchone()
+            evicted = 0
+            if count > self.max_entries:
+                evicted = self._conn.execute(
+                    "DELETE FROM route_cache WHERE key IN"
+                    " (SELECT key FROM route_cache ORDER BY expires_at LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+            self.expirations += expired
+            self.evictions += evicted
+        return expired + evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM route_cache")
+
+
+class TieredCache:
+    """Memory LRU in front of an optional SQLite store, with hit/miss counters."""
+
+    def __init__(self, memory: LRUTTLCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._from_memory(key)
+        if value is None:
+            value = self._from_disk(key, self.disk.get(key) if self.disk is not None else None)
+        return value
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() for the event loop: the SQLite tier is read in a worker thread."""
+        value = self._from_memory(key)
+        if value is None:
+            found = await asyncio.to_thread(self.disk.get, key) if self.disk is not None else None
+            value = self._from_disk(key, found)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = self.disk.set(key, value) if self.disk is not None else None
+        self.memory.set(key, value, expires_at=expires_at)
+
+    async def aset(self, key: str, value: Any) -> None:
+        """set() for the event loop: the SQLite tier is written in a worker thread."""
+        expires_at = await asyncio.to_thread(self.disk.set, key, value) if self.disk is not None else None
+        self.memory.set(key, value, expires_at=expires_at)
+
+    def _from_memory(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.memory_hits += 1
+            record_cache("memory_hit")
+        return value
+
+    def _from_disk(self, key: str, found: Optional[Tuple[float, Any]]) -> Optional[Any]:
+        """Counts the disk lookup's outcome; a hit is promoted to memory."""
+        if found is None:
+            with self._lock:
+                self.misses += 1
+            record_cache("miss")
+            return None
+        expires_at, value = found
+        self.memory.set(key, value, expires_at=expires_at)
+        with self._lock:
+            self.disk_hits += 1
+        record_cache("disk_hit")
+        return value
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.memory.evictions,
+            "expirations": self.memory.expirations,
+            "entries": len(self.memory),
+            "disk": self.disk.path if self.disk is not None else None,
+            "disk_evictions": self.disk.evictions if self.disk is not None else 0,
+            "disk_expirations": self.disk.expirations if self.disk is not None else 0,
+        }
+
+
+_route_cache: Optional[TieredCache] = None
+_route_cache_lock = threading.Lock()
+
+
+def get_route_cache() -> TieredCache:
+    """Process-wide routing cache configured from the ROUTE_CACHE_* env vars."""
+    global _route_cache
+    with _route_cache_lock:
+        if _route_cache is None:
+            disk = SQLiteCache(DEFAULT_DB_PATH) if DEFAULT_DB_PATH else None
+            _route_cache = TieredCache(LRUTTLCache(), disk)
+        return _route_cache
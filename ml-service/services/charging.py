@@ -0,0 +1,175 @@
+# ml-service/services/charging.py
+"""
+Charging-stop optimizer for one route.
+
+Given the stations along a route (progress km, detour, max power) and a
+vehicle (battery, consumption, current SoC), find the set of stops and how
+far to charge at each that reaches the destination with the requested SoC in
+the least total time: charging + detours + a fixed overhead per stop.
+
+SoC is discretized into `steps` levels and the search is a forward DP over
+the stations in route order. For every station there is one array over SoC
+levels for "arrive with this SoC" and one for "leave with this SoC":
+
+    arrive_j(s) = min_i leave_i(s + energy(i -> j)) + detour time of j
+    leave_j(c)  = min(arrive_j(c), overhead + Q_j(c) + min_{s < c} (arrive_j(s) - Q_j(s)))
+
+where Q_j is the cumulative charge-time curve at station j. The inner minimum
+is a prefix minimum, so a station costs O(levels) and the whole plan
+O(stations x reachable predecessors x levels) in NumPy.
+Energy is rounded up to whole levels, so a plan never relies on more charge
+than the vehicle has.
+"""
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+DEFAULT_SOC_STEPS = 100  # 1 % SoC resolution
+
+# DC charging curve: full power up to TAPER_SOC, then falling linearly to
+# TAPER_END_FRACTION of it at 100 %.
+TAPER_SOC = 0.8
+TAPER_END_FRACTION = 0.3
+
+DEFAULT_STOP_OVERHEAD_MIN = 5.0  # parking, plugging in, paying
+
+# A station is reached by leaving the route and coming back
+DETOUR_FACTOR = 2.0
+
+
+def charge_time_curves(power_kw: np.ndarray, battery_kwh: float, steps: int = DEFAULT_SOC_STEPS) -> np.ndarray:
+    """
+    (stations, steps + 1) array: minutes to charge from 0 % to each SoC level
+    at each station's power, following the taper above TAPER_SOC.
+    """
+    soc = (np.arange(steps) + 0.5) / steps
+    frac = np.where(soc <= TAPER_SOC, 1.0, 1.0 - (1.0 - TAPER_END_FRACTION) * (soc - TAPER_SOC) / (1.0 - TAPER_SOC))
+    step_min = (battery_kwh / steps) * 60.0 / (np.asarray(power_kw, dtype=np.float64)[:, None] * frac[None, :])
+    return np.concatenate([np.zeros((len(step_min), 1)), np.cumsum(step_min, axis=1)], axis=1)
+
+
+def optimize_charging_stops(
+    route_km: float,
+    along_km: Sequence[float],
+    detour_km: Sequence[float],
+    power_kw: Sequence[float],
+    battery_kwh: float,
+    kwh_per_km: float,
+    soc_start: float,
+    min_arrival_soc: float,
+    max_charge_soc: float = 1.0,
+    avg_speed_kmh: float = 60.0,
+    stop_overhead_min: float = DEFAULT_STOP_OVERHEAD_MIN,
+    steps: int = DEFAULT_SOC_STEPS,
+) -> Dict[str, Any]:
+    """
+    Minimum-time charging plan. Stations are given as parallel arrays (km from
+    the route start, extra km driven to visit, usable charging power); SoC
+    values are fractions 0..1. min_arrival_soc applies at every charger
+    arrival as well as at the destination.
+
+    Returns {"feasible", "stops", "charge_min", "detour_km", "detour_min",
+    "overhead_min", "arrival_soc"}; each stop is {"station", "arrival_soc",
+    "departure_soc", "charge_min"} with "station" a position in the input
+    arrays. When no plan exists "feasible" is False and "reason" says why.
+    """
+    along = np.asarray(along_km, dtype=np.float64)
+    detour = np.asarray(detour_km, dtype=np.float64)
+    power = np.asarray(power_kw, dtype=np.float64)
+
+    # usable stations in route order; node 0 is the origin, node n + 1 the destination
+    usable = np.flatnonzero((power > 0) & (along >= 0) & (along <= route_km))
+    usable = usable[np.argsort(along[usable], kind="stable")]
+    n = len(usable)
+    node_along = np.concatenate([[0.0], along[usable], [route_km]])
+    node_detour = np.concatenate([[0.0], detour[usable], [0.0]])
+    detour_min = node_detour / max(avg_speed_kmh, 1e-6) * 60.0
+
+    level_kwh = battery_kwh / steps
+    s0 = int(np.floor(soc_start * steps + 1e-9))
+    reserve = int(np.ceil(min_arrival_soc * steps - 1e-9))
+    top = int(np.floor(max_charge_soc * steps + 1e-9))
+    levels = np.arange(steps + 1)
+
+    curves = charge_time_curves(power[usable], battery_kwh, steps)
+    inf = np.inf
+    leave = np.full((n + 2, steps + 1), inf)
+    leave[0, min(s0, steps)] = 0.0
+    arrive_from = np.full((n + 2, steps + 1), -1, dtype=np.int64)  # predecessor node per arrival level
+    leave_from = np.tile(levels, (n + 2, 1))                           # arrival level per departure level
+
+    def energy_levels(i: np.ndarray, j: int) -> np.ndarray:
+        km = node_along[j] - node_along[i] + (node_detour[i] + node_detour[j]) / 2.0
+        return np.ceil(km * kwh_per_km / level_kwh - 1e-9).astype(np.int64)
+
+    arrive_dest = None
+    first_pred = 0
+    for j in range(1, n + 2):
+        # skip predecessors too far back to reach j even on a full charge
+        while (node_along[j] - node_along[first_pred]) * kwh_per_km > max(top, s0) * level_kwh:
+            first_pred += 1
+        preds = np.arange(first_pred, j)
+        arrive = np.full(steps + 1, inf)
+        if len(preds):
+            dep = levels[None, :] + energy_levels(preds, j)[:, None]
+            cost = np.where(dep <= steps, leave[preds[:, None], np.minimum(dep, steps)], inf)
+            best = np.argmin(cost, axis=0)
+            arrive = cost[best, levels] + detour_min[j]
+            arrive_from[j] = preds[best]
+            arrive[:reserve] = inf
+
+        if j == n + 1:
+            arrive_dest = arrive
+            break
+
+        # leave with c: either don't charge, or charge from the cheapest s < c
+        q = curves[j - 1]
+        base = arrive - q
+        prefix = np.minimum.accumulate(base)
+        arg = np.maximum.accumulate(np.where(base == prefix, levels, 0))
+        charged = np.full(steps + 1, inf)
+        charged[1:] = q[1:] + prefix[:-1] + stop_overhead_min
+        charged[top + 1:] = inf
+        take = charged < arrive
+        leave[j] = np.where(take, charged, arrive)
+        leave_from[j, 1:] = np.where(take[1:], arg[:-1], levels[1:])
+
+    if not np.isfinite(arrive_dest).any():
+        return {
+            "feasible": False,
+            "reason": f"No combination of stops reaches the destination with {round(min_arrival_soc * 100)}% left",
+            "stops": [],
+        }
+
+    # least time, and the highest arrival SoC among equally fast plans
+    s = steps - int(np.argmin(arrive_dest[::-1]))
+    arrival_soc = s / steps
+    stops: List[Dict[str, Any]] = []
+    j = n + 1
+    while j > 0:
+        i = int(arrive_from[j, s])
+        c = s + int(energy_levels(np.array([i]), j)[0])  # level on leaving i
+        if i == 0:
+            break
+        a = int(leave_from[i, c])
+        if a != c:
+            stops.append({
+                "station": int(usable[i - 1]),
+                "arrival_soc": a / steps,
+                "departure_soc": c / steps,
+                "charge_min": float(curves[i - 1, c] - curves[i - 1, a]),
+            })
+        j, s = i, a
+    stops.reverse()
+
+    visited = [st["station"] for st in stops]
+    detour_total = float(detour[visited].sum()) if visited else 0.0
+    return {
+        "feasible": True,
+        "stops": stops,
+        "charge_min": sum(st["charge_min"] for st in stops),
+        "detour_km": detour_total,
+        "detour_min": detour_total / max(avg_speed_kmh, 1e-6) * 60.0,
+        "overhead_min": stop_overhead_min * len(stops),
+        "arrival_soc": arrival_soc,
+    }
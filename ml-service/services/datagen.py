@@ -0,0 +1,129 @@
+# ml-service/services/datagen.py
+"""
+Chunked, seeded, multi-process driver for the synthetic dataset generators
+(model/dataset.py, create_dataset.py).
+
+The rows are split into fixed-size chunks and every chunk gets its own
+child of np.random.SeedSequence(seed). A chunk's rows therefore depend only
+on the seed, the chunk size and the chunk's position, never on the number of
+worker processes, so the same seed gives the same file with 1 or 16
+workers. Chunks come back in order, with at most a few per worker in flight,
+so memory stays flat however many rows are written.
+
+Besides CSV text, chunks can be pyarrow Tables written to one Parquet or
+Arrow IPC file (write_table_chunks), with the generators' fixed value lists
+as dictionaries so the integer codes mean the same in every file.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+DEFAULT_CHUNK_ROWS = 500_000
+# chunks queued or running per worker process
+IN_FLIGHT_PER_WORKER = 2
+
+
+def chunk_sizes(rows: int, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> List[int]:
+    chunk_rows = max(1, int(chunk_rows))
+    full, rest = divmod(max(0, int(rows)), chunk_rows)
+    return [chunk_rows] * full + ([rest] if rest else [])
+
+
+def map_chunks(
+    fn: Callable[[int, int, np.random.SeedSequence], Any],
+    rows: int,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    seed: Optional[int] = None,
+    workers: int = 1,
+) -> Iterator[Any]:
+    """
+    Yield fn(chunk_index, n_rows, seed_sequence) for every chunk, in chunk
+    order. With workers > 1, fn runs in a process pool and must be picklable
+    (a module-level function).
+    """
+    sizes = chunk_sizes(rows, chunk_rows)
+    jobs = list(zip(range(len(sizes)), sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+    if workers <= 1:
+        for job in jobs:
+            yield fn(*job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        queued = iter(jobs)
+        for job in queued:
+            pending.append(pool.submit(fn, *job))
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                break
+        while pending:
+            result = pending.popleft().result()
+            job = next(queued, None)
+            if job is not None:
+                pending.append(pool.submit(fn, *job))
+            yield result
+
+
+def write_text_chunks(chunks: Iterable[str], path: str) -> int:
+    """Write rendered text chunks to path in order; returns the characters written."""
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    written = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for text in chunks:
+            written += f.write(text)
+    return written
+
+
+def output_format(path: str, fmt: Optional[str] = None) -> str:
+    """"csv", "parquet" or "arrow": fmt if given, else from the file extension."""
+    if fmt:
+        return fmt
+    return {".parquet": "parquet", ".arrow": "arrow"}.get(os.path.splitext(path)[1].lower(), "csv")
+
+
+def write_table_chunks(tables: Iterable[Any], path: str, fmt: str = "parquet") -> int:
+    """
+    Write pyarrow Tables with one schema to path in order, as Parquet (one row
+    group per chunk) or Arrow IPC file format; returns the rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    writer = None
+    rows = 0
+    try:
+        for table in tables:
+            if writer is None:
+                writer = (pq.ParquetWriter(path, table.schema, compression="zstd") if fmt == "parquet"
+                          else pa.ipc.new_file(path, table.schema))
+            writer.write_table(table)
+            rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_chunks(chunk_fn: Callable, table_fn: Callable, path: str, fmt: str, rows: int,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, seed: Optional[int] = None, workers: int = 1) -> int:
+    """
+    Generate rows into path: chunk_fn's CSV text for "csv", table_fn's Tables
+    otherwise. Both take the same chunk arguments, so a seed gives the same
+    rows in every format. Returns the bytes written.
+    """
+    if fmt == "csv":
+        write_text_chunks(map_chunks(chunk_fn, rows, chunk_rows, seed, workers), path)
+    else:
+        write_table_chunks(map_chunks(table_fn, rows, chunk_rows, seed, workers), path, fmt)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def default_workers() -> int:
+    return max(1, min(8, os.cpu_count() or 1))
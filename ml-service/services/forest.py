@@ -0,0 +1,147 @@
+# ml-service/services/forest.py
+"""
+Flat, memory-mappable form of a fitted scikit-learn forest classifier
+(RandomForestClassifier, or MultiOutputClassifier of them) with a NumPy
+predict that gives the same answers.
+
+A pickled forest is rebuilt object by object on load, and every process
+that loads it holds a private copy of all trees. Here every tree's nodes are
+concatenated into a handful of .npy arrays in one directory. FlatForest.load
+opens them with np.load(mmap_mode="r"), so loading is near instant, pages
+are read on first use, and worker processes on the same host share one copy
+through the page cache.
+
+Layout (node indices are global across all trees):
+    feature.npy    int32   split feature, 0 at leaves
+    threshold.npy  float64 go left when x[feature] <= threshold
+    left.npy       int32   left child; leaves point to themselves
+    right.npy      int32   right child; leaves point to themselves
+    proba.npy      float64 (nodes, max classes) normalized leaf class
+                           distribution, zero at inner nodes
+    roots.npy      int32   root node per tree
+    meta.json      outputs (classes, trees per output), depth, extra
+"""
+import json
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+FORMAT_VERSION = 1
+# rows walked at once; bounds the (rows, trees) temporaries
+PREDICT_CHUNK_ROWS = 1024
+_ARRAYS = ("feature", "threshold", "left", "right", "proba", "roots")
+
+
+def _forests(model: Any) -> List[Any]:
+    """One fitted forest per output."""
+    if hasattr(model, "estimators_") and hasattr(model.estimators_[0], "estimators_"):
+        return list(model.estimators_)  # MultiOutputClassifier
+    return [model]
+
+
+def export_forest(model: Any, out_dir: str, extra: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Write a fitted forest classifier to out_dir in the layout above; extra is
+    stored in meta.json as is. Returns the meta dict.
+    """
+    forests = _forests(model)
+    trees = [t.tree_ for f in forests for t in f.estimators_]
+    n_classes = max(len(f.classes_) for f in forests)
+
+    sizes = np.array([t.node_count for t in trees])
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+    total = int(sizes.sum())
+    feature = np.zeros(total, dtype=np.int32)
+    threshold = np.zeros(total, dtype=np.float64)
+    left = np.zeros(total, dtype=np.int32)
+    right = np.zeros(total, dtype=np.int32)
+    proba = np.zeros((total, n_classes), dtype=np.float64)
+
+    for t, root in zip(trees, roots):
+        ids = np.arange(root, root + t.node_count, dtype=np.int32)
+        leaf = t.children_left == -1
+        feature[ids] = np.where(leaf, 0, t.feature)
+        threshold[ids] = np.where(leaf, 0.0, t.threshold)
+        left[ids] = np.where(leaf, ids, t.children_left + root)
+        right[ids] = np.where(leaf, ids, t.children_right + root)
+        # DecisionTreeClassifier.predict_proba's normalization
+        value = t.value[:, 0, :]
+        norm = value.sum(axis=1, keepdims=True)
+        norm[norm == 0.0] = 1.0
+        proba[ids[leaf], :value.shape[1]] = value[leaf] / norm[leaf]
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, arr in zip(_ARRAYS, (feature, threshold, left, right, proba, roots)):
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+    meta = {
+        "format": FORMAT_VERSION,
+        "n_features": int(forests[0].n_features_in_),
+        "max_depth": int(max(t.max_depth for t in trees)),
+        "outputs": [
+            {"classes": np.asarray(f.classes_).tolist(), "trees": len(f.estimators_)} for f in forests
+        ],
+        "extra": extra or {},
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class FlatForest:
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported flat forest format {meta.get('format')}")
+        self.meta = meta
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.proba = arrays["proba"]
+        self.roots = arrays["roots"]
+        self.n_features = meta["n_features"]
+        self.max_depth = meta["max_depth"]
+        self.classes = [np.asarray(o["classes"]) for o in meta["outputs"]]
+        counts = [o["trees"] for o in meta["outputs"]]
+        self._tree_slices = [slice(a, a + n) for a, n in zip(np.cumsum([0] + counts[:-1]), counts)]
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "FlatForest":
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in _ARRAYS}
+        return cls(arrays, meta)
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """(rows, trees) leaf reached in every tree, all trees walked together one level per step."""
+        X = np.asarray(X, dtype=np.float32)  # sklearn compares float32 features to float64 thresholds
+        rows = np.arange(len(X))[:, None]
+        node = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_proba(self, X: np.ndarray) -> List[np.ndarray]:
+        """Per output, (rows, classes) mean of the trees' leaf distributions."""
+        leaf_proba = self.proba[self.leaves(X)]  # (rows, trees, classes)
+        out = []
+        for trees, classes in zip(self._tree_slices, self.classes):
+            # cumulative sum adds trees in order, as the forest does
+            total = np.cumsum(leaf_proba[:, trees, :len(classes)], axis=1)[:, -1]
+            out.append(total / (trees.stop - trees.start))
+        return out
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """(rows, outputs) predicted class per output."""
+        X = np.asarray(X)
+        if len(X) == 0:
+            return np.empty((0, len(self.classes)), dtype=self.classes[0].dtype)
+        return np.concatenate([
+            np.stack(
+                [classes.take(np.argmax(p, axis=1)) for p, classes in zip(self.predict_proba(chunk), self.classes)],
+                axis=1,
+            )
+            for chunk in np.array_split(X, -(-len(X) // PREDICT_CHUNK_ROWS))
+        ])
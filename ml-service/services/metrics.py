@@ -0,0 +1,229 @@
+# ml-service/services/metrics.py
+"""
+Per-stage timing and counters for the route pipeline, exported two ways:
+cumulative Prometheus histograms/counters for the process (render() for a
+/metrics endpoint, text exposition format 0.0.4), and the current request's
+own stage times and counts as a Server-Timing response header.
+
+Code anywhere under a request wraps a stage in `with stage("osrm"):` and
+bumps per-request counts with note(). The request's totals live in a
+contextvar that begin_request() sets, so the same planner code run outside a
+request (scripts, benchmarks) only feeds the process-wide metrics. Threads
+and executor jobs see the request only when started with the context copied
+(asyncio tasks do that by themselves; see asgi.run_cpu).
+
+Metrics are per process: with several worker processes, scrape each one.
+SERVER_TIMING=0 leaves the header out (it tells clients where time goes).
+"""
+import bisect
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") != "0"
+
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+
+def _labels_text(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[n]).replace("\\", "\\\\").replace('"', '\\"') for n in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Exposition lines of every label set."""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels_text(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS_S):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][i] += 1
+            entry[1][0] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._values.items())
+        out = []
+        for key, (counts, total) in items:
+            running = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                running += n
+                le = _labels_text(self.labelnames, key, f'le="{_number(bound)}"')
+                out.append(f"{self.name}_bucket{le} {running}")
+            out.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}")
+            out.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {running}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for m in self._metrics for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "ampora_request_seconds", "HTTP request time by route and status.", ["endpoint", "method", "status"]))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "ampora_stage_seconds", "Time per pipeline stage (osrm, google, decode, simplify, stations, db_fingerprint, "
+    "db_stations, proximity, charging_plan, serialize).", ["stage"]))
+ROUTE_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "ampora_route_cache_lookups_total", "Route cache lookups by result (memory_hit, disk_hit, miss).", ["result"]))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "ampora_upstream_errors_total", "Failed routing upstream calls (every attempt) by backend and error.",
+    ["backend", "error"]))
+STATIONS_SCANNED = REGISTRY.register(Histogram(
+    "ampora_stations_scanned", "Stations measured against the route(s) per corridor query.", buckets=COUNT_BUCKETS))
+STATIONS_MATCHED = REGISTRY.register(Histogram(
+    "ampora_stations_matched", "Stations within the corridor per corridor query, all alternatives.",
+    buckets=COUNT_BUCKETS))
+
+
+class RequestMetrics:
+    """One request's stage times (ms, summed over repeats) and counts."""
+
+    __slots__ = ("started", "stages", "counts")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def elapsed_s(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Server-Timing value: every stage with its dur, counts as desc, then the total."""
+        parts = [f"{name};dur={ms:.2f}" for name, ms in self.stages.items()]
+        parts += [f'{name};desc="{n}"' for name, n in self.counts.items()]
+        parts.append(f"total;dur={self.elapsed_s() * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("ampora_request_metrics", default=None)
+
+
+def begin_request() -> RequestMetrics:
+    req = RequestMetrics()
+    _current.set(req)
+    return req
+
+
+def current_request() -> Optional[RequestMetrics]:
+    return _current.get()
+
+
+def end_request(req: RequestMetrics, endpoint: str, method: str, status: int) -> None:
+    REQUEST_SECONDS.observe(req.elapsed_s(), endpoint=endpoint, method=method, status=str(status))
+
+
+def note(name: str, amount: int = 1) -> None:
+    """Add to a count of the current request (shown in its Server-Timing header)."""
+    req = _current.get()
+    if req is not None:
+        req.counts[name] = req.counts.get(name, 0) + amount
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        req = _current.get()
+        if req is not None:
+            req.stages[name] = req.stages.get(name, 0.0) + elapsed * 1000
+
+
+def record_corridor(scanned: int, matched: int) -> None:
+    STATIONS_SCANNED.observe(scanned)
+    STATIONS_MATCHED.observe(matched)
+    note("stations_scanned", scanned)
+    note("stations_matched", matched)
+
+
+def record_cache(result: str) -> None:
+    ROUTE_CACHE_LOOKUPS.inc(result=result)
+    note(f"cache_{result}")
+
+
+def record_upstream_error(backend: str, error: str) -> None:
+    UPSTREAM_ERRORS.inc(backend=backend, error=error)
+    note(f"{backend}_errors")
@@ -0,0 +1,154 @@
+# ml-service/services/microbatch.py
+"""
+Micro-batching: single-item requests that arrive close together are handed
+to one batch function call. A batch is flushed when it reaches max_batch
+items or when its oldest item has waited max_wait_ms, whichever comes first,
+so an idle service adds at most max_wait_ms to a request.
+
+Worth it for work with a high fixed cost per call and a low cost per item,
+like predict() on a scikit-learn forest.
+
+MicroBatcher is for threaded callers (Flask workers), AsyncMicroBatcher for
+coroutines on one event loop (ASGI service). The batch function takes a list
+of items and returns a list of results in the same order; if it raises, or
+returns a different number of results, every caller in that batch gets the
+exception.
+"""
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Set
+
+import numpy as np
+
+# Per-request latencies kept for the p50/p99 in stats()
+LATENCY_WINDOW = 2048
+
+
+class _BatchStats:
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._latency_ms = deque(maxlen=LATENCY_WINDOW)
+
+    @staticmethod
+    def _matched(batch: List[Any], results: Any) -> List[Any]:
+        """results as a list, checked to have one result per batch item."""
+        results = list(results)
+        if len(results) != len(batch):
+            raise RuntimeError(f"batch function returned {len(results)} results for {len(batch)} items")
+        return results
+
+    def _record(self, n_items: int, started: List[float]) -> None:
+        now = time.perf_counter()
+        self.batches += 1
+        self.items += n_items
+        self._latency_ms.extend((now - t) * 1000.0 for t in started)
+
+    def stats(self) -> Dict[str, Any]:
+        lat = np.fromiter(self._latency_ms, dtype=np.float64)
+        p50, p99 = np.percentile(lat, [50, 99]) if len(lat) else (None, None)
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else None,
+            "p50_ms": None if p50 is None else round(float(p50), 2),
+            "p99_ms": None if p99 is None else round(float(p99), 2),
+        }
+
+
+class MicroBatcher(_BatchStats):
+    """Thread-based micro-batcher; one daemon thread runs the batches."""
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], max_batch: int = 64, max_wait_ms: float = 2.0,
+                 name: str = "microbatch"):
+        super().__init__(max_batch, max_wait_ms)
+        self._fn = fn
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Any:
+        """Block until the batch containing item has run; return its result."""
+        fut: Future = Future()
+        self._queue.put((item, fut, time.perf_counter()))
+        return fut.result()
+
+    def _collect(self) -> List[Any]:
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait_s
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                # past the deadline, still take whatever is already queued
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                results = self._matched(batch, self._fn([item for item, _, _ in batch]))
+            except BaseException as ex:
+                for _, fut, _ in batch:
+                    fut.set_exception(ex)
+            else:
+                for (_, fut, _), result in zip(batch, results):
+                    fut.set_result(result)
+            self._record(len(batch), [t for _, _, t in batch])
+
+
+class AsyncMicroBatcher(_BatchStats):
+    """
+    Coroutine micro-batcher. fn is awaited (typically it hands the batch to a
+    thread pool); batches flush from the event loop, no background task.
+    """
+
+    def __init__(self, fn: Callable[[List[Any]], Awaitable[List[Any]]], max_batch: int = 64,
+                 max_wait_ms: float = 2.0):
+        super().__init__(max_batch, max_wait_ms)
+        self._fn = fn
+        self._pending: List[Any] = []
+        self._timer: "asyncio.TimerHandle" = None
+        # running batches; the loop only keeps weak references to tasks
+        self._tasks: Set["asyncio.Task"] = set()
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, fut, time.perf_counter()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_s, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Any]) -> None:
+        try:
+            results = self._matched(batch, await self._fn([item for item, _, _ in batch]))
+        except BaseException as ex:
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(ex)
+        else:
+            for (_, fut, _), result in zip(batch, results):
+                if not fut.done():  # caller may have been cancelled
+                    fut.set_result(result)
+        self._record(len(batch), [t for _, _, t in batch])
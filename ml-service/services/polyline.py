@@ -0,0 +1,182 @@
+# ml-service/services/polyline.py
+"""
+Polyline helpers for the routing pipeline.
+
+decode_polyline / encode_polyline implement the Google encoded polyline
+algorithm (precision 5 as used by Google Directions and OSRM "polyline", or 6
+for OSRM "polyline6") on whole NumPy arrays rather than one character at a time.
+
+simplify_polyline drops vertices with Douglas-Peucker under a metre tolerance:
+every removed vertex lies within tolerance_m of the simplified line, so any
+distance measured against the simplified route is off by at most that much.
+simplify_polylines does the same for a route and its alternatives, splitting
+them where they join or diverge so shared stretches simplify to identical
+vertices (and can be deduplicated downstream).
+"""
+import os
+from typing import Any, List, Sequence
+
+import numpy as np
+
+from services.proximity import EARTH_RADIUS_KM, as_coords, unique_segments
+
+# Default tolerance for route geometry. 10 m is below map rendering precision
+# at the zoom levels the TripPlanner uses and negligible next to a 5 km corridor.
+DEFAULT_SIMPLIFY_TOLERANCE_M = float(os.getenv("ROUTE_SIMPLIFY_TOLERANCE_M", "10"))
+
+
+# Enough 5-bit groups for any zigzagged 64-bit delta
+_MAX_GROUPS = 13
+
+
+def decode_polyline(polyline_str: str, precision: int = 5) -> np.ndarray:
+    """Encoded polyline -> float64 array of shape (N, 2) in (lat, lon) order."""
+    if not polyline_str:
+        return np.empty((0, 2), dtype=np.float64)
+    b = np.frombuffer(polyline_str.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if b.min() < 0 or b.max() > 0x3F or b[-1] >= 0x20:
+        raise ValueError("malformed encoded polyline")
+
+    # every byte below 0x20 terminates one varint; group bytes by the value they belong to
+    ends = np.flatnonzero(b < 0x20)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    if len(starts) % 2:
+        raise ValueError("malformed encoded polyline (odd number of values)")
+    shift = 5 * (np.arange(len(b)) - np.repeat(starts, ends - starts + 1))
+    v = np.add.reduceat((b & 0x1F) << shift, starts)
+    v = (v >> 1) ^ -(v & 1)  # zigzag -> signed delta
+
+    coords = np.cumsum(v.reshape(-1, 2), axis=0, dtype=np.int64)
+    return coords / float(10 ** precision)
+
+
+def encode_polyline(coords: Any, precision: int = 5) -> str:
+    """(lat, lon) sequence or array -> encoded polyline string."""
+    pts = as_coords(coords)
+    if len(pts) == 0:
+        return ""
+    ints = np.round(pts * (10 ** precision)).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    v = (deltas << 1) ^ (deltas >> 63)  # signed -> zigzag (non-negative)
+
+    groups = (v[:, None] >> (5 * np.arange(_MAX_GROUPS))) & 0x1F
+    n_groups = np.maximum(1, (np.floor(np.log2(np.maximum(v, 1))).astype(np.int64) // 5) + 1)
+    used = np.arange(_MAX_GROUPS)[None, :] < n_groups[:, None]
+    more = np.arange(_MAX_GROUPS)[None, :] < (n_groups[:, None] - 1)
+    chars = (groups | (more * 0x20)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def _local_xy_m(line: np.ndarray, ref_lat: float = None) -> np.ndarray:
+    """Equirectangular projection (metres) around ref_lat (default: the polyline's mean latitude)."""
+    m_per_deg = EARTH_RADIUS_KM * 1000.0 * np.pi / 180.0
+    k = np.cos(np.radians(line[:, 0].mean() if ref_lat is None else ref_lat))
+    return np.column_stack([line[:, 1] * k * m_per_deg, line[:, 0] * m_per_deg])
+
+
+def simplify_mask(
+    polyline: Any, tolerance_m: float, fixed: np.ndarray = None, ref_lat: float = None
+) -> np.ndarray:
+    """
+    Boolean mask of the vertices Douglas-Peucker keeps (endpoints always kept).
+    fixed: optional boolean mask of vertices that must be kept; each stretch
+    between them is simplified on its own. ref_lat: latitude of the metric
+    projection (default: the polyline's mean).
+    All open ranges of one recursion level are split in a single vectorized pass.
+    """
+    line = as_coords(polyline)
+    n = len(line)
+    keep = np.ones(n, dtype=bool)
+    if n < 3 or tolerance_m <= 0:
+        return keep
+
+    keep[1:-1] = False
+    if fixed is not None:
+        keep |= fixed
+    xy = _local_xy_m(line, ref_lat)
+    x, y = xy[:, 0].copy(), xy[:, 1].copy()
+    tol2 = float(tolerance_m) ** 2
+    anchors = np.flatnonzero(keep)
+    lo = anchors[:-1]
+    hi = anchors[1:]
+    while len(lo):
+        inner = hi - lo - 1
+        lo, hi, inner = lo[inner > 0], hi[inner > 0], inner[inner > 0]
+        if not len(lo):
+            break
+
+        # flat list of interior vertices, tagged with the range they belong to
+        offsets = np.cumsum(inner) - inner
+        rng_id = np.repeat(np.arange(len(lo)), inner)
+        pts = np.arange(len(rng_id)) + np.repeat(lo + 1 - offsets, inner)
+
+        # per-range terms once, then plain 1-D arithmetic per vertex (no (N, 2) temporaries)
+        ax, ay = x[lo], y[lo]
+        abx, aby = x[hi] - ax, y[hi] - ay
+        den = (abx * abx + aby * aby)[rng_id]
+        apx, apy = x[pts] - ax[rng_id], y[pts] - ay[rng_id]
+        bx, by = abx[rng_id], aby[rng_id]
+        t = np.divide(apx * bx + apy * by, den, out=np.zeros_like(den), where=den > 0.0)
+        np.clip(t, 0.0, 1.0, out=t)
+        dx, dy = apx - t * bx, apy - t * by
+        d2 = dx * dx + dy * dy
+
+        # farthest vertex per range (first one on ties)
+        dmax = np.maximum.reduceat(d2, offsets)
+        cand = np.where(d2 == dmax[rng_id], pts, n)
+        split = np.minimum.reduceat(cand, offsets)
+
+        hit = dmax > tol2
+        split = split[hit]
+        keep[split] = True
+        lo, hi = np.concatenate([lo[hit], split]), np.concatenate([split, hi[hit]])
+    return keep
+
+
+def simplify_polyline(polyline: Any, tolerance_m: float = DEFAULT_SIMPLIFY_TOLERANCE_M) -> np.ndarray:
+    """Douglas-Peucker simplified copy of the polyline as an (N, 2) array."""
+    line = as_coords(polyline)
+    return line[simplify_mask(line, tolerance_m)]
+
+
+def junction_masks(polylines: Sequence[Any]) -> List[np.ndarray]:
+    """
+    Per polyline, a boolean mask of its endpoints and of every vertex where the
+    set of polylines sharing the incoming segment differs from the set sharing
+    the outgoing one, i.e. where alternatives join or diverge.
+    """
+    lines = [as_coords(p) for p in polylines]
+    masks = [np.zeros(len(line), dtype=bool) for line in lines]
+    for m in masks:
+        m[[0, -1] if len(m) else []] = True
+    routed = [i for i, line in enumerate(lines) if len(line) >= 3]
+    if len(routed) < 2:
+        return masks
+
+    seg_a, _, seg_ids = unique_segments([lines[i] for i in routed])
+    shared_by = np.zeros(len(seg_a), dtype=np.uint64)
+    for bit, ids in enumerate(seg_ids):
+        shared_by[ids] |= np.uint64(1) << np.uint64(bit)
+
+    for i, ids in zip(routed, seg_ids):
+        members = shared_by[ids]
+        masks[i][1:-1] = members[:-1] != members[1:]
+    return masks
+
+
+def simplify_polylines(
+    polylines: Sequence[Any], tolerance_m: float = DEFAULT_SIMPLIFY_TOLERANCE_M
+) -> List[np.ndarray]:
+    """
+    simplify_polyline for a route and its alternatives. Junction vertices are
+    kept and every polyline is projected around the same latitude, so a
+    stretch the routes share comes out as the same vertices in each of them.
+    """
+    lines = [as_coords(p) for p in polylines]
+    if not any(len(line) for line in lines):
+        return lines
+    ref_lat = float(np.concatenate(lines)[:, 0].mean())
+    return [
+        line[simplify_mask(line, tolerance_m, fixed, ref_lat)]
+        for line, fixed in zip(lines, junction_masks(lines))
+    ]
@@ -0,0 +1,400 @@
+# ml-service/services/profiling.py
+"""
+Opt-in request profiling: profile a sampled fraction of requests
+(PROFILE_SAMPLE_RATE) and keep any request slower than PROFILE_SLOW_MS, so
+slow cases can be looked at and replayed offline. Off unless one of the two
+is set.
+
+PROFILE_MODE picks the profiler:
+- "sample" (default): one daemon thread reads the stacks of the threads
+  serving profiled requests every PROFILE_INTERVAL_MS (sys._current_frames).
+  Cheap enough to run on every request, which is what PROFILE_SLOW_MS needs
+  since a request is only known to be slow at the end. The result is
+  collapsed stacks ("root;...;leaf" -> samples), readable by flamegraph.pl
+  and speedscope.
+- "cprofile": deterministic cProfile of the request thread, saved as a
+  pstats file as well. It slows Python-heavy code down a lot, so use it with
+  a low sample rate rather than with PROFILE_SLOW_MS.
+
+Only the request's own thread is profiled: the Flask worker thread, or, in
+the ASGI service, the CPU-pool jobs the request runs (track()); time spent
+awaiting on the event loop shows in the Server-Timing stages instead.
+
+A kept capture is written by a background thread to PROFILE_DIR/<id>.json
+(newest PROFILE_KEEP are kept) with:
+- the request method, path and query
+- the status, elapsed time and Server-Timing stages and counts
+- the profile
+- with PROFILE_KEEP_BODY=1 only, since they hold user locations: the JSON
+  body and any upstream responses the pipeline attached (attach()), so the
+  fake upstream (benchmarks/fake_upstream.py --responses) can serve them
+  again and benchmarks/replay_capture.py can send the request back through a
+  local app.
+/debug/profiles lists captures while profiling is on, to holders of the
+admin token (services.admin).
+"""
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+# settings are read by get_profiler() on first use, i.e. after the entry point has loaded .env
+DEFAULT_PROFILE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles")
+# functions listed in a capture's summary
+TOP_FUNCTIONS = 25
+# never profiled: scrapes, health checks and the debug endpoints themselves
+SKIP_PATHS = ("/metrics", "/debug/", "/api/health")
+
+_CAPTURE_ID_RE = re.compile(r"^[0-9A-Za-z_-]+$")
+# code object -> "name (file.py:line)"
+_labels: Dict[Any, str] = {}
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def collapse(frame) -> str:
+    """Stack of frame as "root;...;leaf"."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """
+    One daemon thread that, while any thread is registered, records the
+    collapsed stack of every registered thread every interval_s into the
+    Counter it was registered with.
+    """
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._targets: Dict[int, List[Counter]] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, thread_id: int, samples: Counter) -> None:
+        with self._lock:
+            self._targets.setdefault(thread_id, []).append(samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, thread_id: int, samples: Counter) -> None:
+        with self._lock:
+            targets = self._targets.get(thread_id, [])
+            if samples in targets:
+                targets.remove(samples)
+            if not targets:
+                self._targets.pop(thread_id, None)
+
+    def _run(self) -> None:
+        while True:
+            # counted under the lock, so nothing is added to a Counter once remove() returns
+            with self._lock:
+                idle = not self._targets
+                if not idle:
+                    frames = sys._current_frames()
+                    for tid, counters in self._targets.items():
+                        frame = frames.get(tid)
+                        if frame is not None:
+                            stack = collapse(frame)
+                            for samples in counters:
+                                samples[stack] += 1
+                    del frames
+            if idle:
+                self._wake.wait()
+                self._wake.clear()
+            else:
+                time.sleep(self.interval_s)
+
+
+class Capture:
+    """One profiled request."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, method: str, path: str, query: str, mode: str, sampled: bool):
+        self.id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{os.getpid()}-{next(self._ids):06d}"
+        self.at = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        self.started = time.perf_counter()
+        self.method = method
+        self.path = path
+        self.query = query
+        self.mode = mode
+        self.sampled = sampled
+        self.samples: Counter = Counter()
+        self.profiles: List[cProfile.Profile] = []
+        self.attachments: Dict[str, List[Any]] = {}
+
+
+class Profiler:
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        slow_ms: float = 0.0,
+        mode: str = "sample",
+        interval_ms: float = 5.0,
+        directory: str = DEFAULT_PROFILE_DIR,
+        keep: int = 200,
+        keep_body: bool = False,
+    ):
+        if mode not in ("sample", "cprofile"):
+            raise ValueError(f'PROFILE_MODE must be "sample" or "cprofile", got {mode!r}')
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self.directory = directory
+        self.keep = keep
+        self.keep_body = keep_body
+        self.enabled = sample_rate > 0 or slow_ms > 0
+        self._sampler = StackSampler(interval_ms / 1000.0) if mode == "sample" else None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+        self._lock = threading.Lock()
+        self.profiled = 0
+        self.kept = 0
+
+    # ---------- request lifecycle ----------
+    def begin(self, method: str, path: str, query: str = "") -> Optional[Capture]:
+        """Capture for this request if it is profiled (sampled, or slow capture is on), else None."""
+        if not self.enabled or path.startswith(SKIP_PATHS):
+            return None
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_ms <= 0:
+            return None
+        capture = Capture(method, path, query, self.mode, sampled)
+        with self._lock:
+            self.profiled += 1
+        _current.set(capture)
+        return capture
+
+    def start_thread(self, capture: Capture) -> Any:
+        """Start profiling the calling thread for capture; returns the handle for stop_thread."""
+        if self._sampler is not None:
+            self._sampler.add(threading.get_ident(), capture.samples)
+            return threading.get_ident()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active in this thread
+            return None
+        return profile
+
+    def stop_thread(self, capture: Capture, handle: Any) -> None:
+        if handle is None:
+            return
+        if self._sampler is not None:
+            self._sampler.remove(handle, capture.samples)
+            return
+        handle.disable()
+        capture.profiles.append(handle)
+
+    def end(self, capture: Capture, status: int, body: Any = None, timing: Any = None) -> bool:
+        """
+        Finish capture; saves it when sampled or slow. Returns whether it is
+        kept. body is dropped unless keep_body.
+        """
+        _current.set(None)
+        elapsed_ms = (time.perf_counter() - capture.started) * 1000
+        slow = self.slow_ms > 0 and elapsed_ms >= self.slow_ms
+        if not (capture.sampled or slow):
+            return False
+        record = {
+            "id": capture.id,
+            "at": capture.at,
+            "reason": "slow" if slow else "sampled",
+            "method": capture.method,
+            "path": capture.path,
+            "query": capture.query,
+            "body": body if self.keep_body else None,
+            "status": status,
+            "elapsed_ms": round(elapsed_ms, 2),
+            "stages_ms": {k: round(v, 2) for k, v in (timing.stages.items() if timing else ())},
+            "counts": dict(timing.counts) if timing else {},
+            "upstream": capture.attachments if self.keep_body else {},
+        }
+        with self._lock:
+            self.kept += 1
+        self._writer.submit(self._save, capture, record)
+        return True
+
+    # ---------- output ----------
+    def _save(self, capture: Capture, record: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, capture.id)
+        if capture.mode == "sample":
+            record["profile"] = {
+                "mode": "sample",
+                "interval_ms": self.interval_ms,
+                "samples": sum(capture.samples.values()),
+                "top": _top_sampled(capture.samples),
+                "stacks": dict(capture.samples.most_common()),
+            }
+        else:
+            record["profile"] = {"mode": "cprofile", "top": [], "pstats": None}
+            if capture.profiles:
+                stats = pstats.Stats(capture.profiles[0], stream=io.StringIO())
+                for profile in capture.profiles[1:]:
+                    stats.add(profile)
+                stats.dump_stats(base + ".prof")
+                record["profile"].update(top=_top_cprofile(stats), pstats=os.path.basename(base) + ".prof")
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(record, f, default=str)
+        os.replace(base + ".json.tmp", base + ".json")
+        self._prune()
+
+    def _prune(self) -> None:
+        paths = sorted(
+            (os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith(".json")),
+            key=os.path.getmtime,
+        )
+        for path in paths[:max(0, len(paths) - self.keep)]:
+            for p in (path, path[:-len(".json")] + ".prof"):
+                if os.path.exists(p):
+                    os.remove(p)
+
+    def captures(self) -> List[Dict[str, Any]]:
+        """Summaries of the saved captures, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        out = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            out.append({k: record.get(k) for k in ("id", "at", "reason", "method", "path", "status", "elapsed_ms",
+                                                   "stages_ms")})
+        return sorted(out, key=lambda c: c["at"] or "", reverse=True)
+
+    def capture(self, capture_id: str) -> Optional[Dict[str, Any]]:
+        path = self.capture_path(capture_id, ".json")
+        if path is None:
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def capture_path(self, capture_id: str, suffix: str) -> Optional[str]:
+        """Path of a capture's .json / .prof file, None for unknown or malformed ids."""
+        if not _CAPTURE_ID_RE.match(capture_id or ""):
+            return None
+        path = os.path.join(self.directory, capture_id + suffix)
+        return path if os.path.exists(path) else None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "interval_ms": self.interval_ms if self.mode == "sample" else None,
+            "directory": self.directory,
+            "keep": self.keep,
+            "keep_body": self.keep_body,
+            "profiled": self.profiled,
+            "kept": self.kept,
+        }
+
+
+def collapsed_text(record: Dict[str, Any]) -> str:
+    """A sample-mode capture's stacks in collapsed format ("stack count" lines)."""
+    return "".join(f"{stack} {n}\n" for stack, n in record.get("profile", {}).get("stacks", {}).items())
+
+
+def _top_sampled(samples: Counter) -> List[Dict[str, Any]]:
+    total = sum(samples.values()) or 1
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, n in samples.items():
+        frames = stack.split(";")
+        own[frames[-1]] += n
+        for label in set(frames):
+            inclusive[label] += n
+    return [
+        {"function": label, "self_pct": round(100 * own[label] / total, 1),
+         "total_pct": round(100 * inclusive[label] / total, 1)}
+        for label, _ in own.most_common(TOP_FUNCTIONS)
+    ]
+
+
+def _top_cprofile(stats: pstats.Stats) -> List[Dict[str, Any]]:
+    rows = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return [
+        {"function": f"{func} ({os.path.basename(path)}:{line})", "calls": nc, "self_ms": round(tt * 1000, 3),
+         "total_ms": round(ct * 1000, 3)}
+        for (path, line, func), (cc, nc, tt, ct, _) in rows
+    ]
+
+
+_current: ContextVar[Optional[Capture]] = ContextVar("ampora_profile_capture", default=None)
+
+_profiler: Optional[Profiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler:
+    """Process-wide profiler configured from the PROFILE_* env vars (read on first call)."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler(
+                sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+                slow_ms=float(os.getenv("PROFILE_SLOW_MS", "0")),
+                mode=os.getenv("PROFILE_MODE", "sample"),
+                interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+                directory=os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR),
+                keep=int(os.getenv("PROFILE_KEEP", "200")),
+                keep_body=os.getenv("PROFILE_KEEP_BODY", "0") == "1",
+            )
+        return _profiler
+
+
+def current_capture() -> Optional[Capture]:
+    return _current.get()
+
+
+def attach(name: str, value: Any) -> None:
+    """
+    Keep value (e.g. a raw upstream response) with the current request's
+    capture, if it is profiled and request data is kept (PROFILE_KEEP_BODY).
+    """
+    capture = _current.get()
+    if capture is not None and get_profiler().keep_body:
+        capture.attachments.setdefault(name, []).append(value)
+
+
+def track(fn: Callable, *args: Any) -> Any:
+    """fn(*args), profiled for the current capture (if any) in the calling thread; for pool jobs."""
+    capture = _current.get()
+    if capture is None:
+        return fn(*args)
+    profiler = get_profiler()
+    handle = profiler.start_thread(capture)
+    try:
+        return fn(*args)
+    finally:
+        profiler.stop_thread(capture, handle)
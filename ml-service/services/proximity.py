@@ -0,0 +1,139 @@
+# ml-service/services/proximity.py
+"""
+Vectorized route-corridor math shared by all planners.
+
+Polylines and station positions are kept as float64 NumPy arrays of shape
+(N, 2) in (lat, lon) order, so a whole station set is measured against a whole
+route in a few array operations instead of one geodesic call per pair.
+"""
+from collections.abc import Mapping
+from typing import Any, List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Upper bound on station x segment cells evaluated at once. Keeps temporaries
+# to a few tens of MB no matter how long the route or how big the network.
+MAX_CELLS_PER_CHUNK = 500_000
+
+
+def as_coords(points: Any) -> np.ndarray:
+    """[(lat, lon), ...] (list, tuple or array) -> float64 array of shape (N, 2)."""
+    arr = np.asarray(points, dtype=np.float64)
+    if arr.size == 0:
+        return np.empty((0, 2), dtype=np.float64)
+    return arr.reshape(-1, 2)
+
+
+def station_coords(stations: Sequence[Any]) -> np.ndarray:
+    """(lat, lon) array for station dicts or DTOs (anything exposing lat/lon)."""
+    out = np.empty((len(stations), 2), dtype=np.float64)
+    for i, s in enumerate(stations):
+        if isinstance(s, Mapping):
+            out[i, 0], out[i, 1] = s["lat"], s["lon"]
+        else:
+            out[i, 0], out[i, 1] = s.lat, s.lon
+    return out
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km; all arguments in degrees and broadcastable."""
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2.0) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def unique_segments(polylines: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+    """
+    Distinct directed segments across several polylines (identical endpoint
+    coordinates), in order of first appearance. Returns their start and end
+    points as (S, 2) arrays and, per polyline, the id of each of its segments.
+    """
+    lines = [as_coords(p) for p in polylines]
+    counts = [max(len(line) - 1, 0) for line in lines]
+    seg_a = np.concatenate([line[:-1] for line in lines if len(line)] or [np.empty((0, 2))])
+    seg_b = np.concatenate([line[1:] for line in lines if len(line)] or [np.empty((0, 2))])
+    if not len(seg_a):
+        return seg_a, seg_b, [np.empty(0, dtype=np.intp) for _ in lines]
+
+    # vertex ids from a 1-D sort (lat + i*lon), then one int64 code per segment
+    verts = np.concatenate([seg_a, seg_b])
+    _, vid = np.unique(verts[:, 0] + 1j * verts[:, 1], return_inverse=True)
+    vid = vid.ravel().astype(np.int64)
+    codes = vid[:len(seg_a)] * len(verts) + vid[len(seg_a):]
+    _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    ids = np.split(rank[inverse.ravel()], np.cumsum(counts)[:-1])
+    return seg_a[first[order]], seg_b[first[order]], ids
+
+
+def segment_feet(points: np.ndarray, a: np.ndarray, ab: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Closest location on segment a -> a + ab for each point, with the three
+    (..., 2) arrays broadcast against each other (a point x segment grid, or
+    paired lists). Returns the squared distance in a local equirectangular
+    frame centred on the point (scaled degrees, only good for ranking) and the
+    clamped position t of that foot point along the segment.
+    """
+    k = np.cos(np.radians(points[..., 0]))  # a degree of lon is cos(lat) degrees of lat at p
+    # segment start relative to p, and segment direction, in scaled degrees
+    ax = (a[..., 1] - points[..., 1]) * k
+    ay = a[..., 0] - points[..., 0]
+    dx = ab[..., 1] * k
+    dy = ab[..., 0]
+    den = dx * dx + dy * dy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(den > 0.0, -(ax * dx + ay * dy) / den, 0.0)
+    np.clip(t, 0.0, 1.0, out=t)
+    fx = ax + t * dx
+    fy = ay + t * dy
+    return fx * fx + fy * fy, t
+
+
+def project_onto_polyline(points: Any, polyline: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact point-to-polyline projection for every point, in one vectorized pass.
+
+    Returns (cross_track_km, along_route_km): the distance from each point to
+    the closest location on the polyline, and how far along the polyline (from
+    its first vertex) that closest location lies. Segments are projected in a
+    local equirectangular frame centred on each point, then the winning foot
+    point is measured with haversine. Both arrays are inf when the polyline
+    has fewer than two vertices.
+    """
+    pts = as_coords(points)
+    line = as_coords(polyline)
+    cross = np.full(len(pts), np.inf)
+    along = np.full(len(pts), np.inf)
+    if len(pts) == 0 or len(line) < 2:
+        return cross, along
+
+    a = line[:-1]
+    ab = line[1:] - a
+    seg_km = haversine_km(a[:, 0], a[:, 1], line[1:, 0], line[1:, 1])
+    start_km = np.concatenate([[0.0], np.cumsum(seg_km)[:-1]])
+
+    rows = max(1, MAX_CELLS_PER_CHUNK // len(a))
+    for lo in range(0, len(pts), rows):
+        chunk = pts[lo:lo + rows]
+        d2, t = segment_feet(chunk[:, None, :], a[None, :, :], ab[None, :, :])
+        best = np.argmin(d2, axis=1)
+
+        r = np.arange(len(chunk))
+        t_best = t[r, best]
+        foot = a[best] + t_best[:, None] * ab[best]
+        cross[lo:lo + rows] = haversine_km(chunk[:, 0], chunk[:, 1], foot[:, 0], foot[:, 1])
+        along[lo:lo + rows] = start_km[best] + t_best * seg_km[best]
+    return cross, along
+
+
+def distances_to_polyline_km(points: Any, polyline: Any) -> np.ndarray:
+    """Cross-track distance (km) from every point to the polyline."""
+    return project_onto_polyline(points, polyline)[0]
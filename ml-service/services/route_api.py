@@ -0,0 +1,214 @@
+# ml-service/services/route_api.py
+"""
+Framework-neutral parts of /api/route shared by the Flask app (app.py) and the
+ASGI service (asgi.py): request body parsing/validation and response shaping.
+
+Returned paths are Douglas-Peucker simplified here (path_detail "simplified"),
+only for the routes a response carries; corridor matching runs on the full
+geometry.
+"""
+import os
+from typing import Any, Dict, List, Tuple
+
+from services.metrics import stage
+from services.polyline import DEFAULT_SIMPLIFY_TOLERANCE_M, encode_polyline, simplify_polylines
+
+MAX_NEARBY_STATIONS = 60
+
+# /api/routes/batch: jobs per request, and upstream routing calls in flight per batch
+MAX_BATCH_JOBS = int(os.getenv("ROUTE_BATCH_MAX_JOBS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("ROUTE_BATCH_CONCURRENCY", "8"))
+
+_PATH_OPTIONS = ("path_detail", "path_format", "polyline_precision")
+
+
+class RouteRequestError(ValueError):
+    """The request body is invalid; endpoints answer 400 with the message."""
+
+
+def _latlng(p: Dict[str, Any]):
+    return (float(p["lat"]), float(p["lng"]))
+
+
+def parse_route_request(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Body:
+    {
+      "start": {"lat": <float>, "lng": <float>},
+      "end": {"lat": <float>, "lng": <float>},
+      "stops": [ {"lat":..., "lng":...}, ... ],  # optional
+      "path_detail": "simplified" | "full",       # optional, default "simplified"
+      "path_format": "coords" | "polyline",       # optional, default "coords"
+      "polyline_precision": 5 | 6                 # optional, with path_format "polyline"
+    }
+    With path_format "polyline" each route's "path" is an encoded polyline string.
+    """
+    if not isinstance(data, dict):
+        raise RouteRequestError("JSON object body required")
+    start = data.get("start")
+    end = data.get("end")
+    stops = data.get("stops") or []
+    path_detail = data.get("path_detail", "simplified")
+    path_format = data.get("path_format", "coords")
+    precision = data.get("polyline_precision", 5)
+
+    if not start or not end:
+        raise RouteRequestError("start {lat,lng} and end {lat,lng} required")
+    if path_detail not in ("simplified", "full"):
+        raise RouteRequestError("path_detail must be 'simplified' or 'full'")
+    if path_format not in ("coords", "polyline") or precision not in (5, 6):
+        raise RouteRequestError("path_format must be 'coords' or 'polyline' (precision 5 or 6)")
+
+    try:
+        return {
+            "start": _latlng(start),
+            "end": _latlng(end),
+            "waypoints": [_latlng(p) for p in stops if p and "lat" in p and "lng" in p],
+            "path_detail": path_detail,
+            "path_format": path_format,
+            "precision": precision,
+        }
+    except (KeyError, TypeError, ValueError):
+        raise RouteRequestError("start, end and stops need numeric lat and lng")
+
+
+def route_response(routes: List[Dict[str, Any]], near: List[List[Any]], req: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    JSON body for a successful route request. near holds one station list per
+    route; each route carries its own "nearby_stations" (tagged with
+    route_index) and the top-level list stays the fastest route's.
+    """
+
+    paths = [r["path"] for r in routes]
+    if req["path_detail"] == "simplified":
+        # simplified together, so stretches the alternatives share keep identical vertices
+        with stage("simplify"):
+            paths = simplify_polylines(paths, DEFAULT_SIMPLIFY_TOLERANCE_M)
+
+    def _path(path):
+        if req["path_format"] == "polyline":
+            return encode_polyline(path, req["precision"])
+        return path.tolist()  # [ [lat,lon], ... ]
+
+    def _stations(stations):
+        return [s.model_dump() if hasattr(s, "model_dump") else s for s in stations[:MAX_NEARBY_STATIONS]]
+
+    return {
+        "success": True,
+        "routes": [{
+            "distance_km": round(r["distance_km"], 1),
+            "duration_min": round(r["duration_min"], 0),
+            "path": _path(path),
+            "nearby_stations": _stations(stations),
+        } for r, path, stations in zip(routes, paths, near)],
+        "nearby_stations": _stations(near[0]) if near else [],
+    }
+
+
+def parse_batch_request(data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Body:
+    {
+      "jobs": [ {"start": {...}, "end": {...}, "stops": [...]}, ... ],
+      "path_detail" / "path_format" / "polyline_precision": as for /api/route,
+                                                 # defaults for every job, a job may override
+      "stream": false                            # optional: NDJSON lines as jobs finish
+    }
+    Returns (parsed jobs, stream). A malformed job rejects the whole batch.
+    """
+    if not isinstance(data, dict):
+        raise RouteRequestError("JSON object body required")
+    jobs = data.get("jobs")
+    if not isinstance(jobs, list) or not jobs:
+        raise RouteRequestError("jobs must be a non-empty list")
+    if len(jobs) > MAX_BATCH_JOBS:
+        raise RouteRequestError(f"at most {MAX_BATCH_JOBS} jobs per batch")
+
+    defaults = {k: data[k] for k in _PATH_OPTIONS if k in data}
+    parsed = []
+    for i, job in enumerate(jobs):
+        if not isinstance(job, dict):
+            raise RouteRequestError(f"jobs[{i}]: JSON object required")
+        try:
+            parsed.append(parse_route_request({**defaults, **job}))
+        except RouteRequestError as ex:
+            raise RouteRequestError(f"jobs[{i}]: {ex}")
+    return parsed, bool(data.get("stream", False))
+
+
+def batch_result(index: int, routes: List[Dict[str, Any]], near: List[Any], req: Dict[str, Any]) -> Dict[str, Any]:
+    """One job's entry in a batch response: the /api/route body plus index and status."""
+    if not routes:
+        return batch_error(index, 404, "No routes returned")
+    return {"index": index, "status": 200, **route_response(routes, near, req)}
+
+
+def batch_error(index: int, status: int, message: str) -> Dict[str, Any]:
+    return {"index": index, "status": status, "success": False, "error": message}
+
+
+# Defaults match the frontend's EnergyCalculator (60 kWh, 0.18 kWh/km)
+DEFAULT_BATTERY_KWH = 60.0
+DEFAULT_KWH_PER_KM = 0.18
+
+
+def _percent(data: Dict[str, Any], key: str, default: float) -> float:
+    try:
+        value = float(data.get(key, default))
+    except (TypeError, ValueError):
+        raise RouteRequestError(f"{key} must be numeric")
+    if not 0.0 <= value <= 100.0:
+        raise RouteRequestError(f"{key} must be between 0 and 100")
+    return value / 100.0
+
+
+def parse_plan_request(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Body: the /api/route body plus
+    {
+      "vehicle": {"battery_kwh": 60, "range_km": 330,  # or "kwh_per_km": 0.18
+                  "max_charge_kw": 100},               # optional, caps station power
+      "soc_percent": 80,                               # current state of charge
+      "min_arrival_soc_percent": 10,                   # at every charger and at the destination
+      "max_charge_soc_percent": 100,                   # optional, stop charging above this
+      "route_index": 0                                 # optional, which alternative to plan on
+    }
+    """
+    req = parse_route_request(data)
+    vehicle = data.get("vehicle") or {}
+    if not isinstance(vehicle, dict):
+        raise RouteRequestError("vehicle must be an object")
+    try:
+        battery_kwh = float(vehicle.get("battery_kwh", DEFAULT_BATTERY_KWH))
+        if vehicle.get("range_km") is not None:
+            kwh_per_km = battery_kwh / float(vehicle["range_km"])
+        else:
+            kwh_per_km = float(vehicle.get("kwh_per_km", DEFAULT_KWH_PER_KM))
+        max_charge_kw = float(vehicle["max_charge_kw"]) if vehicle.get("max_charge_kw") is not None else None
+        route_index = int(data.get("route_index", 0))
+    except (TypeError, ValueError, ZeroDivisionError):
+        raise RouteRequestError("vehicle values and route_index must be numeric and range_km non-zero")
+    req.update(
+        battery_kwh=battery_kwh,
+        kwh_per_km=kwh_per_km,
+        max_charge_kw=max_charge_kw,
+        soc=_percent(data, "soc_percent", 100.0),
+        min_arrival_soc=_percent(data, "min_arrival_soc_percent", 10.0),
+        max_charge_soc=_percent(data, "max_charge_soc_percent", 100.0),
+        route_index=route_index,
+    )
+
+    if battery_kwh <= 0 or kwh_per_km <= 0 or (max_charge_kw is not None and max_charge_kw <= 0):
+        raise RouteRequestError("battery_kwh, range_km / kwh_per_km and max_charge_kw must be positive")
+    if req["min_arrival_soc"] >= req["max_charge_soc"]:
+        raise RouteRequestError("min_arrival_soc_percent must be below max_charge_soc_percent")
+    if req["route_index"] < 0:
+        raise RouteRequestError("route_index must be >= 0")
+    return req
+
+
+def plan_response(route: Dict[str, Any], plan: Dict[str, Any], req: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON body for /api/plan: the planned route (as in /api/route) and its charging plan."""
+    planned = route_response([route], [[]], req)["routes"][0]
+    planned.pop("nearby_stations")
+    return {"success": True, "route": planned, "plan": plan}
@@ -0,0 +1,306 @@
+# ml-service/services/routing.py
+"""
+OSRM HTTP clients (blocking for Flask, async for the ASGI service): one
+keep-alive connection pool per process, a configurable
+base URL (OSRM_BASE_URL) so we can point at our own osrm-backend or a local
+stand-in, short per-attempt timeouts, bounded retries with jittered
+exponential backoff, all capped by a total deadline per call
+(OSRM_TOTAL_TIMEOUT_S), and a circuit breaker, fed by every failed attempt,
+that fails fast while the router is down instead of tying up workers.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.metrics import record_upstream_error
+
+OSRM_BASE_URL = os.getenv("OSRM_BASE_URL", "https://router.project-osrm.org")
+OSRM_PROFILE = os.getenv("OSRM_PROFILE", "driving")
+OSRM_CONNECT_TIMEOUT_S = float(os.getenv("OSRM_CONNECT_TIMEOUT_S", "2"))
+OSRM_READ_TIMEOUT_S = float(os.getenv("OSRM_READ_TIMEOUT_S", "6"))
+OSRM_RETRIES = int(os.getenv("OSRM_RETRIES", "2"))
+# Attempts, backoff and waits of one call together stop after this long
+OSRM_TOTAL_TIMEOUT_S = float(os.getenv("OSRM_TOTAL_TIMEOUT_S", "10"))
+OSRM_POOL_SIZE = int(os.getenv("OSRM_POOL_SIZE", "20"))
+# Coordinates per /table request; osrm-routed's default --max-table-size is 100
+OSRM_TABLE_MAX = int(os.getenv("OSRM_TABLE_MAX", "100"))
+
+# Google Directions endpoint for both Google planners; overridable to point at
+# a stand-in server (benchmarks/fake_upstream.py)
+GOOGLE_DIRECTIONS_URL = os.getenv("GOOGLE_DIRECTIONS_URL", "https://maps.googleapis.com/maps/api/directions/json")
+
+# Status codes worth another attempt; other 4xx are the caller's fault.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker. After failure_threshold failures it opens for
+    reset_timeout_s, then lets a single probe through (half-open): success
+    closes it, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at >= self.reset_timeout_s:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> Tuple[bool, bool]:
+        """
+        (allowed, probe): whether a call may go ahead, and whether it took the
+        half-open probe slot, which only that call may release().
+        """
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True, False
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True, True
+            return False, False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """
+        Free the half-open probe slot when the call holding it ends without a
+        verdict (cancelled, or an unexpected error), so the next call can probe.
+        """
+        with self._lock:
+            self._probing = False
+
+
+class _OSRMBase:
+    """Configuration, URL building and response handling shared by both clients."""
+
+    def __init__(
+        self,
+        base_url: str = OSRM_BASE_URL,
+        profile: str = OSRM_PROFILE,
+        connect_timeout_s: float = OSRM_CONNECT_TIMEOUT_S,
+        read_timeout_s: float = OSRM_READ_TIMEOUT_S,
+        retries: int = OSRM_RETRIES,
+        total_timeout_s: float = OSRM_TOTAL_TIMEOUT_S,
+        backoff_s: float = 0.2,
+        pool_size: int = OSRM_POOL_SIZE,
+        breaker: CircuitBreaker = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.profile = profile
+        self.connect_timeout_s = connect_timeout_s
+        self.read_timeout_s = read_timeout_s
+        self.retries = retries
+        self.total_timeout_s = total_timeout_s
+        self.backoff_s = backoff_s
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+
+    def _url(self, service: str, points: Iterable[Sequence[float]]) -> str:
+        # OSRM wants lon,lat pairs separated by ';'
+        coords = ";".join(f"{p[1]},{p[0]}" for p in points)
+        return f"{self.base_url}/{service}/v1/{self.profile}/{coords}"
+
+    def _check_open(self) -> bool:
+        """Raise CircuitOpenError if the breaker rejects the call; else whether it is the half-open probe."""
+        allowed, probe = self.breaker.allow()
+        if not allowed:
+            record_upstream_error("osrm", "circuit_open")
+            raise CircuitOpenError(f"OSRM circuit open ({self.base_url})")
+        return probe
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter: uniform(0, backoff * 2^attempt)
+        return random.uniform(0, self.backoff_s * (2 ** attempt))
+
+    def _schedule(self, attempt: int, deadline: float) -> Optional[Tuple[float, float, float]]:
+        """
+        (backoff wait, connect timeout, read timeout) for this attempt, shrunk
+        to what is left before deadline; None once no time is left for a retry.
+        """
+        wait = self._backoff(attempt) if attempt else 0.0
+        remaining = deadline - time.monotonic() - wait
+        if attempt and remaining <= 0:
+            return None
+        remaining = max(remaining, 0.001)
+        return wait, min(self.connect_timeout_s, remaining), min(self.read_timeout_s, remaining)
+
+    def _failed(self, error: str, exc: Exception) -> Exception:
+        # every failed attempt counts toward opening the breaker
+        record_upstream_error("osrm", error)
+        self.breaker.record_failure()
+        return exc
+
+    def _handle(self, status: int, body: Callable[[], Any], raise_for_status: Callable[[], None]) -> Dict[str, Any]:
+        # Upstream answered: even a 4xx (bad coordinates, NoRoute) means it is healthy
+        self.breaker.record_success()
+        if status < 400:
+            return body()
+        try:
+            payload = body()
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict) and "code" in payload:
+            record_upstream_error("osrm", str(payload["code"]))
+            return payload  # OSRM error payload, e.g. {"code": "NoRoute"}
+        raise_for_status()
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        return {"base_url": self.base_url, "circuit": self.breaker.state}
+
+
+class OSRMClient(_OSRMBase):
+    """Blocking client on a pooled requests.Session (Flask workers)."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept": "application/json"})
+
+    def route(self, points: Sequence[Tuple[float, float]], params: Dict[str, Any]) -> Dict[str, Any]:
+        """GET /route/v1/{profile}/{coords}; points are (lat, lon)."""
+        return self._get("route", points, params)
+
+    def table_durations(
+        self, origin: Tuple[float, float], destinations: Sequence[Tuple[float, float]]
+    ) -> List[Optional[float]]:
+        """
+        Driving seconds from origin to each destination via /table, split into
+        requests of at most OSRM_TABLE_MAX coordinates. None where OSRM found
+        no route.
+        """
+        out: List[Optional[float]] = []
+        per_call = max(1, OSRM_TABLE_MAX - 1)
+        for lo in range(0, len(destinations), per_call):
+            chunk = list(destinations[lo:lo + per_call])
+            params = {
+                "sources": "0",
+                "destinations": ";".join(str(i) for i in range(1, len(chunk) + 1)),
+                "annotations": "duration",
+            }
+            data = self._get("table", [origin, *chunk], params)
+            if data.get("code") != "Ok":
+                raise RuntimeError(f"OSRM table failed: {data.get('code')} {data.get('message', '')}".strip())
+            out.extend(data["durations"][0])
+        return out
+
+    def _get(self, service: str, points: Sequence[Tuple[float, float]], params: Dict[str, Any]) -> Dict[str, Any]:
+        probe = self._check_open()
+        url = self._url(service, points)
+        deadline = time.monotonic() + self.total_timeout_s
+        last_exc: Exception = None
+        try:
+            for attempt in range(self.retries + 1):
+                schedule = self._schedule(attempt, deadline)
+                if schedule is None:
+                    break
+                wait, connect_s, read_s = schedule
+                if wait:
+                    time.sleep(wait)
+                try:
+                    r = self.session.get(url, params=params, timeout=(connect_s, read_s))
+                except requests.RequestException as ex:
+                    last_exc = self._failed(type(ex).__name__, ex)
+                else:
+                    if r.status_code not in RETRY_STATUS:
+                        return self._handle(r.status_code, r.json, r.raise_for_status)
+                    last_exc = self._failed(
+                        str(r.status_code), requests.HTTPError(f"{r.status_code} from OSRM", response=r)
+                    )
+                if self.breaker.state == "open":
+                    break
+        finally:
+            if probe:
+                self.breaker.release()
+        raise last_exc
+
+
+class AsyncOSRMClient(_OSRMBase):
+    """Event-loop client on a pooled httpx.AsyncClient (ASGI service)."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            headers={"Accept": "application/json"},
+            timeout=httpx.Timeout(self.read_timeout_s, connect=self.connect_timeout_s),
+            limits=httpx.Limits(max_keepalive_connections=self.pool_size, max_connections=self.pool_size * 2),
+        )
+
+    async def route(self, points: Sequence[Tuple[float, float]], params: Dict[str, Any]) -> Dict[str, Any]:
+        """GET /route/v1/{profile}/{coords}; points are (lat, lon)."""
+        return await self._get("route", points, params)
+
+    async def _get(self, service: str, points: Sequence[Tuple[float, float]], params: Dict[str, Any]) -> Dict[str, Any]:
+        probe = self._check_open()
+        url = self._url(service, points)
+        deadline = time.monotonic() + self.total_timeout_s
+        last_exc: Exception = None
+        try:
+            for attempt in range(self.retries + 1):
+                schedule = self._schedule(attempt, deadline)
+                if schedule is None:
+                    break
+                wait, connect_s, read_s = schedule
+                if wait:
+                    await asyncio.sleep(wait)
+                try:
+                    r = await self.client.get(url, params=params, timeout=httpx.Timeout(read_s, connect=connect_s))
+                except httpx.HTTPError as ex:
+                    last_exc = self._failed(type(ex).__name__, ex)
+                else:
+                    if r.status_code not in RETRY_STATUS:
+                        return self._handle(r.status_code, r.json, r.raise_for_status)
+                    last_exc = self._failed(
+                        str(r.status_code),
+                        httpx.HTTPStatusError(f"{r.status_code} from OSRM", request=r.request, response=r),
+                    )
+                if self.breaker.state == "open":
+                    break
+        finally:
+            # a cancelled or crashed half-open probe must not keep the breaker shut
+            if probe:
+                self.breaker.release()
+        raise last_exc
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
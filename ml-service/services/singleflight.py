@@ -0,0 +1,106 @@
+# ml-service/services/singleflight.py
+"""
+Single-flight request coalescing: while a computation for a key is running,
+further callers with the same key wait for it and share its result (or its
+exception) instead of starting their own. Nothing is kept once the leader
+finishes; results that should outlive the request belong in services.cache.
+
+SingleFlight is for threaded callers (Flask workers), AsyncSingleFlight for
+coroutines on one event loop (ASGI service).
+"""
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _FlightStats(ABC):
+    def __init__(self):
+        self.executed = 0   # computations actually run (leaders)
+        self.coalesced = 0  # callers that joined a computation already in flight
+
+    @abstractmethod
+    def _in_flight(self) -> int:
+        """Keys with a computation running."""
+
+    def stats(self) -> Dict[str, int]:
+        return {"executed": self.executed, "coalesced": self.coalesced, "in_flight": self._in_flight()}
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight(_FlightStats):
+    """Thread-based single flight."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def _in_flight(self) -> int:
+        return len(self._calls)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(_FlightStats):
+    """
+    Coroutine single flight. The computation runs as its own task, so a caller
+    that is cancelled (client went away) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tasks: Dict[Hashable, "asyncio.Task[Any]"] = {}
+
+    def _in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter was cancelled
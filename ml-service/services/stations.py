@@ -0,0 +1,311 @@
+# ml-service/services/stations.py
+"""
+Station set helpers: a uniform lat/lon grid index built once when stations
+are loaded, so corridor queries only measure stations in cells the route's
+buffered bounding boxes touch instead of scanning the whole network, and a
+process-level snapshot so route requests only reload stations when the
+tables actually changed.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from services.metrics import record_corridor
+from services.proximity import (
+    as_coords,
+    haversine_km,
+    project_onto_polyline,
+    segment_feet,
+    station_coords,
+    unique_segments,
+)
+
+KM_PER_DEG_LAT = 111.195
+
+# ~11 km cells: a 5 km corridor touches a handful of cells per route chunk.
+DEFAULT_CELL_DEG = 0.1
+
+# Route vertices per bounding box. Smaller boxes hug curvy roads tighter,
+# larger ones mean fewer cell lookups.
+CHUNK_VERTICES = 32
+
+_KEY_OFFSET = 1 << 20
+
+
+def _cell_keys(i_lat: np.ndarray, i_lon: np.ndarray) -> np.ndarray:
+    return (i_lat.astype(np.int64) + _KEY_OFFSET) * (2 * _KEY_OFFSET) + (i_lon.astype(np.int64) + _KEY_OFFSET)
+
+
+def _pad_boxes(lo: np.ndarray, hi: np.ndarray, buffer_km: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Grow (lat, lon) boxes by buffer_km on every side (in place)."""
+    # 1% slack covers great-circle vs parallel/meridian length differences
+    buffer_km = buffer_km * 1.01
+    pad_lat = buffer_km / KM_PER_DEG_LAT
+    lo[:, 0] -= pad_lat
+    hi[:, 0] += pad_lat
+    max_abs_lat = np.minimum(np.maximum(np.abs(lo[:, 0]), np.abs(hi[:, 0])), 89.0)
+    pad_lon = buffer_km / (KM_PER_DEG_LAT * np.cos(np.radians(max_abs_lat)))
+    lo[:, 1] -= pad_lon
+    hi[:, 1] += pad_lon
+    return lo, hi
+
+
+class StationIndex:
+    """Grid bucket index over station coordinates (positions into the station list)."""
+
+    def __init__(self, stations: Iterable[Any], cell_deg: float = DEFAULT_CELL_DEG):
+        self.cell_deg = float(cell_deg)
+        self.coords = station_coords(list(stations))
+
+        cells = np.floor(self.coords / self.cell_deg).astype(np.int64)
+        keys = _cell_keys(cells[:, 0], cells[:, 1])
+        self._order = np.argsort(keys, kind="stable")
+        self._keys, self._starts, self._counts = np.unique(keys[self._order], return_index=True, return_counts=True)
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def candidates(self, route_polyline: Any, buffer_km: float) -> np.ndarray:
+        """
+        Sorted positions of stations that may lie within buffer_km of the route.
+        Conservative: never drops a station that is actually inside the buffer.
+        """
+        line = as_coords(route_polyline)
+        if len(line) < 2 or not len(self._keys):
+            return np.empty(0, dtype=np.intp)
+
+        # Bounding box per chunk of CHUNK_VERTICES segments (chunks share end vertices)
+        starts = np.arange(0, len(line) - 1, CHUNK_VERTICES)
+        ends = np.minimum(starts + CHUNK_VERTICES, len(line) - 1)
+        lo = np.minimum(np.minimum.reduceat(line[:-1], starts, axis=0), line[ends])
+        hi = np.maximum(np.maximum.reduceat(line[:-1], starts, axis=0), line[ends])
+        return self._in_cells(*_pad_boxes(lo, hi, buffer_km))
+
+    def _in_cells(self, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        """Sorted positions of stations in grid cells the (lat, lon) boxes touch."""
+        c_lo = np.floor(lo / self.cell_deg).astype(np.int64)
+        n_lat, n_lon = (np.floor(hi / self.cell_deg).astype(np.int64) - c_lo + 1).T
+
+        # every (lat, lon) cell of every box, flattened
+        n = n_lat * n_lon
+        box = np.repeat(np.arange(len(n)), n)
+        off = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        keys = np.unique(_cell_keys(c_lo[box, 0] + off // n_lon[box], c_lo[box, 1] + off % n_lon[box]))
+
+        at = np.searchsorted(self._keys, keys)
+        at = at[(at < len(self._keys)) & (self._keys[np.minimum(at, len(self._keys) - 1)] == keys)]
+        if not len(at):
+            return np.empty(0, dtype=np.intp)
+        counts = self._counts[at]
+        rows = np.repeat(self._starts[at] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        picked = self._order[rows]
+        picked.sort()
+        return picked
+
+    def near_route(
+        self, route_polyline: Any, max_distance_km: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (station positions, cross-track km, km from route start) for stations
+        within max_distance_km of the route.
+        """
+        cand = self.candidates(route_polyline, max_distance_km)
+        if len(cand) == 0:
+            record_corridor(0, 0)
+            return cand, np.empty(0), np.empty(0)
+        cross, along = project_onto_polyline(self.coords[cand], route_polyline)
+        keep = cross <= max_distance_km
+        record_corridor(len(cand), int(keep.sum()))
+        return cand[keep], cross[keep], along[keep]
+
+    def near_routes(
+        self, route_polylines: Sequence[Any], max_distance_km: float
+    ) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        near_route for a route and its alternatives, one result per polyline.
+
+        Segments the routes share (identical endpoints) are measured once: the
+        union of segments is cut into blocks of CHUNK_VERTICES in road order,
+        and each station is only measured against blocks whose buffered box
+        contains it. Each route then takes, per station, its closest segment
+        among those pairs, which is exact for every station within
+        max_distance_km.
+        """
+        lines = [as_coords(p) for p in route_polylines]
+        out = [(np.empty(0, dtype=np.intp), np.empty(0), np.empty(0)) for _ in lines]
+        routed = [i for i, line in enumerate(lines) if len(line) >= 2]
+        if not routed or not len(self._keys):
+            record_corridor(0, 0)
+            return out
+
+        # unique directed segments, in order of first appearance so blocks follow the road
+        a, b, seg_ids = unique_segments([lines[i] for i in routed])
+        seg_km = haversine_km(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+
+        block_start = np.arange(0, len(a), CHUNK_VERTICES)
+        lo, hi = _pad_boxes(
+            np.minimum.reduceat(np.minimum(a, b), block_start, axis=0),
+            np.maximum.reduceat(np.maximum(a, b), block_start, axis=0),
+            max_distance_km,
+        )
+        cand = self._in_cells(lo, hi)
+        if len(cand) == 0:
+            record_corridor(0, 0)
+            return out
+        pts = self.coords[cand]
+
+        # (station, segment) pairs for every block box a station falls in
+        inside = (
+            (pts[:, None, 0] >= lo[None, :, 0]) & (pts[:, None, 0] <= hi[None, :, 0])
+            & (pts[:, None, 1] >= lo[None, :, 1]) & (pts[:, None, 1] <= hi[None, :, 1])
+        )
+        p_idx, blk = np.nonzero(inside)
+        blk_len = np.diff(np.append(block_start, len(a)))[blk]
+        pair_pt = np.repeat(p_idx, blk_len)
+        pair_seg = np.repeat(block_start[blk] - np.cumsum(blk_len) + blk_len, blk_len) + np.arange(blk_len.sum())
+        d2, t = segment_feet(pts[pair_pt], a[pair_seg], b[pair_seg] - a[pair_seg])
+
+        for i, ids in zip(routed, seg_ids):
+            # position of each unique segment along this route (first occurrence), -1 if absent
+            pos = np.full(len(a), -1)
+            pos[ids[::-1]] = np.arange(len(ids))[::-1]
+            start_km = np.concatenate([[0.0], np.cumsum(seg_km[ids])[:-1]])
+
+            on = np.flatnonzero(pos[pair_seg] >= 0)
+            if not len(on):
+                continue
+            # pairs are grouped by station: closest segment per group (first one on ties)
+            pp, dd = pair_pt[on], d2[on]
+            group = np.flatnonzero(np.r_[True, pp[1:] != pp[:-1]])
+            dmin = np.repeat(np.minimum.reduceat(dd, group), np.diff(np.append(group, len(dd))))
+            best = np.where(dd == dmin, np.arange(len(dd)), len(dd))
+            pick = on[np.minimum.reduceat(best, group)]
+            pp, ss, tt = pair_pt[pick], pair_seg[pick], t[pick]
+
+            foot = a[ss] + tt[:, None] * (b[ss] - a[ss])
+            cross = haversine_km(pts[pp, 0], pts[pp, 1], foot[:, 0], foot[:, 1])
+            along = start_km[pos[ss]] + tt * seg_km[ss]
+            keep = cross <= max_distance_km
+            out[i] = (cand[pp][keep], cross[keep], along[keep])
+        # a station near several alternatives counts once per route
+        record_corridor(len(cand), sum(len(o[0]) for o in out))
+        return out
+
+
+class StationSet(list):
+    """
+    A loaded list of stations carrying its StationIndex.
+    Treat it as an immutable snapshot; build a new one when stations change.
+    """
+
+    def __init__(self, stations: Iterable[Any] = (), cell_deg: float = DEFAULT_CELL_DEG):
+        super().__init__(stations)
+        self.index = StationIndex(self, cell_deg=cell_deg)
+
+
+def station_index(stations: Any) -> StationIndex:
+    """Index carried by a StationSet, or a throwaway one for a plain list."""
+    index = getattr(stations, "index", None)
+    if isinstance(index, StationIndex):
+        return index
+    return StationIndex(stations)
+
+
+# ---------- Snapshot ----------
+DEFAULT_SNAPSHOT_TTL_S = float(os.getenv("STATION_SNAPSHOT_TTL_S", "60"))
+
+
+def stations_fingerprint(session, station_model, charger_model) -> Tuple:
+    """
+    One cheap aggregate query that changes whenever stations or chargers are
+    added or removed, a station moves, a charger's power changes or a charger
+    moves to another station. Latitude and longitude are summed separately and
+    squared, so moves that cancel out in one sum still show; power weighted by
+    its station's coordinates ties chargers to stations. Renames, and edits
+    that keep every sum (e.g. two stations with identical chargers swapping
+    places), do not show up; use StationSnapshot.invalidate() for those.
+    """
+    s, c = station_model, charger_model
+    linked = (c.power_kw * s.latitude, c.power_kw * s.longitude)
+    row = session.execute(select(
+        select(func.count(s.station_id)).scalar_subquery(),
+        select(func.max(s.station_id)).scalar_subquery(),
+        select(func.coalesce(func.sum(s.latitude), 0.0)).scalar_subquery(),
+        select(func.coalesce(func.sum(s.longitude), 0.0)).scalar_subquery(),
+        select(func.coalesce(func.sum(s.latitude * s.latitude + s.longitude * s.longitude), 0.0)).scalar_subquery(),
+        select(func.count(c.charger_id)).scalar_subquery(),
+        select(func.coalesce(func.sum(c.power_kw), 0.0)).scalar_subquery(),
+        *(
+            select(func.coalesce(func.sum(term), 0.0)).select_from(c).join(s, c.station_id == s.station_id)
+            .scalar_subquery()
+            for term in linked
+        ),
+    )).one()
+    return (int(row[0]), row[1], *(round(float(v), 6) for v in row[2:5]), int(row[5]),
+            *(round(float(v), 3) for v in row[6:]))
+
+
+class StationSnapshot:
+    """
+    Process-level cache of the loaded StationSet.
+
+    Within ttl_s of the last check the cached set is returned without touching
+    the DB. After that the fingerprint query runs and the full load only
+    happens when the fingerprint differs. invalidate() forces a reload on the
+    next get().
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], Iterable[Any]],
+        fingerprint: Callable[[], Hashable],
+        ttl_s: float = DEFAULT_SNAPSHOT_TTL_S,
+    ):
+        self._loader = loader
+        self._fingerprint = fingerprint
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._stations: Optional[StationSet] = None
+        self._fp: Optional[Hashable] = None
+        self._checked_at = float("-inf")
+        self._loaded_at = float("-inf")
+        self.hits = 0
+        self.checks = 0
+        self.loads = 0
+
+    def get(self) -> StationSet:
+        with self._lock:
+            now = time.monotonic()
+            if self._stations is not None and now - self._checked_at < self.ttl_s:
+                self.hits += 1
+                return self._stations
+
+            self.checks += 1
+            fp = self._fingerprint()
+            if self._stations is None or fp != self._fp:
+                self._stations = StationSet(self._loader())
+                self._fp = fp
+                self._loaded_at = now
+                self.loads += 1
+            self._checked_at = now
+            return self._stations
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._fp = None
+            self._checked_at = float("-inf")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stations": len(self._stations) if self._stations is not None else 0,
+                "age_s": round(time.monotonic() - self._loaded_at, 1) if self._stations is not None else None,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "checks": self.checks,
+                "loads": self.loads,
+            }
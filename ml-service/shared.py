@@ -0,0 +1,70 @@
+# ml-service/shared.py
+"""
+Objects both entry points serve from: app.py (Flask) and asgi.py (FastAPI).
+
+Nothing is built at import: no planner or route cache, no model file read,
+no threads. Each getter builds its object on first call, after the entry
+point has loaded .env. So asgi.py can share the planner setup without
+importing app.py and starting the Flask app's own workers (its activity
+MicroBatcher thread, the batch pool).
+"""
+import os
+import threading
+from typing import Optional
+
+from flask import Flask
+
+from enhanced_ev_planner import EnhancedEVPlanner
+from models import db
+from services.activity import ACTIVITY_MODEL_PATH, ActivityModel
+
+_lock = threading.Lock()
+_planner: Optional[EnhancedEVPlanner] = None
+_activity_model: Optional[ActivityModel] = None
+_activity_loaded = False
+_db_app: Optional[Flask] = None
+
+
+def _pg_uri():
+    host = os.getenv("POSTGRES_HOST", "localhost")
+    port = os.getenv("POSTGRES_PORT", "5432")
+    dbn  = os.getenv("POSTGRES_DB", "ampora")
+    usr  = os.getenv("POSTGRES_USER", "ampora_user")
+    pwd  = os.getenv("POSTGRES_PASSWORD", "a")
+    return f"postgresql+psycopg2://{usr}:{pwd}@{host}:{port}/{dbn}"
+
+
+def init_db(app: Flask) -> None:
+    """Bind Flask-SQLAlchemy (models.db) to app; DATABASE_URL (any SQLAlchemy URL) overrides the POSTGRES_* settings."""
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL") or _pg_uri()
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+
+
+def get_db_app() -> Flask:
+    """A bare Flask app bound to the station DB, for app_context() outside the Flask service."""
+    global _db_app
+    with _lock:
+        if _db_app is None:
+            _db_app = Flask("ampora-db")
+            init_db(_db_app)
+        return _db_app
+
+
+def get_planner() -> EnhancedEVPlanner:
+    """Process-wide OSRM planner (route cache, station snapshot, coalescing)."""
+    global _planner
+    with _lock:
+        if _planner is None:
+            _planner = EnhancedEVPlanner(max_station_distance_km=5)  # 5km band from route polyline
+        return _planner
+
+
+def get_activity_model() -> Optional[ActivityModel]:
+    """Activity model from model/model.ipynb, loaded once; None while ACTIVITY_MODEL_PATH does not exist."""
+    global _activity_model, _activity_loaded
+    with _lock:
+        if not _activity_loaded:
+            _activity_model = ActivityModel.load() if os.path.exists(ACTIVITY_MODEL_PATH) else None
+            _activity_loaded = True
+        return _activity_model
@@ -0,0 +1,225 @@
+# ml-service/train_activity_model.py
+"""
+Train the activity model headless, sweeping forest sizes and depths.
+
+    python train_activity_model.py --data model/ev_activity_data_v2.parquet \\
+        --n-estimators 50,100,200 --max-depth 8,12,16 --n-jobs 8 --budget-ms 20
+
+Same recipe as model/model.ipynb: an 80/20 split with random_state 42, and
+Pipeline(encode_features -> MultiOutputClassifier(RandomForestClassifier)).
+Fitting runs in parallel, across labels and across the trees within each
+label. Fixed seeds give the same trees at any --n-jobs. Each variant's
+record holds:
+- test-split accuracy and hamming loss
+- fit time
+- single-row and batched latency through ActivityModel.predict (serial, with
+  no lookup table, so this is the cost of a table miss in one worker), on the
+  pickled pipeline or, with --serving flat, on the exported flat artifact
+- pickled size
+
+The variant with the best accuracy whose single-row p99 fits --budget-ms
+(any variant without a budget) is saved to --out in the notebook's package
+format, with its training settings and metrics under "training". Rebuild the
+lookup table (build_activity_table.py) and the flat artifact
+(export_activity_model.py) after replacing the served model.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, hamming_loss
+from sklearn.model_selection import train_test_split
+from sklearn.multioutput import MultiOutputClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, MultiLabelBinarizer
+
+from services.activity import DAYS, MONTHS, ActivityModel, _file_sha256, encode_features, load_dataset
+from services.forest import export_forest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_PATH = os.path.join(HERE, "model", "ev_activity_data_v2.csv")
+MODEL_PATH = os.path.join(HERE, "model", "ev_recommendation_model.pkl")
+TEST_SIZE = 0.2
+SPLIT_SEED = 42
+FOREST_SEED = 42
+
+
+def split_jobs(n_jobs: int, n_labels: int):
+    """(jobs across labels, jobs across trees) using at most n_jobs cores in total."""
+    n_jobs = (os.cpu_count() or 1) if n_jobs < 0 else max(1, n_jobs)
+    outer = min(n_jobs, n_labels)
+    return outer, max(1, n_jobs // outer)
+
+
+def build_pipeline(n_estimators: int, max_depth: int, n_jobs: int = 1, n_labels: int = 1) -> Pipeline:
+    outer, inner = split_jobs(n_jobs, n_labels)
+    forest = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=FOREST_SEED,
+                                    n_jobs=inner)
+    return Pipeline([
+        ("transformer", FunctionTransformer(encode_features)),
+        ("classifier", MultiOutputClassifier(forest, n_jobs=outer)),
+    ])
+
+
+def serial(pipeline: Pipeline) -> Pipeline:
+    """Fitted pipeline set to predict in the calling thread, as a serving worker does."""
+    classifier = pipeline.steps[-1][1]
+    classifier.n_jobs = None
+    for forest in [classifier.estimator, *classifier.estimators_]:
+        forest.n_jobs = None
+    return pipeline
+
+
+def package(pipeline: Pipeline, labels, training=None):
+    """The notebook's model package."""
+    mlb = MultiLabelBinarizer(classes=labels).fit([labels])
+    return {"pipeline": pipeline, "mlb": mlb, "target_names": mlb.classes_, "training": training or {}}
+
+
+def serving_rows(X):
+    """Dataset rows as parse_activity_row returns them."""
+    F = encode_features(X)
+    return [
+        {"charging_time": float(ct), "total_minutes": int(minutes), "day": DAYS[day], "month": MONTHS[month],
+         "is_festival": int(festival), "is_weekend": int(weekend)}
+        for ct, festival, weekend, minutes, day, month in zip(
+            F["charging_time"], F["is_festival"], F["is_weekend"], F["total_minutes"], F["day_code"], F["month_code"])
+    ]
+
+
+def served(pkg, serving: str, out_dir: str) -> ActivityModel:
+    """The model as the service would load it in the given format."""
+    model = ActivityModel.from_package(pkg)
+    if serving == "pickle":
+        return model
+    export_forest(model.classifier, out_dir, extra={"labels": model.labels, "columns": model.columns,
+                                                    "source_sha256": "", "encoding": model.encoding})
+    return ActivityModel.load(out_dir, table_path=None)
+
+
+def latency(model: ActivityModel, rows, single_runs: int, batch_rows: int, batch_runs: int):
+    single = []
+    for row in rows[:single_runs]:
+        t0 = time.perf_counter()
+        model.predict([row])
+        single.append((time.perf_counter() - t0) * 1000)
+    batch = rows[:batch_rows]
+    batched = []
+    for _ in range(batch_runs):
+        t0 = time.perf_counter()
+        model.predict(batch)
+        batched.append((time.perf_counter() - t0) * 1000)
+    return {
+        "single_p50_ms": round(float(np.percentile(single, 50)), 2),
+        "single_p99_ms": round(float(np.percentile(single, 99)), 2),
+        "batch_rows": len(batch),
+        "batch_ms": round(float(np.median(batched)), 2),
+        "batch_us_per_row": round(float(np.median(batched)) * 1000 / len(batch), 1),
+    }
+
+
+def _ints(text: str):
+    return [int(v) for v in text.split(",") if v]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--data", default=DATA_PATH, help="model/dataset.py output: .csv, .parquet or .arrow")
+    ap.add_argument("--n-estimators", type=_ints, default=[50, 100, 200])
+    ap.add_argument("--max-depth", type=_ints, default=[8, 12, 16])
+    ap.add_argument("--n-jobs", type=int, default=-1, help="cores for fitting; -1 for all")
+    ap.add_argument("--budget-ms", type=float, default=None, help="single-row p99 latency budget")
+    ap.add_argument("--serving", choices=["pickle", "flat"], default="pickle",
+                    help="model format the latencies are measured on")
+    ap.add_argument("--latency-rows", type=int, default=200, help="single-row predictions timed per variant")
+    ap.add_argument("--batch-rows", type=int, default=1000)
+    ap.add_argument("--out", default=MODEL_PATH, help="where the chosen model is saved")
+    ap.add_argument("--report", default=None, help="also write the sweep as JSON here")
+    ap.add_argument("--dry-run", action="store_true", help="sweep and report without saving a model")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    X, y, labels = load_dataset(args.data)
+    load_s = time.perf_counter() - t0
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=SPLIT_SEED)
+    test_rows = serving_rows(X_test.head(max(args.latency_rows, args.batch_rows)))
+    print(f"{args.data}: {len(X):,} rows ({len(X_train):,} train), {len(labels)} labels, loaded in {load_s:.2f}s")
+
+    def within_budget(r):
+        return args.budget_ms is None or r["single_p99_ms"] <= args.budget_ms
+
+    def rank(r):
+        return r["accuracy"], -r["single_p99_ms"]
+
+    with tempfile.TemporaryDirectory(prefix="train_activity_") as tmp:
+        results = []
+        best, best_package = None, None
+        print(f"{'trees':>5} {'depth':>5} {'fit s':>6} {'accuracy':>8} {'hamming':>7} {'1-row p50':>9} "
+              f"{'1-row p99':>9} {'batch ms':>8} {'us/row':>6} {'size MB':>7}")
+        for n_estimators in args.n_estimators:
+            for max_depth in args.max_depth:
+                pipeline = build_pipeline(n_estimators, max_depth, args.n_jobs, len(labels))
+                t0 = time.perf_counter()
+                pipeline.fit(X_train, y_train)
+                fit_s = time.perf_counter() - t0
+                serial(pipeline)
+
+                y_pred = pipeline.predict(X_test)
+                params = {"n_estimators": n_estimators, "max_depth": max_depth}
+                pkg = package(pipeline, labels, {"params": params})
+                buf = io.BytesIO()
+                joblib.dump(pkg, buf)
+                result = {
+                    **params,
+                    "fit_s": round(fit_s, 2),
+                    "accuracy": round(float(accuracy_score(y_test, y_pred)), 4),
+                    "hamming_loss": round(float(hamming_loss(y_test, y_pred)), 4),
+                    **latency(served(pkg, args.serving, os.path.join(tmp, f"{n_estimators}x{max_depth}")),
+                              test_rows, args.latency_rows, args.batch_rows, 5),
+                    "size_mb": round(buf.tell() / 1e6, 1),
+                }
+                results.append(result)
+                if within_budget(result) and (best is None or rank(result) > rank(best)):
+                    best, best_package = result, pkg
+                print(f"{n_estimators:>5} {max_depth:>5} {result['fit_s']:>6.1f} {result['accuracy']:>8.4f} "
+                      f"{result['hamming_loss']:>7.4f} {result['single_p50_ms']:>9.2f} {result['single_p99_ms']:>9.2f} "
+                      f"{result['batch_ms']:>8.1f} {result['batch_us_per_row']:>6.1f} {result['size_mb']:>7.1f}",
+                      flush=True)
+
+    report = {
+        "data": os.path.abspath(args.data),
+        "data_sha256": _file_sha256(args.data),
+        "rows": len(X),
+        "test_size": TEST_SIZE,
+        "split_seed": SPLIT_SEED,
+        "forest_seed": FOREST_SEED,
+        "n_jobs": args.n_jobs,
+        "serving": args.serving,
+        "budget_ms": args.budget_ms,
+        "results": results,
+        "chosen": best,
+    }
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if best is None:
+        sys.exit(f"No variant has a single-row p99 within {args.budget_ms} ms; nothing saved")
+
+    print(f"Chosen: {best['n_estimators']} trees, depth {best['max_depth']} "
+          f"(accuracy {best['accuracy']}, single-row p99 {best['single_p99_ms']} ms)")
+    if args.dry_run:
+        return
+    best_package["training"] = {k: v for k, v in report.items() if k != "results"}
+    joblib.dump(best_package, args.out)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()